@@ -19,153 +19,226 @@ const B2_PREFIX = process.env.B2_S3_PREFIX || 'ai-generated/'
  * Webhook endpoint for Modal to report generation results
  * 
  * POST /api/generate/webhook
- * Body:
+ * JSON body:
  * {
  *   job_id: string,
  *   status: 'completed' | 'failed',
- *   image_base64?: string,  // base64 encoded PNG
+ *   image_base64?: string,  // base64 encoded image (PNG unless content_type says otherwise)
+ *   content_type?: string,  // image/png (default), image/webp or image/jpeg
  *   error?: string,
  *   processing_time_ms?: number,
  *   metadata?: object
  * }
+ *
+ * Or multipart/form-data (TENKAIGEN_WEBHOOK_TRANSPORT=multipart on Modal):
+ *   payload: the JSON body above without image_base64
+ *   image:   the raw PNG file
+ *
+ * When the worker uploaded the image itself, image_base64 is replaced by
+ *   object_key, size_bytes, sha256, content_type
+ * and this route only records the result.
+ *
+ * Small status updates may arrive batched as { updates: [body, ...] }; each is
+ * handled on its own and the response lists one result per update.
+ *
+ * Modal retries failed deliveries with an Idempotency-Key header, so a result
+ * for a job that is already completed is acknowledged without re-uploading,
+ * and a late failure never overwrites a completed job.
  */
-export async function POST(req: NextRequest) {
-  try {
-    const body = await req.json()
-    const {
-      job_id,
-      status,
-      image_base64,
-      error,
-      processing_time_ms,
-      metadata
-    } = body
-
-    console.log(`[webhook] Received result for job ${job_id}, status: ${status}`)
-
-    if (!job_id || !status) {
-      return NextResponse.json(
-        { error: 'job_id and status are required' },
-        { status: 400 }
-      )
-    }
+async function parseWebhookBody(req: NextRequest) {
+  const contentType = req.headers.get('content-type') || ''
+  if (contentType.includes('multipart/form-data')) {
+    const form = await req.formData()
+    const payload = JSON.parse(String(form.get('payload') || '{}'))
+    const image = form.get('image')
+    const imageBuffer = image && typeof image !== 'string'
+      ? Buffer.from(await image.arrayBuffer())
+      : null
+    return { ...payload, imageBuffer }
+  }
+  const body = await req.json()
+  const imageBuffer = body.image_base64 ? Buffer.from(body.image_base64, 'base64') : null
+  return { ...body, imageBuffer }
+}
 
-    const supabase = await createServiceClient()
+type WebhookUpdate = {
+  job_id?: string
+  status?: string
+  imageBuffer?: Buffer | null
+  object_key?: string
+  size_bytes?: number
+  sha256?: string
+  content_type?: string
+  error?: string
+  processing_time_ms?: number
+  metadata?: Record<string, unknown>
+}
+
+type UpdateOutcome = { status: number; body: Record<string, unknown> }
+
+async function handleUpdate(
+  supabase: Awaited<ReturnType<typeof createServiceClient>>,
+  update: WebhookUpdate
+): Promise<UpdateOutcome> {
+  const {
+    job_id,
+    status,
+    imageBuffer,
+    object_key,
+    size_bytes,
+    sha256,
+    content_type,
+    error,
+    processing_time_ms,
+    metadata
+  } = update
+
+  console.log(`[webhook] Received result for job ${job_id}, status: ${status}`)
+
+  if (!job_id || !status) {
+    return { status: 400, body: { error: 'job_id and status are required' } }
+  }
+
+  if (status === 'completed' && (imageBuffer || object_key)) {
+    // Upload image to B2 Storage
+    try {
+      // Fetch job to get user_id
+      const { data: job } = await supabase
+        .from('generation_jobs')
+        .select('user_id, status, result_url')
+        .eq('id', job_id)
+        .single()
+
+      if (!job) {
+        console.error(`[webhook] Job ${job_id} not found`)
+        return { status: 404, body: { error: 'Job not found' } }
+      }
+
+      if (job.status === 'completed' && job.result_url) {
+        // Retried delivery of a result we already stored
+        return { status: 200, body: { success: true, result_url: job.result_url, duplicate: true } }
+      }
+
+      let key: string
+      if (object_key) {
+        // Already uploaded by the Modal worker
+        key = object_key
+      } else {
+        // Upload to B2: ai-generated/{user_id}/{job_id}.{png|webp|jpeg}
+        const mime = content_type || 'image/png'
+        key = `${B2_PREFIX}${job.user_id}/${job_id}.${mime.split('/')[1] || 'png'}`
 
-    if (status === 'completed' && image_base64) {
-      // Upload image to B2 Storage
-      try {
-        // Fetch job to get user_id
-        const { data: job } = await supabase
-          .from('generation_jobs')
-          .select('user_id')
-          .eq('id', job_id)
-          .single()
-
-        if (!job) {
-          console.error(`[webhook] Job ${job_id} not found`)
-          return NextResponse.json(
-            { error: 'Job not found' },
-            { status: 404 }
-          )
-        }
-
-        // Decode base64 image
-        const imageBuffer = Buffer.from(image_base64, 'base64')
-        
-        // Upload to B2: ai-generated/{user_id}/{job_id}.png
-        const key = `${B2_PREFIX}${job.user_id}/${job_id}.png`
-        
         const uploadCommand = new PutObjectCommand({
           Bucket: B2_BUCKET,
           Key: key,
-          Body: imageBuffer,
-          ContentType: 'image/png',
+          Body: imageBuffer || undefined,
+          ContentType: mime,
           CacheControl: 'public, max-age=31536000', // Cache for 1 year
         })
 
         await s3Client.send(uploadCommand)
-
-        // Construct public URL
-        const result_url = `${process.env.B2_S3_ENDPOINT}/${B2_BUCKET}/${key}`
-
-        // Update job with success
-        const { error: updateError } = await supabase
-          .from('generation_jobs')
-          .update({
-            status: 'completed',
-            result_url,
-            completed_at: new Date().toISOString(),
-            processing_time_ms,
-            metadata: metadata || {}
-          })
-          .eq('id', job_id)
-
-        if (updateError) {
-          console.error(`[webhook] Failed to update job ${job_id}:`, updateError)
-          return NextResponse.json(
-            { error: 'Failed to update job' },
-            { status: 500 }
-          )
-        }
-
-        console.log(`[webhook] ✅ Job ${job_id} completed, image uploaded to ${result_url}`)
-        
-        return NextResponse.json({
-          success: true,
-          result_url
-        })
-
-      } catch (err) {
-        console.error(`[webhook] Error processing job ${job_id}:`, err)
-        
-        // Mark job as failed
-        await supabase
-          .from('generation_jobs')
-          .update({
-            status: 'failed',
-            error_message: err instanceof Error ? err.message : 'Failed to process image',
-            completed_at: new Date().toISOString()
-          })
-          .eq('id', job_id)
-
-        return NextResponse.json(
-          { error: 'Failed to process image' },
-          { status: 500 }
-        )
       }
 
-    } else if (status === 'failed') {
-      // Update job with failure
+      // Construct public URL
+      const result_url = `${process.env.B2_S3_ENDPOINT}/${B2_BUCKET}/${key}`
+
+      // Update job with success
       const { error: updateError } = await supabase
         .from('generation_jobs')
         .update({
-          status: 'failed',
-          error_message: error || 'Generation failed',
+          status: 'completed',
+          result_url,
           completed_at: new Date().toISOString(),
-          processing_time_ms
+          processing_time_ms,
+          metadata: object_key
+            ? { ...(metadata || {}), object_key, size_bytes, sha256 }
+            : (metadata || {})
         })
         .eq('id', job_id)
 
       if (updateError) {
         console.error(`[webhook] Failed to update job ${job_id}:`, updateError)
-        return NextResponse.json(
-          { error: 'Failed to update job' },
-          { status: 500 }
-        )
+        return { status: 500, body: { error: 'Failed to update job' } }
       }
 
-      console.log(`[webhook] ❌ Job ${job_id} failed: ${error}`)
-      
-      return NextResponse.json({ success: true })
+      console.log(`[webhook] ✅ Job ${job_id} completed, image uploaded to ${result_url}`)
+
+      return { status: 200, body: { success: true, result_url } }
+
+    } catch (err) {
+      console.error(`[webhook] Error processing job ${job_id}:`, err)
 
-    } else {
+      // Mark job as failed
+      await supabase
+        .from('generation_jobs')
+        .update({
+          status: 'failed',
+          error_message: err instanceof Error ? err.message : 'Failed to process image',
+          completed_at: new Date().toISOString()
+        })
+        .eq('id', job_id)
+
+      return { status: 500, body: { error: 'Failed to process image' } }
+    }
+
+  } else if (status === 'failed') {
+    const { data: job } = await supabase
+      .from('generation_jobs')
+      .select('status')
+      .eq('id', job_id)
+      .single()
+
+    if (job?.status === 'completed') {
+      // A late or replayed failure must not overwrite a finished job
+      return { status: 200, body: { success: true, duplicate: true } }
+    }
+
+    // Update job with failure
+    const { error: updateError } = await supabase
+      .from('generation_jobs')
+      .update({
+        status: 'failed',
+        error_message: error || 'Generation failed',
+        completed_at: new Date().toISOString(),
+        processing_time_ms
+      })
+      .eq('id', job_id)
+
+    if (updateError) {
+      console.error(`[webhook] Failed to update job ${job_id}:`, updateError)
+      return { status: 500, body: { error: 'Failed to update job' } }
+    }
+
+    console.log(`[webhook] ❌ Job ${job_id} failed: ${error}`)
+
+    return { status: 200, body: { success: true } }
+
+  } else {
+    return { status: 400, body: { error: 'Invalid status or missing image data' } }
+  }
+}
+
+export async function POST(req: NextRequest) {
+  try {
+    const parsed = await parseWebhookBody(req)
+    const supabase = await createServiceClient()
+
+    if (Array.isArray(parsed.updates)) {
+      // Batched status updates: handle each, fail the request only if any needs a retry
+      const outcomes: UpdateOutcome[] = []
+      for (const update of parsed.updates as WebhookUpdate[]) {
+        outcomes.push(await handleUpdate(supabase, update))
+      }
+      const retryable = outcomes.some((o) => o.status >= 500)
       return NextResponse.json(
-        { error: 'Invalid status or missing image data' },
-        { status: 400 }
+        { success: !retryable, results: outcomes.map((o) => ({ status: o.status, ...o.body })) },
+        { status: retryable ? 500 : 200 }
       )
     }
 
+    const outcome = await handleUpdate(supabase, parsed)
+    return NextResponse.json(outcome.body, { status: outcome.status })
+
   } catch (e) {
     console.error('[webhook] error', e)
     return NextResponse.json(
@@ -174,4 +247,3 @@ export async function POST(req: NextRequest) {
     )
   }
 }
-
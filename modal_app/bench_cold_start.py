@@ -0,0 +1,150 @@
+"""
+Benchmark: container cold start, split into the snapshot (cpu) and restore (gpu) stages
+
+Stub mode runs each start in a fresh interpreter so import costs are real, and
+walks the same two stages as QwenGenerator: the cpu stage (imports + building
+the pipeline in host memory, what a memory snapshot captures) and the gpu stage
+(device copy, worker threads, warm-up; what still runs after a restore). The
+stub sleeps stand in for weight loading and the device copy.
+
+Remote mode reads the startup report from a deployed QwenGenerator via
+`stats()`, which is the same StartupTimer report, e.g. to compare a deploy
+with QWEN_MEMORY_SNAPSHOT=1 against one with it disabled.
+
+Usage:
+    python modal_app/bench_cold_start.py --runs 5 --load-delay 2.0 --transfer-delay 0.5
+    python modal_app/bench_cold_start.py --remote --runs 3
+
+Stub mode requires Pillow (in the Modal image); remote mode requires modal.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def stub_start(load_delay: float, transfer_delay: float, step_delay: float) -> dict:
+    """One container start with the stub pipeline; runs in a child process."""
+    from qwen_runtime.startup import StartupTimer
+
+    timer = StartupTimer()
+    with timer.stage("cpu"):
+        with timer.phase("import"):
+            from PIL import Image  # noqa: F401  (encoding dependency, imported by the real start too)
+            from qwen_runtime.batching import GenerationJob, MicroBatcher, run_batch
+            from qwen_runtime.encoding import EncoderPool
+            from qwen_runtime.metrics import PipelineMetrics
+            from qwen_runtime.stub_pipeline import StubQwenPipeline
+        with timer.phase("weight_load"):
+            pipe = StubQwenPipeline(
+                step_delay_s=step_delay,
+                load_delay_s=load_delay,
+                transfer_delay_s=transfer_delay,
+            )
+
+    with timer.stage("gpu"):
+        with timer.phase("placement"):
+            pipe.to("cuda")
+        metrics = PipelineMetrics()
+        encoder = EncoderPool(metrics=metrics)
+
+        def run_jobs(batch):
+            return run_batch(
+                pipe,
+                batch,
+                use_nunchaku=True,
+                enhance_prompt=lambda prompt, style: prompt,
+                max_batch_size=2,
+                generator_factory=lambda seed: seed,
+                encoder=encoder,
+                metrics=metrics,
+            )
+
+        batcher = MicroBatcher(run_jobs)
+        with timer.phase("warmup"):
+            job = GenerationJob(prompt="warm-up", width=256, height=256, num_inference_steps=1, seed=0)
+            batcher.submit(job).result()
+
+    batcher.close()
+    encoder.shutdown()
+    return timer.report()
+
+
+def run_stub(runs: int, load_delay: float, transfer_delay: float, step_delay: float) -> list:
+    reports = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [
+                sys.executable, __file__, "--child",
+                "--load-delay", str(load_delay),
+                "--transfer-delay", str(transfer_delay),
+                "--step-delay", str(step_delay),
+            ],
+            cwd=HERE, capture_output=True, text=True, check=True,
+        )
+        reports.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return reports
+
+
+def run_remote(runs: int) -> list:
+    import modal
+
+    generator = modal.Cls.from_name("tenkaigen-qwen-generator", "QwenGenerator")()
+    return [generator.stats.remote()["startup"] for _ in range(runs)]
+
+
+def summarize(reports: list) -> dict:
+    def median(values):
+        return round(statistics.median(values), 3) if values else None
+
+    stages = sorted({name for r in reports for name in r.get("stages_s", {})})
+    phases = sorted({name for r in reports for name in r.get("phases_s", {})})
+    cold = [r["total_s"] for r in reports]
+    restored = [r["stages_s"]["gpu"] for r in reports if "gpu" in r.get("stages_s", {})]
+    return {
+        "runs": len(reports),
+        "median_cold_start_s": median(cold),
+        # With a memory snapshot only the gpu stage runs on restore
+        "median_restore_start_s": median(restored),
+        "median_stages_s": {n: median([r["stages_s"][n] for r in reports if n in r.get("stages_s", {})]) for n in stages},
+        "median_phases_s": {n: median([r["phases_s"][n] for r in reports if n in r.get("phases_s", {})]) for n in phases},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--load-delay", type=float, default=2.0, help="Stub weight-load seconds (cpu stage)")
+    parser.add_argument("--transfer-delay", type=float, default=0.5, help="Stub device-copy seconds (gpu stage)")
+    parser.add_argument("--step-delay", type=float, default=0.05, help="Stub seconds per denoising step")
+    parser.add_argument("--remote", action="store_true", help="Read startup reports from the deployed app")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="Print raw reports as JSON")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(stub_start(args.load_delay, args.transfer_delay, args.step_delay)))
+        return
+
+    if args.remote:
+        reports = run_remote(args.runs)
+    else:
+        reports = run_stub(args.runs, args.load_delay, args.transfer_delay, args.step_delay)
+
+    summary = summarize(reports)
+    if args.json:
+        print(json.dumps({"summary": summary, "reports": reports}, indent=2))
+        return
+    print(f"{'run':>4} {'cpu_s':>8} {'gpu_s':>8} {'total_s':>8}")
+    for i, r in enumerate(reports):
+        st = r.get("stages_s", {})
+        print(f"{i:>4} {st.get('cpu', 0):>8.3f} {st.get('gpu', 0):>8.3f} {r['total_s']:>8.3f}")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
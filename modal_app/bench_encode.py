@@ -0,0 +1,96 @@
+"""
+Benchmark: output encoder settings
+
+Encodes representative design images (1024x1024 and 1664x928) with each
+candidate EncodeOptions setting and reports median encode time and output size,
+so the default in QWEN_OUTPUT_ENCODING can be picked from data.
+
+Usage:
+    python modal_app/bench_encode.py --repeat 5
+    python modal_app/bench_encode.py --json > encode.json
+
+Requires Pillow (in the Modal image).
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from qwen_runtime.encoding import EncodeOptions, encode_image
+
+SIZES = [(1024, 1024), (1664, 928)]
+
+SETTINGS = {
+    "png-optimize (legacy)": EncodeOptions(format="png", compress_level=None, optimize=True),
+    "png-l1": EncodeOptions(format="png", compress_level=1),
+    "png-l3": EncodeOptions(format="png", compress_level=3),
+    "png-l6 (default)": EncodeOptions(format="png", compress_level=6),
+    "png-l9": EncodeOptions(format="png", compress_level=9),
+    "webp-lossless-m0": EncodeOptions(format="webp", lossless=True, compress_level=0, quality=0),
+    "webp-lossless-m4": EncodeOptions(format="webp", lossless=True, compress_level=4),
+    "webp-q90-m4": EncodeOptions(format="webp", compress_level=4, quality=90),
+    "jpeg-q95": EncodeOptions(format="jpeg", quality=95),
+}
+
+
+def representative_image(width: int, height: int):
+    """
+    Print-style design: white background, a smooth painted subject and some
+    flat vector shapes with hard edges
+    """
+    from PIL import Image, ImageDraw
+
+    canvas = Image.new("RGB", (width, height), (255, 255, 255))
+    sub_w, sub_h = width * 2 // 3, height * 2 // 3
+    small = (max(1, sub_w // 16), max(1, sub_h // 16))
+    blob = Image.frombytes("RGB", small, os.urandom(small[0] * small[1] * 3))
+    blob = blob.resize((sub_w, sub_h), Image.BICUBIC)
+    canvas.paste(blob, ((width - sub_w) // 2, (height - sub_h) // 2))
+    draw = ImageDraw.Draw(canvas)
+    for i in range(12):
+        x = (i * width) // 12
+        draw.rectangle([x, height - height // 8, x + width // 24, height - 8], fill=(20 * i, 40, 200 - 10 * i))
+        draw.ellipse([x, 8, x + width // 20, 8 + width // 20], outline=(0, 0, 0), width=4)
+    return canvas
+
+
+def run(repeat: int) -> list:
+    rows = []
+    for width, height in SIZES:
+        image = representative_image(width, height)
+        for name, options in SETTINGS.items():
+            timings = []
+            size = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                size = len(encode_image(image, options))
+                timings.append((time.perf_counter() - start) * 1000)
+            rows.append({
+                "size": f"{width}x{height}",
+                "setting": name,
+                "options": options.to_dict(),
+                "encode_ms": round(statistics.median(timings), 1),
+                "bytes": size,
+            })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Emit JSON instead of a table")
+    args = parser.parse_args()
+
+    rows = run(args.repeat)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"📊 Encoder benchmark (median of {args.repeat})")
+    for row in rows:
+        print(f"   {row['size']:<10} {row['setting']:<24} {row['encode_ms']:>8} ms {row['bytes']:>10} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmark: the generator end to end over a fixed prompt corpus
+
+Runs the corpus in qwen_runtime.benchmark at every (steps, size) combination
+and reports per-config latency p50/p95/p99, images per hour, peak VRAM, host
+RSS, and image and webhook-body bytes as JSON that can be diffed between
+commits (--out, and --baseline to print the changes against an earlier run).
+
+Stub mode (the default) runs in this process against StubQwenPipeline with
+the container's encoder pool, so orchestration, encoding and transport costs
+can be compared on a CPU-only box. --remote runs the same matrix on the
+deployed QwenGenerator, once per --backends x --placements combination; each
+combination gets its own container via `with_options` (ENABLE_NUNCHAKU and
+QWEN_PLACEMENT set through a secret), and every row records the backend and
+placement the container actually loaded, so a fallback shows up in the diff.
+
+Usage:
+    python modal_app/bench_generator.py --steps 4,8 --sizes 1664x928,1024x1024
+    python modal_app/bench_generator.py --stub-step-delay 0.05 --out bench.json
+    python modal_app/bench_generator.py --remote --backends nunchaku,standard --steps default \\
+        --placements auto,model_offload --out gpu.json --baseline gpu-main.json
+
+Stub mode requires Pillow (in the Modal image); remote mode requires modal
+and a deployed app.
+"""
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+from typing import List, Optional
+
+from qwen_runtime.benchmark import CORPUS, CORPUS_VERSION, compare, make_configs, parse_sizes, parse_steps, run_matrix
+
+BACKEND_ENV = {"nunchaku": "1", "standard": "0"}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stub(args, configs: List[dict]) -> List[dict]:
+    from qwen_runtime.batching import run_batch
+    from qwen_runtime.encoding import EncoderPool
+    from qwen_runtime.stub_pipeline import StubQwenPipeline
+
+    pipe = StubQwenPipeline(step_delay_s=args.stub_step_delay, textured=True)
+    encoder = EncoderPool()
+
+    def run_jobs(batch):
+        return run_batch(
+            pipe,
+            batch,
+            use_nunchaku=args.stub_lightning,
+            enhance_prompt=lambda prompt, style: prompt,
+            max_batch_size=args.batch_size,
+            generator_factory=lambda seed: seed,
+            encoder=encoder,
+        )
+
+    try:
+        rows = run_matrix(
+            run_jobs,
+            configs,
+            use_nunchaku=args.stub_lightning,
+            repeats=args.repeats,
+            batch_size=args.batch_size,
+            warmup=args.warmup,
+            encoding=args.encoding,
+        )
+    finally:
+        encoder.shutdown()
+    for row in rows:
+        row.update(backend="stub", placement="cpu")
+    return rows
+
+
+def run_remote(args, configs: List[dict]) -> List[dict]:
+    import modal
+
+    generator_cls = modal.Cls.from_name("tenkaigen-qwen-generator", "QwenGenerator")
+    rows = []
+    for backend in args.backends.split(","):
+        for placement in args.placements.split(","):
+            env = {"ENABLE_NUNCHAKU": BACKEND_ENV[backend]}
+            if placement != "auto":
+                env["QWEN_PLACEMENT"] = placement
+            generator = generator_cls.with_options(secrets=[modal.Secret.from_dict(env)])()
+            report = generator.benchmark.remote(
+                configs,
+                repeats=args.repeats,
+                batch_size=args.batch_size,
+                warmup=args.warmup,
+                encoding=args.encoding,
+            )
+            print(f"🧪 {backend}/{placement}: container loaded {report['backend']}/{report['placement']}", file=sys.stderr)
+            for row in report["rows"]:
+                row["requested"] = f"{backend}/{placement}"
+            rows.extend(report["rows"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", default="4,8", help='Comma-separated step counts; "default" = backend default')
+    parser.add_argument("--sizes", default="1664x928,1024x1024")
+    parser.add_argument("--repeats", type=int, default=1, help="Passes over the corpus per config")
+    parser.add_argument("--batch-size", type=int, default=1, help="Jobs per pipeline call")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured jobs per config")
+    parser.add_argument("--encoding", type=json.loads, default=None, help='Output encoding JSON, e.g. {"format": "webp"}')
+    parser.add_argument("--remote", action="store_true", help="Run on the deployed QwenGenerator")
+    parser.add_argument("--backends", default="nunchaku,standard", help="Remote: nunchaku and/or standard")
+    parser.add_argument("--placements", default="auto", help="Remote: auto or QWEN_PLACEMENT modes, comma-separated")
+    parser.add_argument("--stub-step-delay", type=float, default=0.0, help="Stub seconds per step")
+    parser.add_argument("--stub-lightning", action="store_true", help="Stub: resolve default steps/CFG as Lightning")
+    parser.add_argument("--out", help="Write the report here as well as to stdout")
+    parser.add_argument("--baseline", help="Earlier report to compare against")
+    args = parser.parse_args()
+
+    for backend in args.backends.split(","):
+        if backend not in BACKEND_ENV:
+            parser.error(f"Unknown backend {backend!r}; expected nunchaku or standard")
+
+    configs = make_configs(parse_steps(args.steps), parse_sizes(args.sizes))
+    # Per-image log lines go to stderr so stdout is just the report
+    with contextlib.redirect_stdout(sys.stderr):
+        rows = run_remote(args, configs) if args.remote else run_stub(args, configs)
+    report = {
+        "corpus_version": CORPUS_VERSION,
+        "corpus_size": len(CORPUS),
+        "mode": "remote" if args.remote else "stub",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {
+            "repeats": args.repeats,
+            "batch_size": args.batch_size,
+            "warmup": args.warmup,
+            "encoding": args.encoding,
+            "stub_step_delay_s": None if args.remote else args.stub_step_delay,
+        },
+        "rows": rows,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"📊 Against {args.baseline} ({baseline.get('revision')}):", file=sys.stderr)
+        for change in compare(baseline, report):
+            parts = [
+                f"{field} {d['change']:+.1%}" + ("" if d["better"] is None else (" ✓" if d["better"] else " ✗"))
+                for field, d in change["delta"].items()
+            ]
+            print(f"   {change['backend']}/{change['placement']} {change['steps']} steps {change['size']}: {', '.join(parts)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
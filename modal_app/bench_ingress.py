@@ -0,0 +1,175 @@
+"""
+Benchmark: ingress request throughput with a stubbed spawn
+
+Serves the ingress app (`qwen_runtime.ingress.create_app`) with uvicorn in a
+subprocess on localhost, replacing Modal's spawn with a stub that waits
+--spawn-ms per RPC, then fires requests at it from an httpx client in this
+process. Reports requests/s, jobs/s and client-side latency percentiles.
+
+--blocking makes the stub sleep synchronously inside the handler, which is
+what a plain `.spawn(...)` call does to the event loop; compare it with the
+default async stub to see what blocking I/O costs the container.
+
+Usage:
+    python modal_app/bench_ingress.py --requests 2000 --concurrency 100
+    python modal_app/bench_ingress.py --requests 2000 --concurrency 100 --blocking
+    python modal_app/bench_ingress.py --requests 20 --batch-size 500
+
+Requires fastapi, pydantic, uvicorn and httpx (all in the Modal image).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import socket
+import statistics
+import time
+
+from qwen_runtime.ingress import create_app, job_rows, spawn_many
+
+COLUMNS = ("job_id", "prompt", "style", "width", "height", "seed")
+
+
+class StubSpawn:
+    """Stands in for `Function.spawn` / `Function.spawn_map` with a fixed RPC latency."""
+
+    def __init__(self, function: "StubFunction"):
+        self.function = function
+
+    async def aio(self, *args):
+        self.function.calls += 1
+        if self.function.blocking:
+            time.sleep(self.function.latency_s)
+        else:
+            await asyncio.sleep(self.function.latency_s)
+
+
+class StubFunction:
+    def __init__(self, latency_s: float, blocking: bool, spawn_map: bool):
+        self.latency_s = latency_s
+        self.blocking = blocking
+        self.calls = 0
+        self.spawn = StubSpawn(self)
+        if spawn_map:
+            self.spawn_map = StubSpawn(self)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(port: int, latency_s: float, blocking: bool, spawn_map: bool) -> None:
+    """Server process: the ingress app on a stub spawn, plus a stats route for the bench."""
+    import uvicorn
+
+    function = StubFunction(latency_s, blocking, spawn_map)
+
+    async def dispatch(jobs, submitted_at):
+        await spawn_many(function, job_rows(jobs, COLUMNS))
+
+    # Swallow the per-job log lines
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = create_app(dispatch)
+        app.get("/_bench/stats")(lambda: {"spawn_calls": function.calls})
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def wait_for(url: str, timeout_s: float = 30.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            httpx.get(url).raise_for_status()
+            return
+        except httpx.HTTPError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def job_body(i: int) -> dict:
+    return {"job_id": f"job-{i}", "prompt": f"design {i}", "width": 1664, "height": 928, "seed": i}
+
+
+async def drive(url: str, requests: int, concurrency: int, batch_size: int) -> dict:
+    import httpx
+
+    latencies = []
+    accepted = 0
+    limit = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+        async def one(i: int):
+            nonlocal accepted
+            if batch_size > 1:
+                path, body = "/batch", {"jobs": [job_body(i * batch_size + j) for j in range(batch_size)]}
+            else:
+                path, body = "/", job_body(i)
+            async with limit:
+                start = time.perf_counter()
+                response = await client.post(url + path, json=body)
+                latencies.append(time.perf_counter() - start)
+            data = response.json()
+            accepted += len(data.get("job_ids", [])) if batch_size > 1 else int(data.get("success", False))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall_s = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "jobs_accepted": accepted,
+        "wall_s": round(wall_s, 3),
+        "req_per_s": round(requests / wall_s, 1),
+        "jobs_per_s": round(accepted / wall_s, 1),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "latency_p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=1, help="Jobs per POST /batch; 1 uses POST /")
+    parser.add_argument("--spawn-ms", type=float, default=5.0, help="Simulated spawn RPC latency")
+    parser.add_argument("--blocking", action="store_true", help="Stub spawn blocks the event loop")
+    parser.add_argument("--no-spawn-map", action="store_true", help="Fan batches out with per-job spawns")
+    args = parser.parse_args()
+
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(
+        target=serve,
+        args=(port, args.spawn_ms / 1000.0, args.blocking, not args.no_spawn_map),
+        daemon=True,
+    )
+    server.start()
+    try:
+        wait_for(url + "/")
+        report = asyncio.run(drive(url, args.requests, args.concurrency, args.batch_size))
+        import httpx
+
+        spawn_calls = httpx.get(url + "/_bench/stats").json()["spawn_calls"]
+    finally:
+        server.terminate()
+
+    report.update({
+        "batch_size": args.batch_size,
+        "spawn_ms": args.spawn_ms,
+        "blocking": args.blocking,
+        "spawn_calls": spawn_calls,
+    })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
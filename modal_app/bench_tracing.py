@@ -0,0 +1,109 @@
+"""
+Benchmark: per-job cost of tracing
+
+Runs the same jobs through `run_batch` with a zero-delay stub pipeline (so
+what is left is the Python around the GPU call, step callbacks included),
+once without traces and once with a Trace per job that is serialised and
+exported as a JSON log line, as run_job does. The difference per job is
+the tracing overhead; it is reported next to the stub's --step-delay so it
+can be read against real step times. The last job's span tree is printed.
+
+Usage:
+    python modal_app/bench_tracing.py --jobs 500 --steps 30
+    python modal_app/bench_tracing.py --step-delay 0.01 --steps 8
+
+Requires Pillow (in the Modal image).
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+from typing import Optional
+
+from qwen_runtime.batching import GenerationJob, run_batch
+from qwen_runtime.stub_pipeline import StubQwenPipeline
+from qwen_runtime.tracing import Trace
+
+
+def run(jobs: int, steps: int, size: int, step_delay: float, traced: bool) -> dict:
+    pipe = StubQwenPipeline(step_delay_s=step_delay)
+    # Both modes log the same per-image lines; traced runs add the trace line
+    sink = io.StringIO()
+    last: Optional[dict] = None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sink):
+        last = _jobs(pipe, jobs, steps, size, traced)
+    wall_s = time.perf_counter() - start
+    trace_bytes = sum(len(line) for line in sink.getvalue().splitlines() if line.startswith('{"event":"trace"'))
+    return {
+        "mode": "traced" if traced else "off",
+        "jobs": jobs,
+        "wall_s": round(wall_s, 4),
+        "per_job_us": round(wall_s / jobs * 1e6, 1),
+        "log_bytes_per_job": round(trace_bytes / jobs),
+        "example": last,
+    }
+
+
+def _jobs(pipe: StubQwenPipeline, jobs: int, steps: int, size: int, traced: bool) -> Optional[dict]:
+    last = None
+    for i in range(jobs):
+        trace = Trace("job", job_id=f"bench-{i}") if traced else None
+        job = GenerationJob(
+            prompt=f"bench {i}", width=size, height=size, num_inference_steps=steps, seed=i, trace=trace,
+        )
+        if trace is not None:
+            trace.mark("batched")
+        [future] = run_batch(
+            pipe,
+            [job],
+            use_nunchaku=True,
+            enhance_prompt=lambda prompt, style: prompt,
+            max_batch_size=1,
+            generator_factory=lambda seed: seed,
+            embed_prompts=lambda prompts, negatives: {"prompt": prompts, "negative_prompt": negatives},
+        )
+        result = future.result()
+        if trace is not None:
+            result["metadata"]["trace"] = trace.to_dict()
+            trace.export("json")
+            last = result["metadata"]["trace"]
+    return last
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=30, help="Denoising steps (one span each)")
+    parser.add_argument("--size", type=int, default=64, help="Small keeps encoding from drowning the difference")
+    parser.add_argument("--step-delay", type=float, default=0.0, help="Stub seconds per step")
+    parser.add_argument("--repeat", type=int, default=5, help="Best of N runs per mode")
+    args = parser.parse_args()
+
+    rows = {}
+    # Alternate the modes so warm-up and CPU frequency drift hit both alike
+    for _ in range(args.repeat):
+        for traced in (False, True):
+            row = run(args.jobs, args.steps, args.size, args.step_delay, traced)
+            best = rows.get(row["mode"])
+            if best is None or row["wall_s"] < best["wall_s"]:
+                rows[row["mode"]] = row
+    example = rows["traced"].pop("example")
+    rows["off"].pop("example")
+    overhead_us = rows["traced"]["per_job_us"] - rows["off"]["per_job_us"]
+    report = {
+        "steps": args.steps,
+        "step_delay_s": args.step_delay,
+        "off": rows["off"],
+        "traced": rows["traced"],
+        "overhead_per_job_us": round(overhead_us, 1),
+        "overhead_per_step_us": round(overhead_us / max(1, args.steps), 2),
+        "example_trace": example,
+    }
+    print(f"📊 Tracing overhead ({args.jobs} jobs, {args.steps} steps): {overhead_us:.0f}µs per job")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
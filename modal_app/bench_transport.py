@@ -0,0 +1,118 @@
+"""
+Benchmark: base64-in-JSON vs multipart webhook transport
+
+Builds the exact request body `qwen_runtime.delivery` would send for one
+generated PNG and reports payload bytes, encode time and peak memory for each
+transport. Each mode runs in its own subprocess so peak RSS is not polluted by
+the other mode.
+
+Usage:
+    python modal_app/bench_transport.py --width 1664 --height 928 --repeat 5
+
+Requires Pillow and httpx (both are in the Modal image).
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from qwen_runtime.delivery import WEBHOOK_TRANSPORTS, build_webhook_request
+from qwen_runtime.encoding import EncodeOptions, encode_image
+
+
+def make_png(width: int, height: int) -> bytes:
+    """PNG of a representative design, encoded with the default settings."""
+    from bench_encode import representative_image
+
+    return encode_image(representative_image(width, height), EncodeOptions())
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_child(transport: str, png_path: str, repeat: int) -> dict:
+    import httpx
+
+    with open(png_path, "rb") as f:
+        png = f.read()
+    result_format = "bytes" if transport == "multipart" else "base64"
+    rss_before = _peak_rss_mb()
+
+    timings = []
+    body_len = 0
+    tracemalloc.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Include the generator-side encode so both modes are measured end to end
+        result = {"success": True, "metadata": {"width": 0, "height": 0}}
+        if result_format == "bytes":
+            result["image_bytes"] = png
+        else:
+            result["image_base64"] = base64.b64encode(png).decode("utf-8")
+        kwargs = build_webhook_request("bench-job", result, 0, transport)
+        request = httpx.Request("POST", "http://localhost/webhook", **kwargs)
+        body_len = len(request.read())
+        timings.append((time.perf_counter() - start) * 1000)
+        del result, kwargs, request
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "transport": transport,
+        "png_bytes": len(png),
+        "payload_bytes": body_len,
+        "inflation": round(body_len / len(png), 3),
+        "encode_ms_min": round(min(timings), 2),
+        "encode_ms_mean": round(sum(timings) / len(timings), 2),
+        "traced_peak_mb": round(traced_peak / (1024 * 1024), 2),
+        "rss_growth_mb": round(_peak_rss_mb() - rss_before, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--width", type=int, default=1664)
+    parser.add_argument("--height", type=int, default=928)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", choices=WEBHOOK_TRANSPORTS, help=argparse.SUPPRESS)
+    parser.add_argument("--png", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.png, args.repeat)))
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+        tmp.write(make_png(args.width, args.height))
+        png_path = tmp.name
+    try:
+        rows = []
+        for transport in WEBHOOK_TRANSPORTS:
+            out = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__),
+                "--child", transport, "--png", png_path, "--repeat", str(args.repeat),
+            ])
+            rows.append(json.loads(out.decode().strip().splitlines()[-1]))
+    finally:
+        os.unlink(png_path)
+
+    print(f"📊 Webhook transport benchmark ({args.width}x{args.height}, {args.repeat} runs)")
+    for row in rows:
+        print(
+            f"   {row['transport']:<10} payload {row['payload_bytes']:>10} B "
+            f"(x{row['inflation']})  encode {row['encode_ms_mean']:>7} ms  "
+            f"traced peak {row['traced_peak_mb']:>6} MB  RSS +{row['rss_growth_mb']} MB"
+        )
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
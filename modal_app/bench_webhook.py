@@ -0,0 +1,119 @@
+"""
+Benchmark: webhook delivery against a flaky local stub server
+
+Starts an HTTP server on localhost that fails a share of requests (503, or 429
+with Retry-After), then delivers results and status updates through
+WebhookDeliverer. Reports how many deliveries succeeded, retries, dead-lettered
+requests, batched POSTs, and how many duplicate Idempotency-Keys the server
+saw (which the webhook route ignores).
+
+Usage:
+    python modal_app/bench_webhook.py --jobs 200 --fail-rate 0.3
+    python modal_app/bench_webhook.py --jobs 200 --statuses --batch-ms 20
+
+Requires httpx (in the Modal image).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qwen_runtime.delivery import DeadLetterStore, WebhookDeliverer
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    dead_jobs: set = set()
+    seen: dict = {}
+    posts = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        key = self.headers.get("idempotency-key", "")
+        updates = json.loads(body).get("updates") if body.startswith(b"{") else None
+        keys = [u["idempotency_key"] for u in updates] if updates else [key]
+        with self.lock:
+            type(self).posts += 1
+        if any(k.split(":")[0] in self.dead_jobs for k in keys):
+            self.send_response(400)  # permanent rejection -> dead letter
+        elif random.random() < self.fail_rate:
+            if random.random() < 0.5:
+                self.send_response(503)
+            else:
+                self.send_response(429)
+                self.send_header("Retry-After", "0.01")
+        else:
+            with self.lock:
+                for k in keys:
+                    self.seen[k] = self.seen.get(k, 0) + 1
+            self.send_response(200)
+        self.send_header("content-length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+async def run(jobs: int, statuses: bool, batch_ms: float, image_kb: int, dead_rate: float) -> dict:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/generate/webhook"
+    StubWebhook.dead_jobs = {f"job-{i}" for i in range(jobs) if random.random() < dead_rate}
+
+    dead_dir = tempfile.mkdtemp(prefix="dead-letters-")
+    deliverer = WebhookDeliverer(
+        webhook_url=url,
+        base_delay_s=0.01,
+        max_delay_s=0.2,
+        batch_window_s=batch_ms / 1000.0,
+        dead_letters=DeadLetterStore(dead_dir),
+    )
+    image = base64.b64encode(random.randbytes(image_kb * 1024)).decode()
+
+    async def one(i: int) -> bool:
+        job_id = f"job-{i}"
+        if statuses:
+            result = {"success": False, "error": "Prompt is required"}
+        else:
+            result = {"success": True, "image_base64": image, "content_type": "image/png", "metadata": {}}
+        return await deliverer.deliver(job_id, result, 1000)
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(one(i) for i in range(jobs)))
+    wall_s = time.perf_counter() - start
+    await deliverer.aclose()
+    server.shutdown()
+
+    return {
+        "jobs": jobs,
+        "delivered": sum(outcomes),
+        "wall_s": round(wall_s, 3),
+        "server_posts": StubWebhook.posts,
+        "duplicate_keys": sum(n - 1 for n in StubWebhook.seen.values()),
+        "dead_letter_files": len(DeadLetterStore(dead_dir).pending()),
+        **deliverer.stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="Share of requests answered 503/429")
+    parser.add_argument("--dead-rate", type=float, default=0.02, help="Share of jobs the server always rejects")
+    parser.add_argument("--statuses", action="store_true", help="Send small failure updates instead of images")
+    parser.add_argument("--batch-ms", type=float, default=0.0, help="Status batching window")
+    parser.add_argument("--image-kb", type=int, default=256)
+    args = parser.parse_args()
+
+    StubWebhook.fail_rate = args.fail_rate
+    print(json.dumps(asyncio.run(run(args.jobs, args.statuses, args.batch_ms, args.image_kb, args.dead_rate)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,13 +8,92 @@ import math
 import os
 import base64
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import modal
 
 # Create Modal app
 app = modal.App("tenkaigen-qwen-generator")
 
+# Must match qwen_runtime.startup.NUNCHAKU_MANIFEST_PATH
+NUNCHAKU_MANIFEST_PATH = "/opt/tenkaigen/nunchaku_manifest.json"
+
+
+def bake_nunchaku():
+    """
+    Image build step: install a Nunchaku build matching the baked Torch and record it
+
+    Tries the prebuilt wheels first and only compiles from source (A10G, sm_86)
+    when none of them ships the QwenImage transformer. All of this happens once,
+    at image build time; the container only validates the manifest written here.
+    A failure is recorded in the manifest rather than failing the build, so the
+    standard pipeline can still be deployed.
+    """
+    import json
+    import subprocess
+    import sys
+    from importlib import metadata
+
+    import torch
+
+    def pip(*args, env=None):
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "--no-cache-dir", *args], env=env)
+
+    def has_qwen_transformer() -> bool:
+        check = (
+            "from nunchaku.models.transformers.transformer_qwenimage "
+            "import NunchakuQwenImageTransformer2DModel"
+        )
+        return subprocess.call([sys.executable, "-c", check]) == 0
+
+    torch_version = torch.__version__.split("+")[0]
+    torch_mm = ".".join(torch_version.split(".")[:2])  # e.g., "2.9"
+    py_tag = f"cp{sys.version_info.major}{sys.version_info.minor}"
+    wheels = [
+        # Try newer releases first
+        f"https://github.com/nunchaku-tech/nunchaku/releases/download/v{v}/nunchaku-{v}+torch{torch_mm}-{py_tag}-{py_tag}-linux_x86_64.whl"
+        for v in ("0.3.3", "0.3.2", "0.3.1")
+    ]
+    # Known commit that includes QwenImage transformer
+    nunchaku_commit = "c01772562ab103d4958349250df626696d763d89"
+
+    manifest = {"torch": torch.__version__, "cuda": torch.version.cuda, "python": py_tag}
+    source = None
+    for url in wheels:
+        try:
+            print(f"🔧 Trying Nunchaku wheel: {url}")
+            pip(url)
+        except subprocess.CalledProcessError:
+            continue
+        if has_qwen_transformer():
+            source = url
+            break
+    if source is None:
+        print("⚙️ No wheel ships the Qwen transformer; building Nunchaku from source...")
+        env = os.environ.copy()
+        env["CUDA_HOME"] = env.get("CUDA_HOME", "/usr/local/cuda")
+        env["TORCH_CUDA_ARCH_LIST"] = env.get("TORCH_CUDA_ARCH_LIST", "8.6")
+        env["CUDAARCHS"] = env.get("CUDAARCHS", "86")
+        env["MAX_JOBS"] = env.get("MAX_JOBS", "8")
+        try:
+            pip("--no-build-isolation", f"git+https://github.com/nunchaku-tech/nunchaku.git@{nunchaku_commit}", env=env)
+            if has_qwen_transformer():
+                source = f"git@{nunchaku_commit}"
+        except subprocess.CalledProcessError as e:
+            manifest["error"] = f"source build failed: {e}"
+
+    if source is not None:
+        manifest["source"] = source
+        manifest["nunchaku"] = metadata.version("nunchaku")
+    else:
+        manifest.setdefault("error", "no Nunchaku build with the QwenImage transformer could be installed")
+
+    os.makedirs(os.path.dirname(NUNCHAKU_MANIFEST_PATH), exist_ok=True)
+    with open(NUNCHAKU_MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"📋 Nunchaku manifest: {manifest}")
+
+
 # Define the container image with all dependencies
 # Ensure NumPy is installed BEFORE Nunchaku to satisfy build/import requirements
 image = (
@@ -36,16 +115,21 @@ image = (
         "fastapi[standard]==0.115.4",
         "pydantic==2.10.3",
         "requests==2.32.3",
+        "httpx",
+        "boto3",
         "huggingface_hub",
         "setuptools",
         "wheel",
         "ninja",
     )
-    # Install PyTorch CUDA 12.8 wheels (match runtime GPUs). Install Nunchaku at runtime to match Torch version.
+    # Install PyTorch CUDA 12.8 wheels (match runtime GPUs), then bake the matching Nunchaku build
     .run_commands(
         "python -m pip install --upgrade pip setuptools wheel",
         "python -m pip install torch torchvision --index-url https://download.pytorch.org/whl/cu128",
     )
+    .run_function(bake_nunchaku, timeout=3600)
+    # GPU-free runtime helpers (batching, stub pipeline) shipped alongside this file
+    .add_local_python_source("qwen_runtime")
 )
 
 # GPU configuration - A10G is good balance of performance/cost
@@ -55,128 +139,289 @@ GPU_CONFIG = "A10G"
 model_volume = modal.Volume.from_name("qwen-models", create_if_missing=True)
 MODEL_CACHE_PATH = "/cache/models"
 
+# Concurrent inputs per container; these feed the micro-batcher in QwenGenerator
+MAX_CONCURRENT_INPUTS = int(os.environ.get("QWEN_MAX_CONCURRENT_INPUTS", "4"))
+# Concurrent requests per ingress container; the handlers only await spawns
+INGRESS_CONCURRENT_INPUTS = int(os.environ.get("TENKAIGEN_INGRESS_CONCURRENCY", "200"))
+
+# Webhook requests that still fail after retries are kept here for replay_webhooks
+os.environ.setdefault("TENKAIGEN_DEAD_LETTER_DIR", f"{MODEL_CACHE_PATH}/webhook_dead_letters")
+
+# Persistent tier of the result cache (QWEN_RESULT_CACHE=volume). It has its own
+# volume: a cache miss reloads it, which must not remount the model weights
+result_cache_volume = modal.Volume.from_name("tenkaigen-result-cache", create_if_missing=True)
+RESULT_CACHE_PATH = "/cache/results"
+
+# Inductor caches and portable compile artifacts (QWEN_COMPILE)
+COMPILE_CACHE_PATH = f"{MODEL_CACHE_PATH}/torch_compile"
+
+# Resolved Nunchaku transformer (module, class) per Nunchaku version
+NUNCHAKU_RESOLVER_CACHE = f"{MODEL_CACHE_PATH}/nunchaku_resolver.json"
+
+# Snapshot the CPU stage of container startup (imports + weights in host memory)
+MEMORY_SNAPSHOT = str(os.environ.get("QWEN_MEMORY_SNAPSHOT", "1")).lower() in ("1", "true", "yes")
+
+
+def _push_metrics(role: str):
+    """Push this container's counters to the shared Dict that GET /metrics renders (once per container)."""
+    from qwen_runtime.telemetry import start_pushing
+
+    return start_pushing(modal.Dict.from_name("tenkaigen-metrics", create_if_missing=True), role)
+
+
+def _progress_store():
+    """Shared Dict the GPU containers publish step progress to and GET /progress reads."""
+    return modal.Dict.from_name("tenkaigen-progress", create_if_missing=True)
+
 
 @app.cls(
     image=image,
     gpu=GPU_CONFIG,
-    timeout=900,  # allow longer startup for first-time runtime builds
-    scaledown_window=300,  # Keep warm for 5 minutes
-    volumes={MODEL_CACHE_PATH: model_volume},
+    timeout=900,  # 15 minutes max per input
+    scaledown_window=300,  # Keep warm for 5 minutes; JobQueue sets min/buffer containers at runtime
+    volumes={MODEL_CACHE_PATH: model_volume, RESULT_CACHE_PATH: result_cache_volume},
     secrets=[modal.Secret.from_name("tenkaigen-secrets")],
+    enable_memory_snapshot=MEMORY_SNAPSHOT,
 )
+@modal.concurrent(max_inputs=MAX_CONCURRENT_INPUTS)
 class QwenGenerator:
     """
     Qwen Nanchaku Lightning Image Generator
     Uses 4-step Lightning model for ultra-fast generation (~10 seconds)
     Quality is excellent for print-on-demand designs
+
+    Concurrent `generate` calls are coalesced by a micro-batcher: jobs with the
+    same (width, height, steps, cfg) that arrive within QWEN_BATCH_WINDOW_MS are
+    sent through one pipeline call.
     """
     
-    @modal.enter()
+    @modal.enter(snap=True)
     def load_model(self):
-        """Load model at container start. Prefer Nunchaku Lightning if available."""
-        import torch
-        from diffusers import QwenImagePipeline
-        import os
-        from huggingface_hub import hf_hub_download
-        import importlib
-        import subprocess
-        import pkgutil
-        import inspect
-
-        def _import_nunchaku_qwen_transformer():
-            """
-            Robustly locate Nunchaku's QwenImage transformer across versions by:
-            1) Trying known module paths
-            2) Falling back to walking nunchaku package modules
-            Returns the transformer class and a string describing the source module.
-            """
-            candidates = [
-                "nunchaku.models.transformers.transformer_qwenimage",
-                "nunchaku.models.transformers.transformer_qwen_image",
-                "nunchaku.models.transformers.qwenimage",
-                "nunchaku.models.transformers.qwen_image",
-                "nunchaku.models.cv.transformers.qwenimage",
-                "nunchaku.models.cv.transformers.qwen_image",
-                "nunchaku.models.cv.transformers.transformer_qwenimage",
-                "nunchaku.models.cv.transformers.transformer_qwen_image",
-                "nunchaku.diffusers.models.transformers.qwenimage",
-                "nunchaku.diffusers.models.transformers.qwen_image",
-                "nunchaku.diffusers.transformers.qwenimage",
-                "nunchaku.diffusers.transformers.qwen_image",
-                "nunchaku.models.hub.transformers.qwenimage",
-                "nunchaku.models.hub.transformers.qwen_image",
-                "nunchaku.models.transformers",
-                "nunchaku.models",
-                "nunchaku.diffusers",
-            ]
-            class_names = [
-                "NunchakuQwenImageTransformer2DModel",
-                "QwenImageTransformer2DModel",
-                "NunchakuQwenImageTransformer",
-                "QwenImageTransformer",
-                "NunchakuQwenImageModel",
-            ]
-            # Try direct imports first
-            for mod_name in candidates:
-                try:
-                    mod = importlib.import_module(mod_name)
-                    for cls_name in class_names:
-                        if hasattr(mod, cls_name):
-                            return getattr(mod, cls_name), mod_name
-                except Exception:
-                    pass
-            # Walk the nunchaku package to discover the class dynamically
-            try:
-                import nunchaku  # type: ignore
-                discovered = []
-                print("🔎 Scanning nunchaku package for Qwen transformer classes...")
-                for finder, name, ispkg in pkgutil.walk_packages(nunchaku.__path__, nunchaku.__name__ + "."):
-                    try:
-                        mod = importlib.import_module(name)
-                    except Exception:
-                        continue
-                    for _, obj in inspect.getmembers(mod, inspect.isclass):
-                        # Candidate if class name references qwen and transformer (image optional)
-                        nm = obj.__name__.lower()
-                        if "qwen" in nm and ("transform" in nm or "image" in nm):
-                            discovered.append((obj, name))
-                            # Prefer more specific names first
-                            if "transform" in nm and ("image" in nm or "2d" in nm):
-                                print(f"🔎 Found candidate class {obj.__name__} in {name}")
-                                return obj, name
-                # If we found anything, return the first discovered
-                if discovered:
-                    print(f"🔎 Using first discovered candidate {discovered[0][0].__name__} from {discovered[0][1]}")
-                    return discovered[0]
-                else:
-                    # Log a subset of module names to help debugging
-                    try:
-                        import pkgutil as _pkg
-                        mods = []
-                        for _, mname, _ in _pkg.walk_packages(nunchaku.__path__, nunchaku.__name__ + "."):
-                            if any(x in mname.lower() for x in ["qwen", "transform", "image"]):
-                                mods.append(mname)
-                                if len(mods) >= 20:
-                                    break
-                        print(f"📋 Nunchaku modules (sample): {mods}")
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            raise ImportError("Unable to locate Nunchaku QwenImage transformer class in installed package")
+        """
+        CPU stage: imports and weight loading into host memory
+
+        With memory snapshots enabled this runs once, without a GPU attached, and
+        later containers restore its result instead of re-running it. Nothing here
+        may touch CUDA or start threads.
+        """
+        from qwen_runtime.startup import StartupTimer
+
+        self._startup = StartupTimer()
+        self._nunchaku_resolved = None
+        with self._startup.stage("cpu"):
+            if str(os.environ.get("QWEN_STUB_PIPELINE", "0")).lower() in ("1", "true", "yes"):
+                from qwen_runtime.stub_pipeline import StubQwenPipeline
+                print("🧪 Using stub pipeline (QWEN_STUB_PIPELINE is set)")
+                with self._startup.phase("weight_load"):
+                    self.pipe = StubQwenPipeline(
+                        step_delay_s=float(os.environ.get("QWEN_STUB_STEP_DELAY_S", "0")),
+                        load_delay_s=float(os.environ.get("QWEN_STUB_LOAD_DELAY_S", "0")),
+                        transfer_delay_s=float(os.environ.get("QWEN_STUB_TRANSFER_DELAY_S", "0")),
+                    )
+                self._use_nunchaku = False
+                self._revision = {"weights": "stub"}
+            else:
+                self._load_pipeline()
+
+    @modal.enter(snap=False)
+    def start_gpu(self):
+        """GPU stage: place the pipeline, start the micro-batcher and warm up (runs after every restore)."""
+        from qwen_runtime.batching import MicroBatcher
+        from qwen_runtime.encoding import EncoderPool
+        from qwen_runtime.metrics import PipelineMetrics
+        from qwen_runtime.buckets import bucket_table_from_env
+        from qwen_runtime.determinism import configure_determinism, deterministic_mode
+        from qwen_runtime.nunchaku_resolver import remember_transformer_class
+        from qwen_runtime.result_cache import backend_revision, result_cache_from_env
+
+        self._buckets = bucket_table_from_env()
+        self._deterministic = deterministic_mode()
+        with self._startup.stage("gpu"):
+            if self._deterministic and self._backend != "stub":
+                # Before placement: cuBLAS reads its workspace config on first use
+                configure_determinism()
+            with self._startup.phase("placement"):
+                self._place_pipeline()
+
+            # The text encoder has to run on the GPU, so the negative prompt is
+            # pinned here rather than in the snapshot stage
+            self._prompt_cache = None
+            prompt_cache_enabled = str(os.environ.get("QWEN_PROMPT_CACHE", "1")).lower() in ("1", "true", "yes")
+            if prompt_cache_enabled and hasattr(self.pipe, "encode_prompt"):
+                from qwen_runtime.prompt_cache import PromptEmbeddingCache
+                with self._startup.phase("prompt_cache"):
+                    self._prompt_cache = PromptEmbeddingCache(self.pipe)
+                    self._prompt_cache.pin(" ")
+
+            # Volume writes wait until after the snapshot stage
+            if self._nunchaku_resolved and remember_transformer_class(NUNCHAKU_RESOLVER_CACHE, **self._nunchaku_resolved):
+                model_volume.commit()
+                print("💾 Saved the Nunchaku class resolution to the model volume")
+            self._result_cache = result_cache_from_env(RESULT_CACHE_PATH, volume=result_cache_volume)
+            if self._result_cache is not None:
+                # Deterministic output differs in the low bits, so it gets its own revision
+                self._result_cache.publish_revision(backend_revision(
+                    self._use_nunchaku, **self._revision, deterministic="1" if self._deterministic else None,
+                ))
+
+            self._metrics = PipelineMetrics()
+            self._encoder = EncoderPool(metrics=self._metrics)
+            # A job's numerics depend on the batch it shares, so reproducible runs go alone
+            self._max_batch_size = 1 if self._deterministic else int(os.environ.get("QWEN_MAX_BATCH_SIZE", "2"))
+            self._batcher = MicroBatcher(
+                self._run_jobs,
+                window_s=float(os.environ.get("QWEN_BATCH_WINDOW_MS", "50")) / 1000.0,
+                max_batch_size=self._max_batch_size,
+            )
+            print(f"📦 Micro-batching enabled (max batch {self._max_batch_size})")
+
+            from qwen_runtime.progress import latent_previewer, progress_publisher
+            self._progress = progress_publisher(_progress_store())
+            self._previewer = latent_previewer() if self._progress is not None else None
+
+            with self._startup.phase("compile"):
+                self._compile_pipeline()
+
+            self._warmup_report = {}
+            if str(os.environ.get("QWEN_WARMUP", "1")).lower() in ("1", "true", "yes"):
+                with self._startup.phase("warmup"):
+                    self._warmup()
+                self._metrics.reset()
+                self._save_compile_cache()
+        self._startup.log()
+        self._record_cold_start()
+
+    def _record_cold_start(self):
+        from qwen_runtime.telemetry import registry
+
+        metrics = registry()
+        metrics.inc("tenkaigen_cold_starts_total", backend=self._backend)
+        for stage, duration in self._startup.report().get("stages_s", {}).items():
+            metrics.observe("tenkaigen_cold_start_seconds", duration, stage=stage)
+        _push_metrics("generator")
+
+    @property
+    def _backend(self) -> str:
+        """Backend label for metrics: nunchaku, standard or stub."""
+        if self._revision.get("weights") == "stub":
+            return "stub"
+        return "nunchaku" if self._use_nunchaku else "standard"
+
+    def _compile_pipeline(self):
+        """Apply QWEN_COMPILE, preloading compiled artifacts from the volume."""
+        from qwen_runtime import compile as qwen_compile
+        from qwen_runtime.stub_pipeline import StubQwenPipeline
+
+        mode = qwen_compile.compile_mode()
+        if mode == "max-autotune" and self._deterministic:
+            # Autotuning picks kernels by timing, which differs between containers
+            print("🎯 Deterministic mode: compiling regional instead of max-autotune")
+            mode = "regional"
+        self._compile = {"mode": mode, "compiled": []}
+        if mode == "off" or isinstance(self.pipe, StubQwenPipeline):
+            return
+        qwen_compile.configure_cache_dir(COMPILE_CACHE_PATH)
+        artifacts = qwen_compile.artifacts_path(COMPILE_CACHE_PATH, mode, self._backend)
+        preloaded = qwen_compile.load_artifacts(artifacts)
+        self._compile = qwen_compile.compile_pipeline(
+            self.pipe, mode, self._use_nunchaku, (self._placement or {}).get("mode")
+        )
+        self._compile["cache_preloaded"] = preloaded
+        print(f"🛠️ Compile: {self._compile}")
+
+    def _save_compile_cache(self):
+        """Persist compiled artifacts gathered during warm-up for the next container."""
+        from qwen_runtime import compile as qwen_compile
+
+        if not self._compile.get("compiled") or self._compile.get("cache_preloaded"):
+            return
+        if qwen_compile.save_artifacts(qwen_compile.artifacts_path(COMPILE_CACHE_PATH, self._compile["mode"], self._backend)):
+            model_volume.commit()
+            print("💾 Saved compile cache to the model volume")
+
+    def _warmup(self):
+        """
+        Run a dummy generation at each warm-up size before serving
+
+        Covers CUDA context init, cuDNN autotune, allocator growth, lazy kernel
+        loads and, with QWEN_COMPILE, graph capture for that shape. With
+        QWEN_WARMUP_RUNS > 1 the later runs show the steady-state cost.
+        """
+        import time
+        from qwen_runtime.batching import GenerationJob
+        from qwen_runtime.progress import ProgressReporter
+        from qwen_runtime.startup import warmup_sizes
+
+        runs = max(1, int(os.environ.get("QWEN_WARMUP_RUNS", "1")))
+        for width, height in warmup_sizes():
+            durations = []
+            for _ in range(runs):
+                job = GenerationJob(prompt="warm-up", width=width, height=height, num_inference_steps=1, seed=0)
+                if self._previewer is not None and not self._previewer.fitted:
+                    # Fits the latent preview against this decode; publishes nothing
+                    job.progress = ProgressReporter("warm-up", None, self._previewer)
+                start = time.perf_counter()
+                result = self._run_jobs([job])[0].result()
+                durations.append(round(time.perf_counter() - start, 3))
+                if not result["success"]:
+                    print(f"⚠️ Warm-up generation at {width}x{height} failed: {result.get('error')}")
+                    break
+            self._warmup_report[f"{width}x{height}"] = durations
+            print(f"🔥 Warm-up {width}x{height}: {durations}")
+
+    @modal.exit()
+    def shutdown(self):
+        batcher = getattr(self, "_batcher", None)
+        if batcher is not None:
+            batcher.close()
+        encoder = getattr(self, "_encoder", None)
+        if encoder is not None:
+            encoder.shutdown()
+        from qwen_runtime.delivery import close_background_deliverers
+        from qwen_runtime.progress import stop_publishing
+        from qwen_runtime.telemetry import stop_pushing
+        close_background_deliverers()
+        stop_pushing()
+        stop_publishing()
+
+    def _load_pipeline(self):
+        """Load the model into host memory. Prefer Nunchaku Lightning if available."""
+        timer = self._startup
+        with timer.phase("import"):
+            import torch
+            import diffusers
+            from diffusers import QwenImagePipeline
+            from huggingface_hub import hf_hub_download
 
         # Help PyTorch reduce fragmentation if we ever fall back
         os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 
         enable_nunchaku = str(os.environ.get("ENABLE_NUNCHAKU", "0")).lower() in ("1", "true", "yes")
         if enable_nunchaku:
-            # Try Nunchaku Lightning
-            try:
-                # Resolve transformer class dynamically
-                NunchakuQwenImageTransformer2DModel, src_module = _import_nunchaku_qwen_transformer()
+            from qwen_runtime.nunchaku_resolver import resolve_transformer_class
+            from qwen_runtime.startup import check_nunchaku_manifest
+
+            # Nunchaku is baked into the image at build time; a missing or mismatched
+            # build raises here instead of installing anything in the request path
+            with timer.phase("import"):
+                manifest = check_nunchaku_manifest()
+                # Resolved (module, class) is cached on the volume per Nunchaku version;
+                # a fresh resolution is written by start_gpu, after the snapshot
+                NunchakuQwenImageTransformer2DModel, src_module = resolve_transformer_class(
+                    cache_path=NUNCHAKU_RESOLVER_CACHE,
+                    version=manifest["nunchaku"],
+                    save=False,
+                )
+                self._nunchaku_resolved = {
+                    "version": manifest["nunchaku"],
+                    "module": src_module,
+                    "class_name": NunchakuQwenImageTransformer2DModel.__name__,
+                }
                 from nunchaku.utils import get_precision
                 from diffusers import FlowMatchEulerDiscreteScheduler
-                print(f"🚀 Loading Qwen-Image Lightning (4-step) with Nunchaku from {src_module}...")
+            # Try Nunchaku Lightning
+            try:
+                print(f"🚀 Loading Qwen-Image Lightning (4-step) with Nunchaku {manifest['nunchaku']} from {src_module}...")
                 scheduler_config = {
                     "base_image_seq_len": 256,
                     "base_shift": math.log(3),
@@ -194,121 +439,21 @@ class QwenGenerator:
                     "use_karras_sigmas": False,
                 }
                 scheduler = FlowMatchEulerDiscreteScheduler.from_config(scheduler_config)
-                rank = 32
-                filename = f"svdq-{get_precision()}_r{rank}-qwen-image-lightningv1.0-4steps.safetensors"
-                model_path = hf_hub_download(
-                    repo_id="nunchaku-tech/nunchaku-qwen-image",
-                    filename=filename,
-                    cache_dir=MODEL_CACHE_PATH
-                )
-                print(f"📥 Loading transformer from: {model_path}")
-                # Some versions expose from_single_file; fall back to from_pretrained
                 try:
-                    transformer = NunchakuQwenImageTransformer2DModel.from_single_file(model_path)  # type: ignore[attr-defined]
+                    precision = get_precision()
                 except Exception:
-                    transformer = NunchakuQwenImageTransformer2DModel.from_pretrained(model_path)
-                self.pipe = QwenImagePipeline.from_pretrained(
-                    "Qwen/Qwen-Image",
-                    transformer=transformer,
-                    scheduler=scheduler,
-                    torch_dtype=torch.bfloat16,
-                    cache_dir=MODEL_CACHE_PATH,
-                    trust_remote_code=True,
-                )
-                # Prefer sequential offload for lower VRAM; exclude transformer if we have ample VRAM
-                total_vram_gb = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-                if total_vram_gb > 18:
-                    try:
-                        self.pipe._exclude_from_cpu_offload.append("transformer")
-                    except Exception:
-                        pass
-                self.pipe.enable_sequential_cpu_offload()
-                print("✅ Qwen-Image Lightning pipeline loaded! (~10-12s per image)")
-                self._use_nunchaku = True
-                return
-            except Exception as e:
-                print(f"⚠️ Nunchaku load failed: {e}. Attempting runtime install...")
-                try:
-                    env = os.environ.copy()
-                    # Ensure CUDA 12.8 Torch (required by prebuilt Nunchaku wheel)
-                    subprocess.check_call([
-                        "python3", "-m", "pip", "install", "--upgrade",
-                        "pip", "setuptools", "wheel", "ninja"
-                    ], env=env)
-                    subprocess.check_call([
-                        "python3", "-m", "pip", "install",
-                        "torch", "torchvision", "--index-url", "https://download.pytorch.org/whl/cu128"
-                    ], env=env)
-
-                    # Choose a matching prebuilt Nunchaku wheel for current Torch major.minor
-                    torch_version = torch.__version__.split("+")[0]
-                    torch_mm = ".".join(torch_version.split(".")[:2])  # e.g., "2.9"
-                    candidates = [
-                        # Try newer releases first
-                        f"https://github.com/nunchaku-tech/nunchaku/releases/download/v0.3.3/nunchaku-0.3.3+torch{torch_mm}-cp311-cp311-linux_x86_64.whl",
-                        f"https://github.com/nunchaku-tech/nunchaku/releases/download/v0.3.2/nunchaku-0.3.2+torch{torch_mm}-cp311-cp311-linux_x86_64.whl",
-                        f"https://github.com/nunchaku-tech/nunchaku/releases/download/v0.3.1/nunchaku-0.3.1+torch{torch_mm}-cp311-cp311-linux_x86_64.whl",
-                    ]
-                    last_err = None
-                    for url in candidates:
-                        try:
-                            print(f"🔧 Trying Nunchaku wheel: {url}")
-                            subprocess.check_call(["python3", "-m", "pip", "install", "--no-cache-dir", url], env=env)
-                            last_err = None
-                            break
-                        except subprocess.CalledProcessError as perr:
-                            last_err = perr
-                            continue
-                    if last_err is not None:
-                        raise last_err
-
-                    # Retry load after install with robust import fallbacks
-                    try:
-                        NunchakuQwenImageTransformer2DModel, src_module = _import_nunchaku_qwen_transformer()
-                    except Exception as import_err_after_wheel:
-                        # If the wheel doesn't include Qwen, build from source at a known commit
-                        print(f"⚙️ Wheel missing Qwen transformer; building Nunchaku from source... ({import_err_after_wheel})")
-                        # Configure CUDA build environment (A10G ~ sm_86)
-                        env["CUDA_HOME"] = env.get("CUDA_HOME", "/usr/local/cuda")
-                        env["TORCH_CUDA_ARCH_LIST"] = env.get("TORCH_CUDA_ARCH_LIST", "8.6")
-                        env["CUDAARCHS"] = env.get("CUDAARCHS", "86")
-                        env["MAX_JOBS"] = env.get("MAX_JOBS", "2")
-                        # Known commit that includes QwenImage transformer
-                        nunchaku_commit = "c01772562ab103d4958349250df626696d763d89"
-                        subprocess.check_call([
-                            "python3", "-m", "pip", "install", "--no-cache-dir", "--no-build-isolation",
-                            f"git+https://github.com/nunchaku-tech/nunchaku.git@{nunchaku_commit}"
-                        ], env=env)
-                        # Try to import again after building from source
-                        NunchakuQwenImageTransformer2DModel, src_module = _import_nunchaku_qwen_transformer()
-                    from nunchaku.utils import get_precision
-                    from diffusers import FlowMatchEulerDiscreteScheduler
-                    print(f"✅ Nunchaku installed at runtime. Loading Lightning from {src_module}...")
-                    scheduler_config = {
-                        "base_image_seq_len": 256,
-                        "base_shift": math.log(3),
-                        "invert_sigmas": False,
-                        "max_image_seq_len": 8192,
-                        "max_shift": math.log(3),
-                        "num_train_timesteps": 1000,
-                        "shift": 1.0,
-                        "shift_terminal": None,
-                        "stochastic_sampling": False,
-                        "time_shift_type": "exponential",
-                        "use_beta_sigmas": False,
-                        "use_dynamic_shifting": True,
-                        "use_exponential_sigmas": False,
-                        "use_karras_sigmas": False,
-                    }
-                    scheduler = FlowMatchEulerDiscreteScheduler.from_config(scheduler_config)
-                    rank = 32
-                    filename = f"svdq-{get_precision()}_r{rank}-qwen-image-lightningv1.0-4steps.safetensors"
+                    # No GPU is attached while the snapshot is taken; A10G (sm_86) uses int4
+                    precision = "int4"
+                rank = 32
+                filename = f"svdq-{precision}_r{rank}-qwen-image-lightningv1.0-4steps.safetensors"
+                with timer.phase("weight_load"):
                     model_path = hf_hub_download(
                         repo_id="nunchaku-tech/nunchaku-qwen-image",
                         filename=filename,
                         cache_dir=MODEL_CACHE_PATH
                     )
                     print(f"📥 Loading transformer from: {model_path}")
+                    # Some versions expose from_single_file; fall back to from_pretrained
                     try:
                         transformer = NunchakuQwenImageTransformer2DModel.from_single_file(model_path)  # type: ignore[attr-defined]
                     except Exception:
@@ -321,30 +466,53 @@ class QwenGenerator:
                         cache_dir=MODEL_CACHE_PATH,
                         trust_remote_code=True,
                     )
-                    total_vram_gb = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-                    if total_vram_gb > 18:
-                        try:
-                            self.pipe._exclude_from_cpu_offload.append("transformer")
-                        except Exception:
-                            pass
-                    self.pipe.enable_sequential_cpu_offload()
-                    print("✅ Qwen-Image Lightning pipeline loaded after runtime install")
-                    self._use_nunchaku = True
-                    return
-                except Exception as ie:
-                    print(f"⚠️ Runtime Nunchaku install failed: {ie}")
+                self._use_nunchaku = True
+                self._revision = {
+                    "weights": filename,
+                    "nunchaku": manifest["nunchaku"],
+                    "diffusers": diffusers.__version__,
+                }
+                print("✅ Qwen-Image Lightning pipeline loaded! (~10-12s per image)")
+                return
+            except Exception as e:
+                print(f"⚠️ Nunchaku load failed: {e}. Falling back to standard pipeline")
 
         # Fallback to standard pipeline
         print("🚀 Loading standard Qwen-Image pipeline (fallback)")
-        self.pipe = QwenImagePipeline.from_pretrained(
-            "Qwen/Qwen-Image",
-            torch_dtype=torch.bfloat16,
-            cache_dir=MODEL_CACHE_PATH,
-            trust_remote_code=True,
-        )
-        self.pipe.enable_sequential_cpu_offload()
+        with timer.phase("weight_load"):
+            self.pipe = QwenImagePipeline.from_pretrained(
+                "Qwen/Qwen-Image",
+                torch_dtype=torch.bfloat16,
+                cache_dir=MODEL_CACHE_PATH,
+                trust_remote_code=True,
+            )
         self._use_nunchaku = False
+        self._revision = {"weights": "Qwen/Qwen-Image", "diffusers": diffusers.__version__}
         print("✅ Standard Qwen-Image pipeline loaded")
+
+    def _place_pipeline(self):
+        """Pick and apply a GPU placement from free VRAM and component sizes."""
+        from qwen_runtime.placement import apply_placement, component_sizes, plan_placement, read_vram
+        from qwen_runtime.stub_pipeline import StubQwenPipeline
+
+        if isinstance(self.pipe, StubQwenPipeline):
+            # No torch modules to size; just simulate the device copy
+            self.pipe.to("cuda")
+            self._placement = {"mode": "gpu", "reason": "stub pipeline"}
+            return
+        vram = read_vram()
+        transformer = getattr(self.pipe, "transformer", None)
+        blocks = getattr(transformer, "transformer_blocks", None)
+        plan = plan_placement(
+            total_vram_bytes=vram["total"],
+            free_vram_bytes=vram["free"],
+            component_bytes=component_sizes(self.pipe),
+            use_nunchaku=self._use_nunchaku,
+            transformer_blocks=len(blocks) if blocks is not None else None,
+        )
+        print(f"🧭 Placement: {plan.mode} ({plan.reason})")
+        apply_placement(self.pipe, plan)
+        self._placement = plan.to_dict()
     
     @modal.method()
     def generate(
@@ -353,10 +521,13 @@ class QwenGenerator:
         style: Optional[str] = None,
         width: int = 1024,
         height: int = 1024,
-        num_inference_steps: int = 12,  # Fallback default trimmed for speed; Lightning uses 4
-        cfg_scale: float = 4.0,  # Lightning uses 1.0; standard uses higher CFG
+        num_inference_steps: Optional[int] = None,  # Resolved from the loaded backend
+        cfg_scale: Optional[float] = None,  # Lightning uses 1.0; standard uses higher CFG
         negative_prompt: str = " ",
         seed: Optional[int] = None,
+        result_format: str = "base64",
+        encoding: Optional[dict] = None,
+        progress_id: Optional[str] = None,
     ) -> dict:
         """
         Generate an image from a prompt
@@ -366,241 +537,774 @@ class QwenGenerator:
             style: Optional style hint (Anime, Line Art, etc.)
             width: Output width (default 1664 for print quality)
             height: Output height (default 928 for print quality)
-            num_inference_steps: Number of denoising steps (default 50)
-            cfg_scale: Classifier-free guidance scale (default 4.0)
+            num_inference_steps: Number of denoising steps (default 4 on Lightning, 30 on standard)
+            cfg_scale: Classifier-free guidance scale (default 1.0 on Lightning, 4.0 on standard)
             negative_prompt: Things to avoid in generation
-            seed: Random seed for reproducibility
+            seed: Random seed for reproducibility; one is drawn when omitted, and
+                the seed used is always returned as metadata.seed (bit-identical
+                reruns need QWEN_DETERMINISTIC, see qwen_runtime.determinism)
+            result_format: "base64" (default) or "bytes" for the raw image
+            encoding: Output encoding, e.g. {"format": "webp", "lossless": True}
+                or {"format": "png", "compress_level": 1}; see EncodeOptions.
+                Defaults to QWEN_OUTPUT_ENCODING or fast PNG (level 6, no optimize)
+            progress_id: Publish per-step progress for GET /progress under this
+                job ID; the caller writes the terminal state after delivery
             
         Returns:
-            dict with 'image_base64' (base64 encoded PNG) and metadata
+            dict with 'image_base64' (base64 encoded image) or 'image_bytes'
+            (raw image) depending on result_format, 'content_type', and metadata
+            (with the call's span tree under "trace" unless TENKAIGEN_TRACE=off)
         """
-        import torch
-        from PIL import Image
-        
+        from qwen_runtime.batching import RESULT_FORMATS, GenerationJob
+        from qwen_runtime.encoding import EncodeOptions
+        from qwen_runtime.tracing import start_trace
+
+        if result_format not in RESULT_FORMATS:
+            return {"success": False, "error": f"Unsupported result_format: {result_format}"}
+        try:
+            EncodeOptions.from_dict(encoding)
+        except Exception as e:
+            return {"success": False, "error": f"Invalid encoding: {e}"}
+
         print(f"🎨 Generating image: {prompt[:100]}...")
         print(f"   Style: {style}, Size: {width}x{height}, Steps: {num_inference_steps}")
-        
-        # Set random seed if provided
-        if seed is not None:
-            torch.manual_seed(seed)
-        
-        # Enhance prompt based on style
-        enhanced_prompt = self._enhance_prompt(prompt, style)
-        
-        # Generate image
-        try:
-            # Use true_cfg for Lightning, guidance_scale for standard
-            call_kwargs = dict(
-                prompt=enhanced_prompt,
-                negative_prompt=negative_prompt,
-                width=width,
-                height=height,
-            )
-            if getattr(self, "_use_nunchaku", False):
-                call_kwargs["num_inference_steps"] = num_inference_steps if num_inference_steps else 4
-                call_kwargs["true_cfg_scale"] = cfg_scale if cfg_scale is not None else 1.0
-            else:
-                call_kwargs["num_inference_steps"] = num_inference_steps if num_inference_steps else 30
-                call_kwargs["guidance_scale"] = cfg_scale if cfg_scale is not None else 4.0
 
-            result = self.pipe(**call_kwargs)
-            
-            image = result.images[0]
-            
-            # Convert to base64 for transport
-            buffer = io.BytesIO()
-            image.save(buffer, format="PNG", optimize=True)
-            image_bytes = buffer.getvalue()
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
-            print(f"✅ Generated image: {len(image_bytes)} bytes")
-            
-            return {
-                "success": True,
-                "image_base64": image_base64,
-                "metadata": {
-                    "prompt": prompt,
-                    "enhanced_prompt": enhanced_prompt,
-                    "style": style,
-                    "width": width,
-                    "height": height,
-                    "steps": num_inference_steps,
-                    "cfg_scale": cfg_scale,
-                    "nunchaku": getattr(self, "_use_nunchaku", False),
-                }
-            }
-            
-        except Exception as e:
-            print(f"❌ Generation failed: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    def _enhance_prompt(self, prompt: str, style: Optional[str]) -> str:
+        job = GenerationJob(
+            prompt=prompt,
+            style=style,
+            width=width,
+            height=height,
+            num_inference_steps=num_inference_steps,
+            cfg_scale=cfg_scale,
+            negative_prompt=negative_prompt,
+            seed=seed,
+            result_format=result_format,
+            encoding=encoding,
+            trace=start_trace("generate_call"),
+            progress=self._progress_reporter(progress_id) if progress_id else None,
+        )
+        result = self._submit(self._buckets.snap_job(job))
+        if job.progress is not None:
+            # Steps must land before the caller's terminal state, not after it
+            self._progress.flush()
+        if job.trace is not None:
+            job.trace.finish()
+            if result["success"]:
+                result["metadata"] = {**result.get("metadata", {}), "trace": job.trace.to_dict()}
+        return result
+
+    @modal.method()
+    def generate_batch(self, jobs: List[dict]) -> List[dict]:
         """
-        Enhance prompt with style-specific additions
-        
-        The LLM already expanded the prompt, but we can add
-        quality boosters and style-specific tags here
+        Generate several images, batching compatible jobs into shared pipeline calls
+
+        Args:
+            jobs: List of dicts with the same keys as `generate` arguments
+
+        Returns:
+            List of result dicts, one per job and in the same order, each shaped
+            like the return value of `generate`
         """
-        
-        # Base quality enhancer for all styles
-        quality_magic = "Ultra HD, 4K, cinematic composition"
-        
-        # Style-specific enhancements
-        style_enhancements = {
-            "Anime": ", vibrant colors, detailed shading, anime art style, high quality illustration",
-            "Line Art": ", clean lines, minimalist design, vector art style, simple elegant composition",
-            "Flat Logo": ", flat design, bold shapes, modern minimalist logo, clean vector graphics",
-            "Watercolor": ", watercolor painting style, soft blending, artistic brush strokes, delicate colors",
-            "Abstract": ", abstract art, geometric shapes, modern composition, bold colors",
-            "Minimalist": ", minimalist design, simple clean composition, negative space, elegant simplicity",
-            "Vintage": ", vintage art style, retro aesthetic, aged texture, classic design",
-            "Grunge": ", grunge texture, distressed style, urban aesthetic, rough edges",
-            "Standard": ", professional design, balanced composition, high quality"
+        from qwen_runtime.batching import GenerationJob
+
+        print(f"🎨 Generating batch of {len(jobs)} images")
+        futures = self._run_jobs([self._buckets.snap_job(GenerationJob(**job)) for job in jobs])
+        return [future.result() for future in futures]
+
+    @modal.method()
+    def stats(self) -> dict:
+        """GPU/CPU overlap figures, cache counters and the cold-start phase report."""
+        cache = self._result_cache
+        prompt_cache = self._prompt_cache
+        return {
+            **self._metrics.snapshot(),
+            "result_cache": cache.stats() if cache is not None else None,
+            "prompt_cache": prompt_cache.stats() if prompt_cache is not None else None,
+            "compile": self._compile,
+            "warmup_s": self._warmup_report,
+            "startup": self._startup.report(),
         }
-        
-        enhancement = style_enhancements.get(style, style_enhancements["Standard"])
-        
-        return f"{prompt}{enhancement}. {quality_magic}."
+
+    @modal.method()
+    def benchmark(
+        self,
+        configs: List[dict],
+        corpus: Optional[List[list]] = None,
+        repeats: int = 1,
+        batch_size: int = 1,
+        warmup: int = 1,
+        encoding: Optional[dict] = None,
+    ) -> dict:
+        """
+        Run the benchmark corpus at each {"steps", "width", "height"} config
+
+        Jobs go straight to the pipeline (no result cache, no bucket snapping)
+        so every config is generated at its exact size. Returns this
+        container's backend and placement with one row of figures per config;
+        see qwen_runtime.benchmark and bench_generator.py.
+        """
+        from qwen_runtime.benchmark import CORPUS, run_matrix
+
+        rows = run_matrix(
+            self._run_jobs,
+            configs,
+            use_nunchaku=getattr(self, "_use_nunchaku", False),
+            corpus=corpus or CORPUS,
+            repeats=repeats,
+            batch_size=batch_size,
+            warmup=warmup,
+            encoding=encoding,
+        )
+        placement = (getattr(self, "_placement", None) or {}).get("mode")
+        for row in rows:
+            row.update(backend=self._backend, placement=placement)
+        return {"backend": self._backend, "placement": placement, "startup": self._startup.report(), "rows": rows}
+
+    @modal.method()
+    def run_job(
+        self,
+        job_id: str,
+        prompt: str,
+        style: Optional[str] = None,
+        width: int = 1664,
+        height: int = 928,
+        seed: Optional[int] = None,
+        num_inference_steps: Optional[int] = None,
+        cfg_scale: Optional[float] = None,
+        submitted_at: Optional[float] = None,
+        upload_url: Optional[str] = None,
+        object_key: Optional[str] = None,
+        user_id: Optional[str] = None,
+        encoding: Optional[dict] = None,
+        queued: bool = False,
+        downgrade: Optional[dict] = None,
+        dispatched_at: Optional[float] = None,
+    ) -> dict:
+        """
+        Consume one job end to end: generate, then report through the webhook
+
+        This is the direct dispatch target for the web endpoint, so the job runs
+        in this container instead of hopping through `process_job`. Steps and
+        CFG default to whatever the loaded backend expects.
+
+        Args:
+            submitted_at: Ingress timestamp (time.time()) so processing_time_ms
+                includes queueing and cold start, like the relay path did
+            upload_url: Optional presigned PUT URL; the image is uploaded there
+                and the webhook only carries the object reference
+            object_key: Storage key for the upload (derived from job_id/user_id
+                when omitted)
+            user_id: Owner used in the default object key
+            encoding: Output encoding options, as for `generate`
+            queued: Dispatched by `JobQueue`, which is told when the job finishes
+                and hands back coalesced duplicates to deliver the result to
+            downgrade: Set by `JobQueue` admission control under load: scales
+                steps and generation size down (see qwen_runtime.admission)
+            dispatched_at: When `JobQueue` spawned this call, splitting the
+                trace's queue time from container acquisition
+        """
+        import time
+        from qwen_runtime.admission import apply_downgrade
+        from qwen_runtime.batching import GenerationJob, resolve_sampling
+        from qwen_runtime.coalescing import follower_result
+        from qwen_runtime.delivery import deliver_result, result_format_for, webhook_transport
+        from qwen_runtime.storage import store_result, wants_direct_upload
+        from qwen_runtime.tracing import span, start_trace
+
+        start_time = submitted_at or time.time()
+        run_start = time.time()
+        transport = webhook_transport()
+        direct_upload = wants_direct_upload(upload_url)
+        print(f"🎨 Running job {job_id}")
+        trace = start_trace("job", start=start_time, job_id=job_id)
+        if trace is not None:
+            self._trace_start(trace, dispatched_at, run_start)
+        progress = self._progress_reporter(job_id)
+        if progress is not None:
+            progress.start()
+        result = {"success": False, "error": "Generation did not complete"}
+        generated = result  # before this job's upload, for coalesced followers
+        try:
+            try:
+                job = GenerationJob(
+                    prompt=prompt,
+                    style=style,
+                    width=width,
+                    height=height,
+                    num_inference_steps=num_inference_steps,
+                    cfg_scale=cfg_scale,
+                    seed=seed,
+                    result_format="bytes" if direct_upload else result_format_for(transport),
+                    encoding=encoding,
+                    trace=trace,
+                    progress=progress,
+                )
+                job = self._buckets.snap_job(job)
+                if downgrade:
+                    default_steps, _ = resolve_sampling(None, None, getattr(self, "_use_nunchaku", False))
+                    job = apply_downgrade(job, downgrade, default_steps, self._buckets)
+                result = self._submit(job)
+                if downgrade and result["success"]:
+                    result["metadata"] = {**result.get("metadata", {}), "downgraded": True}
+                generated = result
+                if direct_upload:
+                    with span(trace, "upload"):
+                        result = store_result(job_id, result, upload_url, object_key, user_id)
+            except Exception as e:
+                # Still delivered below, so the job doesn't sit in "processing"
+                print(f"❌ Job {job_id} failed: {e}")
+                result = {"success": False, "error": str(e)}
+            if trace is not None and result["success"]:
+                # The webhook carries the tree up to here; deliver is only logged
+                result["metadata"] = {**result.get("metadata", {}), "trace": trace.to_dict()}
+            processing_time_ms = int((time.time() - start_time) * 1000)
+            with span(trace, "deliver", transport=transport):
+                deliver_result(job_id, result, processing_time_ms, transport=transport)
+        finally:
+            if progress is not None:
+                # Only now is the result in the database for a client that sees this
+                progress.finish(result["success"], result.get("error"))
+            if queued:
+                # Frees the job's slot in the queue; a lost call is covered by the lease
+                followers = JobQueue().complete.remote(job_id, time.time() - run_start)
+                for follower in followers:
+                    # Coalesced duplicates get this job's image, stored at their own upload target
+                    follower_ms = int((time.time() - follower["submitted_at"]) * 1000)
+                    try:
+                        owed = follower_result(generated, follower)
+                    except Exception as e:
+                        owed = {"success": False, "error": str(e)}
+                    deliver_result(follower["job_id"], owed, follower_ms, transport=transport)
+                    follower_progress = self._progress_reporter(follower["job_id"])
+                    if follower_progress is not None:
+                        follower_progress.finish(owed["success"], owed.get("error"))
+                if followers:
+                    print(f"🔗 Delivered job {job_id}'s result to {len(followers)} coalesced jobs")
+            if trace is not None:
+                trace.export()
+        return {"success": result["success"]}
+
+    def _progress_reporter(self, job_id: str):
+        """A ProgressReporter for job_id, or None when progress is off."""
+        if self._progress is None:
+            return None
+        return self._progress.reporter(job_id, self._previewer)
+
+    def _trace_start(self, trace, dispatched_at: Optional[float], run_start: float) -> None:
+        """Queue and container-acquire spans, with the cold start when this job waited through it."""
+        waiting_since = trace.root.start
+        if dispatched_at is not None and dispatched_at > waiting_since:
+            trace.add("queue", waiting_since, dispatched_at)
+            waiting_since = dispatched_at
+        acquire = trace.add("container_acquire", waiting_since, run_start)
+        for stage, (start, end) in self._startup.stage_windows().items():
+            if end > waiting_since and start < run_start:
+                trace.add(f"enter.{stage}", max(start, waiting_since), end, acquire)
+
+    def _submit(self, job) -> dict:
+        """Serve a job from the result cache, or generate it and cache the result."""
+        import time
+        from qwen_runtime.tracing import span
+
+        start = time.perf_counter()
+        with span(job.trace, "generate") as generate_span:
+            if generate_span is not None:
+                job.trace.current = generate_span
+            try:
+                result = self._generate_or_cached(job)
+            finally:
+                if generate_span is not None:
+                    job.trace.current = job.trace.root
+        self._metrics.record_request(time.perf_counter() - start, bucket=f"{job.width}x{job.height}")
+        return result
+
+    def _generate_or_cached(self, job) -> dict:
+        import time
+        from qwen_runtime.result_cache import cached_result
+        from qwen_runtime.telemetry import registry
+        from qwen_runtime.tracing import span
+
+        cache = self._result_cache
+        with span(job.trace, "result_cache") as cache_span:
+            key = cache.key_for(job, self._enhance_prompt(job.prompt, job.style)) if cache is not None else None
+            entry = cache.lookup(key) if key is not None else None
+            if cache_span is not None:
+                cache_span.attrs["hit"] = entry is not None
+        if entry is not None:
+            print(f"♻️ Result cache hit {key[:12]}")
+            return cached_result(entry, job)
+        if job.trace is not None:
+            job.trace.mark("batched")
+        start = time.perf_counter()
+        result = self._batcher.submit(job).result()
+        registry().observe(
+            "tenkaigen_generation_seconds",
+            time.perf_counter() - start,
+            backend=self._backend,
+            resolution=f"{job.width}x{job.height}",
+        )
+        if key is not None and result["success"]:
+            cache.put_result(key, result)
+        return result
+
+    def _run_jobs(self, jobs) -> list:
+        from qwen_runtime.batching import run_batch
+
+        return run_batch(
+            self.pipe,
+            jobs,
+            use_nunchaku=getattr(self, "_use_nunchaku", False),
+            enhance_prompt=self._enhance_prompt,
+            max_batch_size=self._max_batch_size,
+            encoder=self._encoder,
+            metrics=self._metrics,
+            extra_metadata={"placement": getattr(self, "_placement", None), "deterministic": self._deterministic},
+            embed_prompts=self._prompt_cache,
+        )
+    
+    def _enhance_prompt(self, prompt: str, style: Optional[str]) -> str:
+        """Enhance prompt with style-specific additions (see qwen_runtime.prompts)."""
+        from qwen_runtime.prompts import enhance_prompt
+
+        return enhance_prompt(prompt, style)
+
+
+_relay_cache = None
+
+
+def _job_result_cache():
+    """Per-container result cache for the CPU-side functions (None when disabled)."""
+    global _relay_cache
+    if _relay_cache is None:
+        from qwen_runtime.result_cache import result_cache_from_env
+        _relay_cache = result_cache_from_env(RESULT_CACHE_PATH, volume=result_cache_volume) or False
+    return _relay_cache or None
+
+
+def _cache_key(prompt: str, style, width: int, height: int, seed, encoding: Optional[dict]):
+    """Result cache key for an endpoint job, or None if it cannot be cached."""
+    from qwen_runtime.batching import GenerationJob
+    from qwen_runtime.buckets import bucket_table_from_env
+    from qwen_runtime.prompts import enhance_prompt
+
+    cache = _job_result_cache()
+    if cache is None or seed is None:
+        return None
+    # Snap the same way the GPU container does so the keys agree
+    job = GenerationJob(prompt=prompt, style=style, width=width, height=height, seed=seed, encoding=encoding)
+    job = bucket_table_from_env().snap_job(job)
+    return cache.key_for(job, enhance_prompt(prompt, style))
 
 
 # Background processor to avoid HTTP timeouts
 @app.function(
     image=image,
     secrets=[modal.Secret.from_name("tenkaigen-secrets")],
+    volumes={MODEL_CACHE_PATH: model_volume, RESULT_CACHE_PATH: result_cache_volume},
     timeout=1200,  # Allow ample time for first cold start and generation
 )
-def process_job(job_id: str, prompt: str, style, width: int, height: int, seed):
+def process_job(
+    job_id: str,
+    prompt: str,
+    style,
+    width: int,
+    height: int,
+    seed,
+    upload_url: Optional[str] = None,
+    object_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    encoding: Optional[dict] = None,
+):
+    """
+    Relay path: call the GPU class and forward its result to the webhook
+
+    Used when TENKAIGEN_DISPATCH_MODE=relay, and in the other modes for jobs the
+    result cache already holds: a cache hit is delivered from here without
+    dispatching to the GPU class. Steps and CFG are left unset so the GPU
+    container resolves them from the backend it actually loaded.
+    """
     import time
-    import requests
-    import os as _os
+    from qwen_runtime.batching import GenerationJob
+    from qwen_runtime.delivery import deliver_result, result_format_for, webhook_transport
+    from qwen_runtime.progress import progress_publisher
+    from qwen_runtime.result_cache import cached_result
+    from qwen_runtime.storage import store_result, wants_direct_upload
+    from qwen_runtime.tracing import span, start_trace
 
     start_time = time.time()
-    webhook_url = _os.environ.get("TENKAIGEN_WEBHOOK_URL")
+    _push_metrics("relay")
+    transport = webhook_transport()
+    direct_upload = wants_direct_upload(upload_url)
+    result_format = "bytes" if direct_upload else result_format_for(transport)
+    trace = start_trace("job", start=start_time, job_id=job_id)
+    publisher = progress_publisher(_progress_store())
 
-    generator = QwenGenerator()
-    result = generator.generate.remote(
-        prompt=prompt,
-        style=style,
-        width=width,
-        height=height,
-        seed=seed,
-        # Use Lightning defaults when available
-            num_inference_steps=4 if getattr(generator, "_use_nunchaku", False) else 12,
-        cfg_scale=1.0 if getattr(generator, "_use_nunchaku", False) else 4.0,
-    )
+    try:
+        cache = _job_result_cache()
+        with span(trace, "result_cache") as cache_span:
+            key = _cache_key(prompt, style, width, height, seed, encoding)
+            entry = cache.lookup(key) if key is not None else None
+            if cache_span is not None:
+                cache_span.attrs["hit"] = entry is not None
+        if entry is not None:
+            print(f"♻️ Result cache hit {key[:12]} for job {job_id}; skipping GPU dispatch")
+            job = GenerationJob(
+                prompt=prompt, style=style, width=width, height=height, seed=seed,
+                result_format=result_format, encoding=encoding,
+            )
+            result = cached_result(entry, job)
+        else:
+            generator = QwenGenerator()
+            with span(trace, "generate_remote") as remote_span:
+                result = generator.generate.remote(
+                    prompt=prompt,
+                    style=style,
+                    width=width,
+                    height=height,
+                    seed=seed,
+                    result_format=result_format,
+                    encoding=encoding,
+                    progress_id=job_id if publisher is not None else None,
+                )
+            remote_tree = result.get("metadata", {}).get("trace")
+            if remote_span is not None and remote_tree is not None:
+                # The GPU container's own tree; the gap around it is container acquire
+                trace.attach(remote_tree, remote_span)
+        if direct_upload:
+            with span(trace, "upload"):
+                result = store_result(job_id, result, upload_url, object_key, user_id)
+    except Exception as e:
+        # Delivered like any other failure so the job doesn't sit in "processing"
+        print(f"❌ Job {job_id} failed: {e}")
+        result = {"success": False, "error": str(e)}
+    if trace is not None and result["success"]:
+        result["metadata"] = {**result.get("metadata", {}), "trace": trace.to_dict()}
 
     processing_time_ms = int((time.time() - start_time) * 1000)
+    with span(trace, "deliver", transport=transport):
+        deliver_result(job_id, result, processing_time_ms, transport=transport)
+    if publisher is not None:
+        publisher.reporter(job_id).finish(result["success"], result.get("error"))
+    if trace is not None:
+        trace.export()
 
-    if webhook_url:
-        payload = {
-            "job_id": job_id,
-            "processing_time_ms": processing_time_ms,
-        }
-        if result["success"]:
-            payload.update({
-                "status": "completed",
-                "image_base64": result["image_base64"],
-                "metadata": result["metadata"],
-            })
-        else:
-            payload.update({
-                "status": "failed",
-                "error": result.get("error", "Unknown error"),
-            })
+    return {"success": True}
+
+@app.function(
+    image=image,
+    secrets=[modal.Secret.from_name("tenkaigen-secrets")],
+    volumes={MODEL_CACHE_PATH: model_volume},
+    timeout=900,
+)
+def replay_webhooks() -> dict:
+    """Re-send dead-lettered webhook requests; delivered ones are removed from the store."""
+    import asyncio
+    from qwen_runtime.delivery import WebhookDeliverer, dead_letter_store_from_env
+
+    async def replay():
+        deliverer = WebhookDeliverer(dead_letters=dead_letter_store_from_env(), batch_window_s=0)
         try:
-            requests.post(webhook_url, json=payload, timeout=30)
-        except Exception as _e:
-            print(f"❌ Webhook error for job {job_id}: {_e}")
-    else:
-        print("⚠️ TENKAIGEN_WEBHOOK_URL not configured, skipping webhook")
+            return await deliverer.replay_dead_letters()
+        finally:
+            await deliverer.aclose()
+
+    model_volume.reload()
+    outcome = asyncio.run(replay())
+    model_volume.commit()
+    print(f"📬 Replayed {len(outcome)} dead-lettered webhooks, {sum(outcome.values())} delivered")
+    return outcome
+
+
+# Job queue in front of the GPU pool (TENKAIGEN_DISPATCH_MODE=queue)
+@app.cls(
+    image=image,
+    secrets=[modal.Secret.from_name("tenkaigen-secrets")],
+    min_containers=1,  # holds the queue; must outlive idle periods
+    max_containers=1,  # one scheduler owns every slot
+    volumes={MODEL_CACHE_PATH: model_volume},  # for the dead letters of timed-out jobs
+    timeout=900,
+)
+@modal.concurrent(max_inputs=INGRESS_CONCURRENT_INPUTS)
+class JobQueue:
+    """
+    Priority and fair-share scheduler between the web endpoint and QwenGenerator
+
+    Jobs wait here instead of being spawned straight onto the GPU pool. A
+    dispatcher thread starts `QwenGenerator.run_job` whenever the scheduler has
+    a free slot (see qwen_runtime.scheduler), and run_job reports back through
+    `complete`; a job whose worker never does is dispatched again, up to
+    TENKAIGEN_QUEUE_MAX_ATTEMPTS times, and then failed through the webhook.
+    A job identical to one already queued or running attaches to it instead
+    of running again, and run_job delivers the result to it too (see
+    qwen_runtime.coalescing). New jobs that would miss their class's latency
+    SLO are rejected with a Retry-After, or run downgraded if they are batch
+    jobs (see qwen_runtime.admission). An autoscale thread sets QwenGenerator's
+    min and buffer containers from the arrivals, backlog and run times it
+    sees (see qwen_runtime.autoscaling). Queued and running jobs are mirrored to a
+    Modal Dict so a restarted container picks them up again; a job that was
+    running at the time runs twice, which the webhook's idempotency key absorbs.
+    """
+
+    @modal.enter()
+    def start(self):
+        import threading
+        import time
+        from qwen_runtime.admission import admission_from_env
+        from qwen_runtime.autoscaling import Autoscaler, policy_from_env
+        from qwen_runtime.buckets import bucket_table_from_env
+        from qwen_runtime.job_queue import JobQueueCore
+        from qwen_runtime.scheduler import scheduler_from_env
+
+        self._wake = threading.Event()
+        coalesce = os.environ.get("TENKAIGEN_COALESCE", "1").lower() in ("1", "true", "yes")
+        max_attempts = int(os.environ.get("TENKAIGEN_QUEUE_MAX_ATTEMPTS", "2"))
+        scheduler = scheduler_from_env()
+        self._core = JobQueueCore(
+            scheduler,
+            coalesce=coalesce,
+            max_attempts=max_attempts,
+            admission=admission_from_env(service_time_s=scheduler.service_time_s, buckets=bucket_table_from_env()),
+        )
+        self._autoscaler = None
+        if os.environ.get("TENKAIGEN_AUTOSCALE", "1").lower() in ("1", "true", "yes"):
+            policy = policy_from_env(inputs_per_container=MAX_CONCURRENT_INPUTS, slots=scheduler.slots)
+            self._autoscaler = Autoscaler(policy, service_time_s=scheduler.service_time_s)
+        self._pending = modal.Dict.from_name("tenkaigen-job-queue", create_if_missing=True)
+        entries = sorted((entry for _, entry in self._pending.items()), key=lambda e: e["submitted_at"])
+        if entries:
+            # Already accepted once: not subject to admission control again
+            self._core.submit(entries, time.time(), admit=False)
+            print(f"📥 Restored {len(entries)} queued jobs")
+        threading.Thread(target=self._dispatch_loop, name="job-queue-dispatch", daemon=True).start()
+        if self._autoscaler is not None:
+            threading.Thread(target=self._autoscale_loop, name="job-queue-autoscale", daemon=True).start()
+
+    @modal.method()
+    def submit(self, entries: List[dict]) -> List[dict]:
+        """
+        Queue jobs; returns their status (position, ETA) in submission order
+
+        Each entry has job_id, tenant, priority, submitted_at and the
+        `run_job` kwargs as payload. Jobs refused by admission control come
+        back as {"state": "rejected", "retry_after_s", ...} and are not kept.
+        """
+        import time
+
+        now = time.time()
+        statuses = self._core.submit(entries, now)
+        if self._autoscaler is not None:
+            # Rejected jobs count too: they are demand the pool couldn't take
+            self._autoscaler.observe_arrival(now, len(entries))
+        # Mirrored after the decision; a crash in between loses only the
+        # Dict copy of jobs the ingress has not acknowledged yet
+        accepted = {e["job_id"]: e for e, s in zip(entries, statuses) if s["state"] != "rejected"}
+        if accepted:
+            self._pending.update(accepted)
+        self._wake.set()
+        return statuses
+
+    @modal.method()
+    def status(self, job_id: str) -> dict:
+        import time
+
+        return self._core.status(job_id, time.time())
+
+    @modal.method()
+    def complete(self, job_id: str, duration_s: Optional[float] = None) -> List[dict]:
+        """
+        Free a finished job's slot; returns the coalesced followers owed its result
+
+        Each follower comes with its job_id, submitted_at and its own upload
+        target (upload_url, object_key, user_id).
+        """
+        import time
+
+        followers = self._core.complete(job_id, time.time(), duration_s=duration_s)
+        if self._autoscaler is not None and duration_s is not None:
+            self._autoscaler.observe_service(duration_s)
+        for done in [job_id] + [f["job_id"] for f in followers]:
+            self._pending.pop(done, None)
+        self._wake.set()
+        return [
+            {
+                "job_id": f["job_id"],
+                "submitted_at": f["submitted_at"],
+                **{k: f["payload"].get(k) for k in ("upload_url", "object_key", "user_id")},
+            }
+            for f in followers
+        ]
+
+    @modal.method()
+    def stats(self) -> dict:
+        import time
+
+        stats = self._core.stats()
+        if self._autoscaler is not None:
+            stats["autoscaling"] = self._autoscaler.stats(time.time())
+        return stats
+
+    def _dispatch_loop(self):
+        import time
+        from qwen_runtime.delivery import deliver_result
+
+        while True:
+            job, failed = self._core.claim(time.time())
+            for job_id in failed:
+                print(f"⚠️ Job {job_id} never reported back; failing it")
+                entry = self._pending.pop(job_id, None) or {}
+                processing_time_ms = int((time.time() - entry.get("submitted_at", time.time())) * 1000)
+                if not deliver_result(job_id, {"success": False, "error": "Generation timed out"}, processing_time_ms):
+                    # Possibly dead-lettered; this container runs for days, so don't wait for its exit
+                    model_volume.commit()
+            if job is None:
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+                continue
+            try:
+                QwenGenerator().run_job.spawn(**job.payload, queued=True, dispatched_at=time.time())
+            except Exception as e:
+                print(f"⚠️ Could not dispatch job {job.job_id}: {e}")
+                self._core.requeue(job.job_id, time.time())
+                time.sleep(1.0)
+
+    def _autoscale_loop(self):
+        import time
+
+        interval = float(os.environ.get("TENKAIGEN_AUTOSCALE_INTERVAL_S", "30"))
+        while True:
+            time.sleep(interval)
+            stats = self._core.stats()
+            self._autoscaler.observe_queue(sum(stats["queued"].values()), stats["running"])
+            rec = self._autoscaler.update(time.time())
+            if rec is None:
+                continue
+            try:
+                QwenGenerator().update_autoscaler(
+                    min_containers=rec.min_containers,
+                    buffer_containers=rec.buffer_containers,
+                )
+                print(
+                    f"📈 GPU pool: min_containers={rec.min_containers} buffer_containers={rec.buffer_containers} "
+                    f"({rec.arrival_rate * 60:.1f} jobs/min, {rec.service_time_s:.1f}s/job, load {rec.offered_load:.1f})"
+                )
+            except Exception as e:
+                print(f"⚠️ Could not update the GPU autoscaler: {e}")
+                self._autoscaler.reset()
 
-    return {"success": True}
 
 # FastAPI web endpoint
 @app.function(
     image=image,
     secrets=[modal.Secret.from_name("tenkaigen-secrets")],
+    volumes={MODEL_CACHE_PATH: model_volume, RESULT_CACHE_PATH: result_cache_volume},
     timeout=900,  # 15 minutes max
 )
+@modal.concurrent(max_inputs=INGRESS_CONCURRENT_INPUTS)
 @modal.asgi_app()
 def fastapi_app():
-    from fastapi import FastAPI, Request
-    
-    web_app = FastAPI()
-    
-    @web_app.get("/")
-    async def healthcheck():
-        return {"ok": True}
-    
-    @web_app.post("/")
-    async def generate_endpoint_handler(request: Request):
-        """
-        Web endpoint for image generation
-        
-        POST / with JSON body:
-        {
-            "job_id": "uuid",  // required - job ID from database
-            "prompt": "...",
-            "style": "Anime",  // optional
-            "width": 1664,     // optional
-            "height": 928,     // optional
-            "seed": 12345      // optional
-        }
-        
-        Calls webhook at completion to report results
-        """
-        import time
-        import requests
-        
-        start_time = time.time()
-        
-        # Parse request body safely
-        try:
-            body = await request.json()
-        except Exception:
-            return {"success": False, "error": "Invalid JSON body"}
-        
-        # Extract parameters
-        job_id = body.get("job_id", "")
-        prompt = body.get("prompt", "")
-        style = body.get("style")
-        width = body.get("width", 1664)
-        height = body.get("height", 928)
-        seed = body.get("seed")
-        
-        webhook_url = os.environ.get("TENKAIGEN_WEBHOOK_URL")
-        
-        if not job_id:
-            return {
-                "success": False,
-                "error": "job_id is required"
-            }
-        
-        if not prompt:
-            # Report failure to webhook
-            if webhook_url:
-                requests.post(webhook_url, json={
-                    "job_id": job_id,
-                    "status": "failed",
-                    "error": "Prompt is required"
-                })
-            return {
-                "success": False,
-                "error": "Prompt is required"
+    """
+    Ingress: POST / for one job, POST /batch for many (see qwen_runtime.ingress)
+
+    Seeded jobs the result cache already holds go to the CPU relay, which
+    serves them without touching a GPU container. Everything else goes to
+    `JobQueue` in queue mode (the default), or is spawned straight on
+    `QwenGenerator.run_job` in direct mode; either way the GPU container calls
+    the webhook itself. GET /metrics renders the counters every container
+    pushes to the "tenkaigen-metrics" Dict (see qwen_runtime.telemetry), and
+    GET /progress streams the steps they publish to "tenkaigen-progress"
+    (see qwen_runtime.progress).
+    """
+    import asyncio
+    from qwen_runtime.delivery import WebhookDeliverer, dead_letter_store_from_env
+    from qwen_runtime.ingress import create_app, job_rows, spawn_many
+    from qwen_runtime.progress import progress_enabled
+    from qwen_runtime import telemetry
+
+    dispatch_mode = os.environ.get("TENKAIGEN_DISPATCH_MODE", "queue").lower()
+    relay_columns = (
+        "job_id", "prompt", "style", "width", "height", "seed",
+        "upload_url", "object_key", "user_id", "encoding",
+    )
+    direct_columns = (
+        "job_id", "prompt", "style", "width", "height", "seed",
+        "num_inference_steps", "cfg_scale", "submitted_at",
+        "upload_url", "object_key", "user_id", "encoding",
+    )
+
+    def cached_flags(jobs) -> list:
+        # Volume / S3 lookups block, so this runs in a worker thread
+        cache = _job_result_cache()
+        flags = []
+        for job in jobs:
+            key = _cache_key(job.prompt, job.style, job.width, job.height, job.seed, job.encoding)
+            flags.append(key is not None and cache.contains(key))
+        return flags
+
+    async def dispatch(jobs, submitted_at: float) -> Optional[dict]:
+        if dispatch_mode == "relay":
+            relay, direct = jobs, []
+        else:
+            flags = await asyncio.to_thread(cached_flags, jobs)
+            relay = [job for job, cached in zip(jobs, flags) if cached]
+            direct = [job for job, cached in zip(jobs, flags) if not cached]
+        if dispatch_mode == "queue":
+            gpu = enqueue(direct, submitted_at)
+        else:
+            gpu = spawn_many(
+                QwenGenerator().run_job,
+                # Steps and CFG stay unset so the GPU container resolves them from its backend
+                job_rows(direct, direct_columns, num_inference_steps=None, cfg_scale=None, submitted_at=submitted_at),
+            )
+        _, statuses = await asyncio.gather(spawn_many(process_job, job_rows(relay, relay_columns)), gpu)
+        return statuses if dispatch_mode == "queue" else None
+
+    async def enqueue(jobs, submitted_at: float) -> dict:
+        """Queue statuses by job_id, including admission rejections."""
+        if not jobs:
+            return {}
+        entries = [
+            {
+                "job_id": job.job_id,
+                # Anonymous jobs are their own tenant
+                "tenant": job.user_id or job.job_id,
+                "priority": job.priority,
+                "submitted_at": submitted_at,
+                "payload": {
+                    "job_id": job.job_id, "prompt": job.prompt, "style": job.style,
+                    "width": job.width, "height": job.height, "seed": job.seed,
+                    "submitted_at": submitted_at, "upload_url": job.upload_url,
+                    "object_key": job.object_key, "user_id": job.user_id, "encoding": job.encoding,
+                },
             }
-        
-        print(f"🎨 Starting generation for job {job_id}")
-        
-        # Spawn background worker to avoid HTTP timeouts
-        process_job.spawn(job_id, prompt, style, width, height, seed)
-        
-        # Respond immediately; webhook will deliver results
-        return {"success": True, "job_id": job_id}
-    
-    return web_app
+            for job in jobs
+        ]
+        statuses = await JobQueue().submit.remote.aio(entries)
+        return {entry["job_id"]: status for entry, status in zip(entries, statuses)}
+
+    async def job_status(job_id: str) -> dict:
+        return await JobQueue().status.remote.aio(job_id)
+
+    pusher = _push_metrics("ingress")
+    progress_store = _progress_store()
+
+    async def progress(job_id: str) -> Optional[dict]:
+        return await progress_store.get.aio(job_id)
+
+    def exposition() -> str:
+        # Push first so this container's own counts are current in the scrape
+        pusher.push()
+        return telemetry.render(telemetry.collect(pusher.store))
+
+    async def metrics() -> str:
+        return await asyncio.to_thread(exposition)
+
+    return create_app(
+        dispatch,
+        webhook_factory=lambda: WebhookDeliverer(dead_letters=dead_letter_store_from_env()),
+        job_status=job_status if dispatch_mode == "queue" else None,
+        metrics=metrics if pusher is not None else None,
+        progress=progress if progress_enabled() else None,
+    )
 
 
 # CLI command for local testing
@@ -0,0 +1,8 @@
+"""
+GPU-free runtime helpers for the TenkaiGen Qwen generator.
+
+Everything in this package imports only the standard library at module level so
+it can be loaded by the Modal client at deploy time and exercised on a CPU-only
+box. Heavy dependencies (torch, PIL, diffusers) are imported lazily inside the
+functions that need them.
+"""
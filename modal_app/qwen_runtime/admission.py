@@ -0,0 +1,223 @@
+"""
+Admission control for the job queue
+
+Without it every request is accepted however deep the backlog, and under a
+spike jobs wait for minutes before timing out in the GPU function.
+`AdmissionController` estimates, per new job, how long it would wait given
+the jobs ahead of it, the free slots and the mean of recent per-image run
+times, and compares wait + run time with the latency SLO of its priority
+class:
+
+- within the SLO: admit
+- low-priority class past `downgrade_at` x SLO: admit downgraded (fewer
+  steps and a smaller generation size, fitted back to the requested output)
+  if that meets the SLO, so the backlog drains faster
+- otherwise: reject, with Retry-After set to the time the excess should take
+  to drain
+
+Like the scheduler it takes all state as arguments, so `sim_admission.py`
+can replay arrival traces against it deterministically.
+"""
+import math
+import os
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Optional, Sequence
+
+from .buckets import BucketTable
+
+DEFAULT_SLO_S = {"interactive": 120.0, "batch": 900.0}
+DEFAULT_DOWNGRADE = {"steps_scale": 0.5, "size_scale": 0.75}
+MIN_DOWNGRADED_STEPS = 2
+# run_job's default size, for payloads that leave it out
+DEFAULT_SIZE = (1664, 928)
+
+
+@dataclass
+class Decision:
+    action: str  # "admit", "downgrade" or "reject"
+    estimated_wait_s: float
+    retry_after_s: Optional[float] = None
+    downgrade: Optional[Dict[str, float]] = None
+
+
+def downgrade_speedup(
+    downgrade: Dict[str, float],
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    buckets: Optional[BucketTable] = None,
+) -> float:
+    """
+    Expected run-time factor: steps scale linearly, run time with pixels
+
+    Given the job's size, the pixel ratio is that of the bucket the job runs
+    at and the size `apply_downgrade` picks for it, which is the bucket
+    itself when the table has no smaller one of that aspect ratio. Without a
+    size it is the nominal square of size_scale.
+    """
+    steps_scale = downgrade.get("steps_scale", 1.0)
+    if width is None or height is None:
+        return steps_scale * downgrade.get("size_scale", 1.0) ** 2
+    table = buckets if buckets is not None else BucketTable(None)
+    width, height = table.nearest(width, height)
+    smaller = table.downscaled(width, height, downgrade.get("size_scale", 1.0))
+    return steps_scale * smaller[0] * smaller[1] / (width * height)
+
+
+class AdmissionController:
+    """
+    Args:
+        slo_s: End-to-end latency target (wait + run) per priority class;
+            classes without one are always admitted
+        downgrade_classes: Classes that may be downgraded under load
+        downgrade_at: Fraction of the SLO the estimated wait must pass before
+            downgrading starts
+        downgrade: steps_scale and size_scale applied to downgraded jobs
+        service_time_s: Run-time estimate until latencies have been observed
+        window: Recent run times kept for the estimate
+        buckets: The generator's bucket table, which decides how much
+            smaller a downgraded job of a given size actually runs
+    """
+
+    def __init__(
+        self,
+        slo_s: Optional[Dict[str, float]] = None,
+        downgrade_classes: Sequence[str] = ("batch",),
+        downgrade_at: float = 0.5,
+        downgrade: Optional[Dict[str, float]] = None,
+        service_time_s: float = 15.0,
+        window: int = 200,
+        buckets: Optional[BucketTable] = None,
+    ):
+        self.slo_s = dict(DEFAULT_SLO_S if slo_s is None else slo_s)
+        self.downgrade_classes = tuple(downgrade_classes)
+        self.downgrade_at = downgrade_at
+        self.downgrade = dict(downgrade or DEFAULT_DOWNGRADE)
+        self.buckets = buckets
+        self._initial_service_s = service_time_s
+        self._recent: deque = deque(maxlen=max(1, window))
+        self.admitted = 0
+        self.downgraded = 0
+        self.rejected = 0
+
+    def speedup(self, width: Optional[int] = None, height: Optional[int] = None) -> float:
+        """Run-time factor of downgrading a job of this size (DEFAULT_SIZE if not given)."""
+        return downgrade_speedup(self.downgrade, width or DEFAULT_SIZE[0], height or DEFAULT_SIZE[1], self.buckets)
+
+    def observe(
+        self, duration_s: float, downgraded: bool = False, width: Optional[int] = None, height: Optional[int] = None
+    ) -> None:
+        """Record a finished job's run time (normalized to a full-quality job)."""
+        if duration_s <= 0:
+            return
+        if downgraded:
+            duration_s /= self.speedup(width, height)
+        self._recent.append(duration_s)
+
+    @property
+    def service_time_s(self) -> float:
+        if not self._recent:
+            return self._initial_service_s
+        return sum(self._recent) / len(self._recent)
+
+    def estimate_wait(self, ahead: int, running: int, slots: int) -> float:
+        """Seconds until a job with `ahead` queued jobs in front of it starts."""
+        free = max(0, slots - running)
+        if ahead < free:
+            return 0.0
+        # Slots free up at slots / service_time per second on average
+        return (ahead - free + 1) * self.service_time_s / max(1, slots)
+
+    def decide(
+        self,
+        priority: str,
+        ahead: int,
+        running: int,
+        slots: int,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> Decision:
+        wait = self.estimate_wait(ahead, running, slots)
+        slo = self.slo_s.get(priority)
+        if slo is None:
+            self.admitted += 1
+            return Decision("admit", wait)
+        if self._should_downgrade(priority, wait, slo):
+            latency = wait + self.service_time_s * self.speedup(width, height)
+            if latency <= slo:
+                self.downgraded += 1
+                return Decision("downgrade", wait, downgrade=dict(self.downgrade))
+        else:
+            latency = wait + self.service_time_s
+            if latency <= slo:
+                self.admitted += 1
+                return Decision("admit", wait)
+        self.rejected += 1
+        return Decision("reject", wait, retry_after_s=float(max(1, math.ceil(latency - slo))))
+
+    def _should_downgrade(self, priority: str, wait: float, slo: float) -> bool:
+        return priority in self.downgrade_classes and wait > self.downgrade_at * slo
+
+    def stats(self) -> dict:
+        return {
+            "service_time_s": round(self.service_time_s, 3),
+            "admitted": self.admitted,
+            "downgraded": self.downgraded,
+            "rejected": self.rejected,
+            "slo_s": dict(self.slo_s),
+        }
+
+
+def apply_downgrade(job: Any, downgrade: Dict[str, float], default_steps: int, buckets: Optional[BucketTable] = None) -> Any:
+    """
+    GenerationJob with fewer steps and a smaller generation size
+
+    Call after bucket snapping: the output size stays what was requested and
+    the smaller image is fitted up to it. With a `BucketTable` the smaller
+    size is a configured bucket of the same aspect ratio (see
+    `BucketTable.downscaled`), so downgraded jobs keep sharing warmed-up
+    shapes; without one the scaled size is used as is.
+    """
+    steps = job.num_inference_steps or default_steps
+    steps = max(MIN_DOWNGRADED_STEPS, math.ceil(steps * downgrade.get("steps_scale", 1.0)))
+    table = buckets if buckets is not None else BucketTable(None)
+    width, height = table.downscaled(job.width, job.height, downgrade.get("size_scale", 1.0))
+    return replace(
+        job,
+        num_inference_steps=steps,
+        width=width,
+        height=height,
+        output_width=job.output_width or job.width,
+        output_height=job.output_height or job.height,
+    )
+
+
+def parse_mapping(raw: str) -> Dict[str, float]:
+    """"interactive=120,batch=900" -> {"interactive": 120.0, "batch": 900.0}."""
+    mapping = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip():
+            mapping[name.strip()] = float(value)
+    return mapping
+
+
+def admission_from_env(service_time_s: float = 15.0, buckets: Optional[BucketTable] = None) -> Optional[AdmissionController]:
+    """
+    AdmissionController configured from the environment, or None when off
+
+    TENKAIGEN_SLO_S ("interactive=120,batch=900" by default, "off" disables),
+    TENKAIGEN_DOWNGRADE_AT (default 0.5) and TENKAIGEN_DOWNGRADE
+    ("steps_scale=0.5,size_scale=0.75").
+    """
+    raw = os.environ.get("TENKAIGEN_SLO_S")
+    if raw is not None and raw.strip().lower() in ("", "off", "0", "none"):
+        return None
+    downgrade = os.environ.get("TENKAIGEN_DOWNGRADE")
+    return AdmissionController(
+        slo_s=parse_mapping(raw) if raw else None,
+        downgrade_at=float(os.environ.get("TENKAIGEN_DOWNGRADE_AT", "0.5")),
+        downgrade=parse_mapping(downgrade) if downgrade else None,
+        service_time_s=service_time_s,
+        buckets=buckets,
+    )
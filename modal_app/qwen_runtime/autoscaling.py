@@ -0,0 +1,214 @@
+"""
+Warm-container policy for the GPU pool
+
+With a fixed `scaledown_window` and no minimum, the pool cold-starts through
+every morning ramp and keeps idle GPUs for five minutes after every burst.
+`Autoscaler` keeps a rolling view of arrivals, queue depth and per-image run
+time and turns it into the `min_containers` / `buffer_containers` pair that
+`JobQueue` applies to `QwenGenerator` with `update_autoscaler`:
+
+- offered load, in concurrent jobs, is arrival rate x run time (Little's law),
+  plus what it takes to drain the current backlog within `drain_s`
+- `min_containers` covers that load at `target_utilization`
+- `buffer_containers` adds `headroom` x sqrt(load) slots on top (square-root
+  staffing), so an ordinary burst lands on a warm container; off by default,
+  since `sim_autoscale.py` shows it costs more than the cold starts it saves
+  at today's traffic
+
+Scaling up is applied at once. Scaling down waits until the desired count has
+stayed lower for `scale_down_after_s`, and then goes to the highest count
+asked for in that time, so a lull between two bursts doesn't release
+containers that are about to be needed again.
+
+Like the scheduler it takes the clock as an argument, so `sim_autoscale.py`
+can replay a logged arrival trace through the same code.
+"""
+import math
+import os
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Deque, Optional, Tuple
+
+
+@dataclass
+class AutoscalePolicy:
+    """
+    Args:
+        inputs_per_container: Jobs one GPU container runs at once
+            (QWEN_MAX_CONCURRENT_INPUTS)
+        target_utilization: Share of warm capacity the offered load may fill
+        headroom: Burst buffer in units of sqrt(offered load)
+        drain_s: Time the current backlog should be cleared in
+        min_floor: Containers kept warm regardless of traffic
+        max_containers: Upper bound on the recommendation
+        scale_down_after_s: How long a lower count must hold before applying it
+        window_s: Span of the rolling arrival and run-time view
+    """
+
+    inputs_per_container: int = 4
+    target_utilization: float = 0.9
+    headroom: float = 0.0
+    drain_s: float = 120.0
+    min_floor: int = 0
+    max_containers: int = 10
+    scale_down_after_s: float = 900.0
+    window_s: float = 600.0
+
+
+@dataclass
+class Recommendation:
+    min_containers: int
+    buffer_containers: int
+    arrival_rate: float  # jobs/s over the window
+    service_time_s: float
+    offered_load: float  # concurrent jobs, backlog drain included
+
+    def settings(self) -> Tuple[int, int]:
+        return self.min_containers, self.buffer_containers
+
+
+class Autoscaler:
+    """
+    Rolling load view plus the hysteresis around the recommendation
+
+    Thread-safe: `JobQueue` feeds arrivals and run times from its request
+    threads while its autoscale thread calls `update`.
+    """
+
+    def __init__(self, policy: Optional[AutoscalePolicy] = None, service_time_s: float = 15.0):
+        self.policy = policy or AutoscalePolicy()
+        self._lock = threading.Lock()
+        self._arrivals: Deque[Tuple[float, int]] = deque()
+        self._arrival_count = 0
+        self._first_arrival: Optional[float] = None
+        self._service: deque = deque(maxlen=256)
+        self._initial_service_s = service_time_s
+        self._queued = 0
+        self._running = 0
+        self.current: Optional[Tuple[int, int]] = None
+        self._lower_since: Optional[float] = None
+        self._lower_peak: Tuple[int, int] = (0, 0)
+        self.changes = 0
+
+    # -- observations -----------------------------------------------------
+
+    def observe_arrival(self, now: float, count: int = 1) -> None:
+        with self._lock:
+            if self._first_arrival is None:
+                self._first_arrival = now
+            self._arrivals.append((now, count))
+            self._arrival_count += count
+            self._trim(now)
+
+    def observe_service(self, duration_s: float) -> None:
+        if duration_s > 0:
+            with self._lock:
+                self._service.append(duration_s)
+
+    def observe_queue(self, queued: int, running: int) -> None:
+        with self._lock:
+            self._queued = queued
+            self._running = running
+
+    def _trim(self, now: float) -> None:
+        horizon = now - self.policy.window_s
+        while self._arrivals and self._arrivals[0][0] < horizon:
+            self._arrival_count -= self._arrivals.popleft()[1]
+
+    # -- policy -----------------------------------------------------------
+
+    def recommend(self, now: float) -> Recommendation:
+        """Desired settings for the current load, before hysteresis."""
+        p = self.policy
+        with self._lock:
+            self._trim(now)
+            if self._first_arrival is None:
+                rate = 0.0
+            else:
+                # A young window would overstate the rate of the first arrivals
+                span = min(p.window_s, max(now - self._first_arrival, p.window_s / 10))
+                rate = self._arrival_count / span
+            service = sum(self._service) / len(self._service) if self._service else self._initial_service_s
+            queued, running = self._queued, self._running
+
+        # Jobs in service at the arrival rate, or what is running now if higher
+        load = max(rate * service, float(running))
+        load += queued * service / p.drain_s
+        per_container = max(1, p.inputs_per_container)
+        base = math.ceil(load / (p.target_utilization * per_container) - 1e-9)
+        base = min(p.max_containers, max(p.min_floor, base))
+        burst = p.headroom * math.sqrt(load) if load > 0 else 0.0
+        buffer = min(p.max_containers - base, math.ceil(burst / per_container - 1e-9))
+        return Recommendation(base, max(0, buffer), rate, service, load)
+
+    def update(self, now: float) -> Optional[Recommendation]:
+        """The recommendation if the settings should change now, else None."""
+        rec = self.recommend(now)
+        wanted = rec.settings()
+        with self._lock:
+            current = self.current
+            if current is not None and wanted == current:
+                self._lower_since = None
+                return None
+            if current is None or sum(wanted) > sum(current) or wanted[0] > current[0]:
+                self._lower_since = None
+                return self._apply(rec, wanted)
+            # Lower: hold the current settings until it has stayed lower long enough
+            if self._lower_since is None:
+                self._lower_since = now
+                self._lower_peak = wanted
+                return None
+            self._lower_peak = max(self._lower_peak, wanted, key=sum)
+            if now - self._lower_since < self.policy.scale_down_after_s:
+                return None
+            target = self._lower_peak
+            self._lower_since = None
+            if target == current:
+                return None
+            rec.min_containers, rec.buffer_containers = target
+            return self._apply(rec, target)
+
+    def reset(self) -> None:
+        """Forget the applied settings (they failed to apply) so the next update retries."""
+        with self._lock:
+            self.current = None
+            self._lower_since = None
+
+    def _apply(self, rec: Recommendation, settings: Tuple[int, int]) -> Recommendation:
+        self.current = settings
+        self.changes += 1
+        return rec
+
+    def stats(self, now: float) -> dict:
+        rec = self.recommend(now)
+        return {
+            "current": None if self.current is None else dict(zip(("min_containers", "buffer_containers"), self.current)),
+            "recommended": {"min_containers": rec.min_containers, "buffer_containers": rec.buffer_containers},
+            "arrival_rate_per_min": round(rec.arrival_rate * 60, 2),
+            "service_time_s": round(rec.service_time_s, 3),
+            "offered_load": round(rec.offered_load, 2),
+            "changes": self.changes,
+            "policy": asdict(self.policy),
+        }
+
+
+def policy_from_env(inputs_per_container: int = 4, slots: Optional[int] = None) -> AutoscalePolicy:
+    """
+    AutoscalePolicy from TENKAIGEN_AUTOSCALE_* variables
+
+    TENKAIGEN_AUTOSCALE_MAX defaults to the containers the queue's slots can
+    keep busy, since `JobQueue` never runs more jobs than that.
+    """
+    env = os.environ.get
+    default_max = math.ceil(slots / max(1, inputs_per_container)) if slots else AutoscalePolicy.max_containers
+    return AutoscalePolicy(
+        inputs_per_container=inputs_per_container,
+        target_utilization=float(env("TENKAIGEN_AUTOSCALE_UTILIZATION", "0.9")),
+        headroom=float(env("TENKAIGEN_AUTOSCALE_HEADROOM", "0")),
+        drain_s=float(env("TENKAIGEN_AUTOSCALE_DRAIN_S", "120")),
+        min_floor=int(env("TENKAIGEN_AUTOSCALE_MIN", "0")),
+        max_containers=int(env("TENKAIGEN_AUTOSCALE_MAX", str(default_max))),
+        scale_down_after_s=float(env("TENKAIGEN_AUTOSCALE_DOWN_AFTER_S", "900")),
+        window_s=float(env("TENKAIGEN_AUTOSCALE_WINDOW_S", "600")),
+    )
@@ -0,0 +1,407 @@
+"""
+Micro-batching for QwenGenerator
+
+Jobs that share (width, height, steps, cfg) can run through one pipeline call with
+a list of prompts and one generator per item. `MicroBatcher` collects jobs that
+arrive within a short window, groups the compatible ones and fans the per-image
+results back out to each caller.
+
+Encoding runs on an optional `EncoderPool`, so every runner returns Futures:
+the pipeline thread can move on to the next batch as soon as the images exist.
+"""
+import base64
+import secrets
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .encoding import EncodeOptions, EncoderPool, encode_image
+from .metrics import PipelineMetrics
+from .progress import ProgressCallback
+from .tracing import StepRecorder, gpu_peak_bytes, reset_gpu_peak, span
+
+# Defaults applied when a caller leaves steps/cfg unset
+LIGHTNING_DEFAULTS = (4, 1.0)
+STANDARD_DEFAULTS = (30, 4.0)
+
+
+class BatchKey(NamedTuple):
+    """Sampling parameters that must match for jobs to share a pipeline call."""
+    width: int
+    height: int
+    steps: int
+    cfg_scale: float
+
+
+@dataclass
+class GenerationJob:
+    """One image request, mirroring the arguments of QwenGenerator.generate."""
+    prompt: str
+    style: Optional[str] = None
+    width: int = 1024
+    height: int = 1024
+    num_inference_steps: Optional[int] = None
+    cfg_scale: Optional[float] = None
+    negative_prompt: str = " "
+    seed: Optional[int] = None
+    # "base64" (JSON-safe str) or "bytes" (raw image, no inflation)
+    result_format: str = "base64"
+    # EncodeOptions fields as a dict; None uses the container default
+    encoding: Optional[dict] = None
+    # Exact size to deliver when width/height were snapped to a resolution bucket
+    output_width: Optional[int] = None
+    output_height: Optional[int] = None
+    # "crop" or "resize", see buckets.fit_image
+    fit: str = "crop"
+    # tracing.Trace collecting this job's spans; None when tracing is off
+    trace: Optional[Any] = None
+    # progress.ProgressReporter fed from the step callback; None publishes nothing
+    progress: Optional[Any] = None
+
+
+def resolve_sampling(
+    num_inference_steps: Optional[int],
+    cfg_scale: Optional[float],
+    use_nunchaku: bool,
+) -> Tuple[int, float]:
+    """Fill in backend-specific defaults for steps and CFG."""
+    default_steps, default_cfg = LIGHTNING_DEFAULTS if use_nunchaku else STANDARD_DEFAULTS
+    steps = num_inference_steps if num_inference_steps else default_steps
+    cfg = cfg_scale if cfg_scale is not None else default_cfg
+    return int(steps), float(cfg)
+
+
+RESULT_FORMATS = ("base64", "bytes")
+
+
+def batch_key(job: GenerationJob, use_nunchaku: bool) -> BatchKey:
+    steps, cfg = resolve_sampling(job.num_inference_steps, job.cfg_scale, use_nunchaku)
+    return BatchKey(int(job.width), int(job.height), steps, cfg)
+
+
+def group_jobs(
+    jobs: List[GenerationJob],
+    use_nunchaku: bool,
+    max_batch_size: int,
+) -> List[List[int]]:
+    """
+    Split jobs into compatible groups of at most max_batch_size
+
+    Returns lists of indices into `jobs`; groups are ordered by the position of
+    their first job so earlier arrivals are served first.
+    """
+    open_groups: Dict[BatchKey, List[int]] = {}
+    groups: List[List[int]] = []
+    for idx, job in enumerate(jobs):
+        key = batch_key(job, use_nunchaku)
+        group = open_groups.get(key)
+        if group is None or len(group) >= max(1, max_batch_size):
+            group = []
+            open_groups[key] = group
+            groups.append(group)
+        group.append(idx)
+    return groups
+
+
+def _torch_generator(seed: int) -> Any:
+    import torch
+    return torch.Generator(device="cpu").manual_seed(seed)
+
+
+def _chain_callbacks(callbacks: List[Callable[..., dict]]) -> Callable[..., dict]:
+    """One `callback_on_step_end` that runs several in turn."""
+    def callback(pipe: Any, step: int, timestep: Any, callback_kwargs: dict) -> dict:
+        for cb in callbacks:
+            callback_kwargs = cb(pipe, step, timestep, callback_kwargs)
+        return callback_kwargs
+    return callback
+
+
+def _completed(value: Any) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+def _finish_item(
+    job: GenerationJob,
+    enhanced_prompt: str,
+    image: Any,
+    key: BatchKey,
+    use_nunchaku: bool,
+    batch_size: int,
+    seed: int,
+    extra_metadata: Optional[dict] = None,
+) -> dict:
+    """Fit, encode one generated image and build its result dict."""
+    output_size = (job.output_width or job.width, job.output_height or job.height)
+    try:
+        with span(job.trace, "encode") as encode_span:
+            if output_size != (job.width, job.height):
+                from .buckets import fit_image
+                image = fit_image(image, output_size[0], output_size[1], job.fit)
+            options = EncodeOptions.from_dict(job.encoding)
+            image_bytes = encode_image(image, options)
+            if encode_span is not None:
+                encode_span.attrs.update(format=options.format, bytes=len(image_bytes))
+    except Exception as e:
+        print(f"❌ Encoding failed: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+    print(f"✅ Generated image: {len(image_bytes)} bytes ({options.format})")
+    item = {"success": True, "content_type": options.content_type}
+    if job.result_format == "bytes":
+        item["image_bytes"] = image_bytes
+    else:
+        # Convert to base64 for transport
+        item["image_base64"] = base64.b64encode(image_bytes).decode('utf-8')
+    item["metadata"] = {
+        "prompt": job.prompt,
+        "enhanced_prompt": enhanced_prompt,
+        "style": job.style,
+        "width": output_size[0],
+        "height": output_size[1],
+        "bucket": f"{key.width}x{key.height}",
+        "steps": key.steps,
+        "cfg_scale": key.cfg_scale,
+        # The seed actually used, so an unseeded job can be reproduced
+        "seed": seed,
+        "nunchaku": use_nunchaku,
+        "batch_size": batch_size,
+        "format": options.format,
+        **(extra_metadata or {}),
+    }
+    return item
+
+
+def run_group(
+    pipe: Callable[..., Any],
+    jobs: List[GenerationJob],
+    *,
+    use_nunchaku: bool,
+    enhance_prompt: Callable[[str, Optional[str]], str],
+    generator_factory: Callable[[int], Any] = _torch_generator,
+    encoder: Optional[EncoderPool] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    extra_metadata: Optional[dict] = None,
+    embed_prompts: Optional[Callable[[List[str], List[str]], dict]] = None,
+) -> List[Future]:
+    """
+    Run one compatible group through a single pipeline call
+
+    Every job gets its own generator so per-item seeds are honoured inside the
+    batch; jobs without a seed get a fresh one, returned as `metadata.seed`.
+    Returns one Future per job resolving to a result dict in the same
+    shape as QwenGenerator.generate; `extra_metadata` (e.g. the placement
+    plan) is merged into each result's metadata. With an encoder pool the Futures complete
+    once encoding finishes in the background; without one they are already done.
+    `embed_prompts` (e.g. a PromptEmbeddingCache) maps the enhanced and negative
+    prompts to embedding kwargs that replace the text prompts in the call.
+
+    Jobs with a `trace` get the group's spans (batch wait, prompt encoding,
+    one span per denoising step, decode), and jobs with a `progress` reporter
+    get their step (and latent preview) published; the step callback is only
+    passed to the pipeline when at least one job needs it.
+    """
+    if not jobs:
+        return []
+    key = batch_key(jobs[0], use_nunchaku)
+    if any(batch_key(job, use_nunchaku) != key for job in jobs):
+        raise ValueError("run_group called with incompatible jobs")
+
+    traces = [job.trace for job in jobs if job.trace is not None]
+    group_start = time.time()
+    for trace in traces:
+        if "batched" in trace.marks:
+            trace.add("batch_wait", trace.marks["batched"], group_start)
+
+    enhanced_prompts = [enhance_prompt(job.prompt, job.style) for job in jobs]
+    # Not the `random` module: a memory snapshot restores its state, so every
+    # restored container would draw the same "random" seeds
+    seeds = [job.seed if job.seed is not None else secrets.randbits(32) for job in jobs]
+
+    try:
+        call_kwargs = dict(
+            prompt=enhanced_prompts,
+            negative_prompt=[job.negative_prompt for job in jobs],
+            width=key.width,
+            height=key.height,
+            num_inference_steps=key.steps,
+            generator=[generator_factory(seed) for seed in seeds],
+        )
+        if embed_prompts is not None:
+            embed_start = time.time()
+            try:
+                embeddings = embed_prompts(call_kwargs["prompt"], call_kwargs["negative_prompt"])
+            except Exception as e:
+                print(f"⚠️ Prompt embedding cache failed ({e}); encoding in the pipeline")
+            else:
+                del call_kwargs["prompt"], call_kwargs["negative_prompt"]
+                call_kwargs.update(embeddings)
+            embed_end = time.time()
+            for trace in traces:
+                trace.add("encode_prompt", embed_start, embed_end)
+        # Use true_cfg for Lightning, guidance_scale for standard
+        if use_nunchaku:
+            call_kwargs["true_cfg_scale"] = key.cfg_scale
+        else:
+            call_kwargs["guidance_scale"] = key.cfg_scale
+        callbacks: List[Callable[..., dict]] = []
+        steps = None
+        if traces:
+            steps = StepRecorder()
+            callbacks.append(steps)
+            reset_gpu_peak()
+        progress = None
+        if any(job.progress is not None for job in jobs):
+            progress = ProgressCallback([job.progress for job in jobs], key.steps, key.width, key.height)
+            callbacks.append(progress)
+            if progress.wants_latents:
+                call_kwargs["callback_on_step_end_tensor_inputs"] = ["latents"]
+        if callbacks:
+            call_kwargs["callback_on_step_end"] = callbacks[0] if len(callbacks) == 1 else _chain_callbacks(callbacks)
+
+        call_start = time.time()
+        if metrics is not None:
+            with metrics.gpu_span():
+                result = pipe(**call_kwargs)
+        else:
+            result = pipe(**call_kwargs)
+        if steps is not None:
+            call_end, end_peak = time.time(), gpu_peak_bytes()
+            for trace in traces:
+                steps.record(trace, call_start, call_end, end_peak, batch_size=len(jobs))
+        images = list(result.images)
+        if len(images) != len(jobs):
+            raise RuntimeError(f"Pipeline returned {len(images)} images for {len(jobs)} prompts")
+        if progress is not None:
+            progress.fit_preview(images)
+    except Exception as e:
+        print(f"❌ Batch of {len(jobs)} failed: {str(e)}")
+        return [_completed({"success": False, "error": str(e)}) for _ in jobs]
+
+    futures = []
+    for job, enhanced_prompt, image, seed in zip(jobs, enhanced_prompts, images, seeds):
+        args = (job, enhanced_prompt, image, key, use_nunchaku, len(jobs), seed, extra_metadata)
+        if encoder is not None:
+            futures.append(encoder.submit(_finish_item, *args))
+        else:
+            futures.append(_completed(_finish_item(*args)))
+    return futures
+
+
+def run_batch(
+    pipe: Callable[..., Any],
+    jobs: List[GenerationJob],
+    *,
+    use_nunchaku: bool,
+    enhance_prompt: Callable[[str, Optional[str]], str],
+    max_batch_size: int,
+    generator_factory: Callable[[int], Any] = _torch_generator,
+    encoder: Optional[EncoderPool] = None,
+    metrics: Optional[PipelineMetrics] = None,
+    extra_metadata: Optional[dict] = None,
+    embed_prompts: Optional[Callable[[List[str], List[str]], dict]] = None,
+) -> List[Future]:
+    """Group arbitrary jobs and run each group; Futures keep the input order."""
+    results: List[Optional[Future]] = [None] * len(jobs)
+    for indices in group_jobs(jobs, use_nunchaku, max_batch_size):
+        group_results = run_group(
+            pipe,
+            [jobs[i] for i in indices],
+            use_nunchaku=use_nunchaku,
+            enhance_prompt=enhance_prompt,
+            generator_factory=generator_factory,
+            encoder=encoder,
+            metrics=metrics,
+            extra_metadata=extra_metadata,
+            embed_prompts=embed_prompts,
+        )
+        for i, res in zip(indices, group_results):
+            results[i] = res
+    return results  # type: ignore[return-value]
+
+
+class MicroBatcher:
+    """
+    Collects jobs for a short window and runs them in compatible batches
+
+    `submit` is thread-safe and returns a Future, so concurrent Modal inputs in
+    the same container can each block on their own result while a single
+    worker thread owns the pipeline.
+
+    Args:
+        run_jobs: Callable taking a list of jobs and returning one result
+            Future per job, in order
+        window_s: How long to wait for more jobs after the first one arrives
+        max_batch_size: Upper bound on jobs handed to run_jobs at once
+    """
+
+    def __init__(
+        self,
+        run_jobs: Callable[[List[GenerationJob]], List[Future]],
+        window_s: float = 0.05,
+        max_batch_size: int = 2,
+    ):
+        self.run_jobs = run_jobs
+        self.window_s = window_s
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: List[Tuple[GenerationJob, Future]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, job: GenerationJob) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._pending.append((job, future))
+            self._cond.notify()
+        return future
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _take(self) -> List[Tuple[GenerationJob, Future]]:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return []
+            deadline = time.monotonic() + self.window_s
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            # Take everything pending; run_jobs splits it into compatible groups
+            taken, self._pending = self._pending, []
+            return taken
+
+    def _loop(self) -> None:
+        while True:
+            taken = self._take()
+            if not taken:
+                return
+            jobs = [job for job, _ in taken]
+            try:
+                results = self.run_jobs(jobs)
+            except Exception as e:
+                results = [_completed({"success": False, "error": str(e)}) for _ in jobs]
+            for (_, future), inner in zip(taken, results):
+                inner.add_done_callback(lambda done, outer=future: _chain(done, outer))
+
+
+def _chain(done: Future, outer: Future) -> None:
+    error = done.exception()
+    if error is not None:
+        outer.set_result({"success": False, "error": str(error)})
+    else:
+        outer.set_result(done.result())
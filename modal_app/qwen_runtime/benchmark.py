@@ -0,0 +1,220 @@
+"""
+End-to-end generator benchmark over a fixed prompt corpus
+
+`run_matrix` pushes the same corpus through a `run_jobs` callable (the
+container's `QwenGenerator._run_jobs`, or `run_batch` over the stub pipeline)
+once per (steps, size) config and measures what a job costs from the
+container's side: latency from submission to encoded image, throughput,
+allocator peak VRAM, host RSS, and the size of the image and of the JSON
+webhook body that would carry it. The result cache is not involved, so every
+job really runs.
+
+Rows are plain dicts with sorted, rounded fields so two runs' JSON can be
+diffed; `compare` does that diff for the headline numbers.
+"""
+import json
+import os
+import statistics
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .batching import GenerationJob, resolve_sampling
+from .delivery import build_webhook_request
+from .tracing import gpu_peak_bytes, reset_gpu_peak
+
+# Fixed corpus: (prompt, style). Changing it invalidates comparisons, so add
+# a new corpus version instead of editing this one.
+CORPUS_VERSION = 1
+CORPUS: Tuple[Tuple[str, Optional[str]], ...] = (
+    ("A majestic dragon flying over mountains at sunset", None),
+    ("Minimalist line drawing of a cat curled up asleep", "Line Art"),
+    ("Retro 80s synthwave palm trees with a neon grid horizon", "Retro"),
+    ("Cute kawaii bubble tea cup with a smiling face", "Anime"),
+    ("Vintage botanical illustration of wild mushrooms", None),
+    ("Bold typography reading STAY WILD with mountain silhouettes", None),
+    ("Watercolor koi fish swimming in a circle", "Watercolor"),
+    ("Geometric low-poly wolf head in blue and purple", None),
+)
+
+# Headline fields `compare` reports, and whether higher is better
+HEADLINE = {
+    "latency_p50_s": False,
+    "latency_p95_s": False,
+    "latency_p99_s": False,
+    "images_per_hour": True,
+    "peak_vram_mb": False,
+    "host_rss_mb": False,
+    "output_bytes_mean": False,
+}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))]
+
+
+def host_rss_mb() -> Tuple[Optional[float], Optional[float]]:
+    """(current, process peak) resident set size; None where the platform doesn't say."""
+    current = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    except (ImportError, OSError):
+        peak = None
+    return current, peak
+
+
+def parse_sizes(raw: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for item in raw.split(","):
+        if item.strip():
+            width, height = item.lower().split("x")
+            sizes.append((int(width), int(height)))
+    return sizes
+
+
+def parse_steps(raw: str) -> List[Optional[int]]:
+    """Comma-separated step counts; "default" leaves steps to the backend."""
+    return [None if item.strip() == "default" else int(item) for item in raw.split(",") if item.strip()]
+
+
+def make_configs(steps: Sequence[Optional[int]], sizes: Sequence[Tuple[int, int]]) -> List[dict]:
+    return [{"steps": s, "width": w, "height": h} for s in steps for w, h in sizes]
+
+
+def corpus_jobs(
+    config: dict,
+    corpus: Sequence[Sequence[Any]] = CORPUS,
+    repeats: int = 1,
+    result_format: str = "bytes",
+    encoding: Optional[dict] = None,
+) -> List[GenerationJob]:
+    """The corpus at one config; seeds are fixed per prompt so every run draws the same images."""
+    jobs = []
+    for _ in range(max(1, repeats)):
+        for index, (prompt, style) in enumerate(corpus):
+            jobs.append(GenerationJob(
+                prompt=prompt,
+                style=style,
+                width=config["width"],
+                height=config["height"],
+                num_inference_steps=config.get("steps"),
+                seed=1000 + index,
+                result_format=result_format,
+                encoding=encoding,
+            ))
+    return jobs
+
+
+def run_config(
+    run_jobs: Callable[[List[GenerationJob]], List[Future]],
+    jobs: List[GenerationJob],
+    batch_size: int = 1,
+    warmup: int = 1,
+) -> dict:
+    """
+    Run jobs `batch_size` at a time and measure them
+
+    The first `warmup` jobs are also run once beforehand, unmeasured, so
+    lazy initialisation at a new size doesn't land in the figures.
+    """
+    for job in jobs[:warmup]:
+        run_jobs([job])[0].result()
+
+    reset_gpu_peak()
+    latencies: List[float] = []
+    output_bytes: List[int] = []
+    webhook_bytes: List[int] = []
+    failures = 0
+    start = time.perf_counter()
+    for offset in range(0, len(jobs), max(1, batch_size)):
+        group = jobs[offset:offset + max(1, batch_size)]
+        submitted = time.perf_counter()
+        futures = run_jobs(group)
+        for future in futures:
+            result = future.result()
+            latencies.append(time.perf_counter() - submitted)
+            if not result.get("success"):
+                failures += 1
+                continue
+            image = result.get("image_bytes")
+            output_bytes.append(len(image) if image is not None else len(result.get("image_base64", "")) * 3 // 4)
+            body = build_webhook_request("bench", result, 0, "json")["json"]
+            webhook_bytes.append(len(json.dumps(body)))
+    wall_s = time.perf_counter() - start
+    peak = gpu_peak_bytes()
+    rss, rss_peak = host_rss_mb()
+
+    completed = len(jobs) - failures
+    return {
+        "jobs": len(jobs),
+        "failures": failures,
+        "latency_mean_s": round(statistics.fmean(latencies), 4) if latencies else 0.0,
+        "latency_p50_s": round(percentile(latencies, 0.5), 4),
+        "latency_p95_s": round(percentile(latencies, 0.95), 4),
+        "latency_p99_s": round(percentile(latencies, 0.99), 4),
+        "images_per_hour": round(completed / wall_s * 3600, 1) if wall_s > 0 else 0.0,
+        "peak_vram_mb": round(peak / 2**20, 1) if peak is not None else None,
+        "host_rss_mb": round(rss, 1) if rss is not None else None,
+        "host_rss_peak_mb": round(rss_peak, 1) if rss_peak is not None else None,
+        "output_bytes_mean": round(statistics.fmean(output_bytes)) if output_bytes else 0,
+        "webhook_json_bytes_mean": round(statistics.fmean(webhook_bytes)) if webhook_bytes else 0,
+    }
+
+
+def run_matrix(
+    run_jobs: Callable[[List[GenerationJob]], List[Future]],
+    configs: Sequence[dict],
+    use_nunchaku: bool,
+    corpus: Sequence[Sequence[Any]] = CORPUS,
+    repeats: int = 1,
+    batch_size: int = 1,
+    warmup: int = 1,
+    encoding: Optional[dict] = None,
+) -> List[dict]:
+    """One row per config, with the steps the backend actually ran."""
+    rows = []
+    for config in configs:
+        steps, cfg = resolve_sampling(config.get("steps"), None, use_nunchaku)
+        jobs = corpus_jobs(config, corpus, repeats, encoding=encoding)
+        row = {
+            "steps": steps,
+            "cfg_scale": cfg,
+            "size": f"{config['width']}x{config['height']}",
+            "batch_size": batch_size,
+        }
+        row.update(run_config(run_jobs, jobs, batch_size=batch_size, warmup=warmup))
+        rows.append(row)
+    return rows
+
+
+def row_key(row: dict) -> Tuple:
+    return (row.get("backend"), row.get("placement"), row["steps"], row["size"], row.get("batch_size", 1))
+
+
+def compare(baseline: dict, current: dict) -> List[dict]:
+    """Relative change of the headline numbers for rows present in both reports."""
+    before = {row_key(row): row for row in baseline.get("rows", [])}
+    changes = []
+    for row in current.get("rows", []):
+        old = before.get(row_key(row))
+        if old is None:
+            continue
+        delta = {}
+        for field, higher_is_better in HEADLINE.items():
+            a, b = old.get(field), row.get(field)
+            if a and b is not None:
+                change = (b - a) / a
+                better = None if change == 0 else (change > 0) == higher_is_better
+                delta[field] = {"before": a, "after": b, "change": round(change, 4), "better": better}
+        changes.append({"backend": row.get("backend"), "placement": row.get("placement"),
+                        "steps": row["steps"], "size": row["size"], "delta": delta})
+    return changes
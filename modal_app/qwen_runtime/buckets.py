@@ -0,0 +1,154 @@
+"""
+Resolution buckets for generation requests
+
+Arbitrary sizes defeat kernel caching and compiled graphs and keep otherwise
+compatible jobs out of the same micro-batch. Requests are snapped to the
+nearest entry of a small bucket table, generated at the bucket size, and then
+fitted to the exact requested output:
+- "crop" (default): scale to cover the output, then center-crop
+- "resize": scale straight to the output size (may distort slightly)
+
+The default table holds Qwen-Image's native aspect ratios (sides rounded to
+multiples of 16, the pipeline's latent granularity) plus the 1024x1024 size
+`generate` defaults to and 3/4-size tiers of the non-square ratios that
+downgraded jobs (admission.apply_downgrade) run at. Override it with QWEN_RESOLUTION_BUCKETS
+("1664x928,928x1664,...") or disable snapping with "off".
+"""
+import math
+import os
+from dataclasses import replace
+from typing import Any, List, Optional, Tuple
+
+from .batching import GenerationJob
+
+DEFAULT_BUCKETS: List[Tuple[int, int]] = [
+    (1328, 1328),  # 1:1
+    (1024, 1024),  # 1:1, generate() default
+    (1664, 928),   # 16:9, storefront default
+    (928, 1664),   # 9:16
+    (1472, 1104),  # 4:3
+    (1104, 1472),  # 3:4
+    (1584, 1056),  # 3:2
+    (1056, 1584),  # 2:3
+    (1248, 704),   # 16:9 at 3/4 size, for downgraded jobs
+    (704, 1248),   # 9:16 at 3/4 size
+    (1088, 816),   # 4:3 at 3/4 size
+    (816, 1088),   # 3:4 at 3/4 size
+    (1200, 800),   # 3:2 at 3/4 size
+    (800, 1200),   # 2:3 at 3/4 size
+]
+FIT_MODES = ("crop", "resize")
+# Log-space aspect difference still counted as the same ratio (about 2%)
+ASPECT_TOLERANCE = 0.02
+
+
+def bucket_label(width: int, height: int) -> str:
+    return f"{width}x{height}"
+
+
+class BucketTable:
+    """
+    Snap requested sizes to the nearest bucket
+
+    Nearest means the closest aspect ratio (in log space) and, among buckets
+    with that ratio, the closest area.
+
+    Args:
+        buckets: (width, height) pairs; None or empty disables snapping
+        fit: How the bucket image is fitted to the requested size
+    """
+
+    def __init__(self, buckets: Optional[List[Tuple[int, int]]] = None, fit: str = "crop"):
+        if fit not in FIT_MODES:
+            raise ValueError(f"Unknown fit mode {fit!r}; expected one of {FIT_MODES}")
+        self.buckets = list(buckets or [])
+        self.fit = fit
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.buckets)
+
+    def nearest(self, width: int, height: int) -> Tuple[int, int]:
+        if not self.buckets:
+            return int(width), int(height)
+        aspect = math.log(width / height)
+        area = math.log(width * height)
+
+        def distance(bucket):
+            bw, bh = bucket
+            return (round(abs(aspect - math.log(bw / bh)), 3), abs(area - math.log(bw * bh)))
+
+        return min(self.buckets, key=distance)
+
+    def downscaled(self, width: int, height: int, scale: float) -> Tuple[int, int]:
+        """
+        Smaller bucket for a (width, height) job scaled by `scale` per side
+
+        Among buckets with the same aspect ratio and a smaller area, the one
+        closest in area to the scaled size; (width, height) itself when there
+        is none, so downgraded jobs only run at configured sizes. Without
+        buckets the scaled size is rounded down to the latent granularity.
+        """
+        if not self.buckets:
+            return max(256, int(width * scale) // 16 * 16), max(256, int(height * scale) // 16 * 16)
+        aspect = math.log(width / height)
+        target = math.log(width * height * scale * scale)
+        smaller = [
+            (bw, bh) for bw, bh in self.buckets
+            if abs(aspect - math.log(bw / bh)) <= ASPECT_TOLERANCE and bw * bh < width * height
+        ]
+        if not smaller:
+            return int(width), int(height)
+        return min(smaller, key=lambda bucket: abs(target - math.log(bucket[0] * bucket[1])))
+
+    def snap_job(self, job: GenerationJob) -> GenerationJob:
+        """Job to generate at the bucket size and fit to the requested size afterwards."""
+        if not self.enabled or job.output_width is not None:
+            return job
+        width, height = self.nearest(job.width, job.height)
+        return replace(
+            job,
+            width=width,
+            height=height,
+            output_width=int(job.width),
+            output_height=int(job.height),
+            fit=self.fit,
+        )
+
+
+def parse_buckets(raw: str) -> List[Tuple[int, int]]:
+    buckets = []
+    for item in raw.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        width, _, height = item.partition("x")
+        buckets.append((int(width), int(height)))
+    return buckets
+
+
+def bucket_table_from_env() -> BucketTable:
+    raw = os.environ.get("QWEN_RESOLUTION_BUCKETS")
+    fit = os.environ.get("QWEN_BUCKET_FIT", "crop").lower()
+    if raw is None:
+        return BucketTable(DEFAULT_BUCKETS, fit)
+    if raw.strip().lower() in ("", "off", "0", "none"):
+        return BucketTable(None, fit)
+    return BucketTable(parse_buckets(raw), fit)
+
+
+def fit_image(image: Any, width: int, height: int, fit: str = "crop") -> Any:
+    """Fit a PIL image generated at a bucket size to the requested output size."""
+    from PIL import Image
+
+    if image.size == (width, height):
+        return image
+    if fit == "resize":
+        return image.resize((width, height), Image.LANCZOS)
+    scale = max(width / image.width, height / image.height)
+    scaled = (max(width, round(image.width * scale)), max(height, round(image.height * scale)))
+    if scaled != image.size:
+        image = image.resize(scaled, Image.LANCZOS)
+    left = (image.width - width) // 2
+    top = (image.height - height) // 2
+    return image.crop((left, top, left + width, top + height))
@@ -0,0 +1,151 @@
+"""
+In-flight coalescing of identical generation requests
+
+A double-click or a frontend retry submits the same request twice under two
+job IDs. `InFlightTable` keeps one entry per request fingerprint while its
+first job (the leader) is queued or running; later jobs with the same
+fingerprint attach to it as followers instead of being scheduled, and receive
+the leader's result when it completes.
+
+Entries leave the table when the leader completes, or once the leader has
+been running for longer than `ttl_s`, so a lost leader cannot hold followers
+forever (the caller re-submits them). A leader still waiting in the queue
+never times out here; it will run eventually.
+
+Requests only coalesce within a tenant: two customers who type the same
+prompt expect different images when unseeded, and even seeded ones need their
+own stored object. Each follower still has its own upload target, so
+`follower_result` uploads the leader's image there before delivery.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import store_result, wants_direct_upload
+
+
+def request_fingerprint(
+    prompt: str,
+    style: Optional[str],
+    width: int,
+    height: int,
+    seed: Optional[int],
+    encoding: Optional[dict] = None,
+    tenant: Optional[str] = None,
+) -> str:
+    material = {
+        "prompt": prompt,
+        "style": style,
+        "width": int(width),
+        "height": int(height),
+        "seed": seed,
+        "encoding": encoding or {},
+        "tenant": tenant,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+
+class InFlightTable:
+    """
+    fingerprint -> leader job and its followers
+
+    Not thread-safe; `JobQueueCore` serializes access.
+
+    Args:
+        ttl_s: Drop entries whose leader started longer ago than this in
+            `expire`; None keeps them until `finish`
+    """
+
+    def __init__(self, ttl_s: Optional[float] = None):
+        self.ttl_s = ttl_s
+        self._by_fingerprint: Dict[str, dict] = {}
+        self._leader_fingerprint: Dict[str, str] = {}
+        self._follower_leader: Dict[str, str] = {}
+        self.coalesced = 0
+        self.expired = 0
+
+    def attach(self, fingerprint: str, job_id: str, entry: Any) -> Optional[str]:
+        """
+        Register a job under its fingerprint
+
+        Returns the leader's job_id if the job became a follower, None if it is
+        the leader (nothing in flight for this fingerprint yet).
+        """
+        group = self._by_fingerprint.get(fingerprint)
+        if group is None:
+            self._by_fingerprint[fingerprint] = {"leader": job_id, "started": None, "followers": []}
+            self._leader_fingerprint[job_id] = fingerprint
+            return None
+        group["followers"].append(entry)
+        self._follower_leader[job_id] = group["leader"]
+        self.coalesced += 1
+        return group["leader"]
+
+    def started(self, leader_id: str, now: Optional[float]) -> None:
+        """Start the timeout clock for a leader that began running (None: queued again)."""
+        fingerprint = self._leader_fingerprint.get(leader_id)
+        if fingerprint is not None:
+            self._by_fingerprint[fingerprint]["started"] = now
+
+    def leader_of(self, job_id: str) -> Optional[str]:
+        """Leader a follower is attached to; None for leaders and unknown jobs."""
+        return self._follower_leader.get(job_id)
+
+    def knows(self, job_id: str) -> bool:
+        return job_id in self._leader_fingerprint or job_id in self._follower_leader
+
+    def finish(self, leader_id: str) -> List[Any]:
+        """Remove a leader's entry and return its followers' entries."""
+        fingerprint = self._leader_fingerprint.pop(leader_id, None)
+        if fingerprint is None:
+            return []
+        group = self._by_fingerprint.pop(fingerprint)
+        for follower in group["followers"]:
+            self._follower_leader.pop(_job_id(follower), None)
+        return group["followers"]
+
+    def expire(self, now: float) -> List[Tuple[str, List[Any]]]:
+        """(leader_id, followers) for every entry older than ttl_s, removed from the table."""
+        if self.ttl_s is None:
+            return []
+        stale = [
+            g["leader"] for g in self._by_fingerprint.values()
+            if g["started"] is not None and now - g["started"] > self.ttl_s
+        ]
+        self.expired += len(stale)
+        return [(leader, self.finish(leader)) for leader in stale]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._by_fingerprint),
+            "followers": len(self._follower_leader),
+            "coalesced": self.coalesced,
+            "expired": self.expired,
+        }
+
+
+def follower_result(generated: dict, follower: dict, client: Any = None) -> dict:
+    """
+    The leader's result as delivered to one follower
+
+    Args:
+        generated: The leader's result before its own direct upload (still
+            carrying the image)
+        follower: The follower's job_id plus its upload_url, object_key and
+            user_id
+        client: S3 client for the upload (built from the environment when None)
+    """
+    if not generated.get("success") or not wants_direct_upload(follower.get("upload_url")):
+        return generated
+    return store_result(
+        follower["job_id"],
+        generated,
+        follower.get("upload_url"),
+        follower.get("object_key"),
+        follower.get("user_id"),
+        client=client,
+    )
+
+
+def _job_id(entry: Any) -> str:
+    return entry["job_id"] if isinstance(entry, dict) else entry
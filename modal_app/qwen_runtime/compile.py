@@ -0,0 +1,127 @@
+"""
+Optional torch.compile for the Qwen-Image pipeline
+
+QWEN_COMPILE selects the mode:
+- "off" (default): eager
+- "regional": compile the repeated transformer blocks once and reuse the graph
+  for every block (`compile_repeated_blocks`), plus the VAE decoder; compiles in
+  tens of seconds
+- "max-autotune": compile the whole transformer and the VAE decoder with
+  Inductor's autotuning; slowest to compile, fastest steady state
+
+The Nunchaku transformer runs its own fused kernels and is left alone (its
+VAE decoder is still compiled), and sequential offload moves weights inside
+every forward, so it skips compile entirely.
+
+Compiled artifacts are shared through the model volume: Inductor's on-disk
+caches point there, and after warm-up the portable cache
+(`torch.compiler.save_cache_artifacts`) is written next to them and loaded by
+the next container before compiling.
+"""
+import os
+from typing import Any, Optional
+
+COMPILE_MODES = ("off", "regional", "max-autotune")
+
+
+def compile_mode(mode: Optional[str] = None) -> str:
+    mode = (mode or os.environ.get("QWEN_COMPILE", "off")).lower()
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown QWEN_COMPILE {mode!r}; expected one of {COMPILE_MODES}")
+    return mode
+
+
+def configure_cache_dir(cache_dir: str) -> None:
+    """Point Inductor's FX graph and autograd caches at a shared directory."""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+
+
+def artifacts_path(cache_dir: str, mode: str, backend: str = "standard") -> str:
+    """Portable cache file per torch version, backend and mode; they compile different graphs."""
+    import torch
+
+    return os.path.join(cache_dir, f"megacache-torch{torch.__version__}-{backend}-{mode}.bin")
+
+
+def load_artifacts(path: str) -> bool:
+    """Preload a portable compile cache; False when absent or unsupported."""
+    import torch
+
+    loader = getattr(torch.compiler, "load_cache_artifacts", None)
+    if loader is None or not os.path.exists(path):
+        return False
+    try:
+        with open(path, "rb") as f:
+            loader(f.read())
+        return True
+    except Exception as e:
+        print(f"⚠️ Could not load compile cache {path}: {e}")
+        return False
+
+
+def save_artifacts(path: str) -> bool:
+    """Write the portable compile cache gathered so far; False when there is nothing to save."""
+    import torch
+
+    saver = getattr(torch.compiler, "save_cache_artifacts", None)
+    if saver is None:
+        return False
+    try:
+        artifacts = saver()
+    except Exception as e:
+        print(f"⚠️ Could not collect compile cache: {e}")
+        return False
+    if not artifacts:
+        return False
+    data = artifacts[0]
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def compile_pipeline(pipe: Any, mode: str, use_nunchaku: bool, placement_mode: Optional[str]) -> dict:
+    """
+    Wrap the transformer and VAE decoder for compilation
+
+    Compilation itself happens lazily on the first call at each shape, which is
+    why warm-up runs at every configured size afterwards.
+
+    Returns:
+        dict with mode, the compiled component names and, for anything left
+        uncompiled, the reason
+    """
+    import torch
+
+    report = {"mode": mode, "compiled": []}
+    if mode == "off":
+        return report
+    if placement_mode == "sequential_offload":
+        report["skipped"] = "sequential offload streams weights inside each forward"
+        return report
+
+    transformer = pipe.transformer
+    if use_nunchaku:
+        report["skipped"] = "Nunchaku transformer uses its own kernels"
+    elif mode == "regional":
+        if hasattr(transformer, "compile_repeated_blocks"):
+            transformer.compile_repeated_blocks(fullgraph=True)
+        else:
+            for block in transformer.transformer_blocks:
+                block.compile(fullgraph=True)
+        report["compiled"].append("transformer")
+    else:
+        # No CUDA graphs: offload hooks move weights and micro-batches change the
+        # batch dimension, either of which would invalidate a captured graph
+        pipe.transformer = torch.compile(transformer, mode="max-autotune-no-cudagraphs")
+        report["compiled"].append("transformer")
+    if mode == "regional":
+        pipe.vae.decoder.compile()
+    else:
+        pipe.vae.decoder = torch.compile(pipe.vae.decoder, mode="max-autotune-no-cudagraphs")
+    report["compiled"].append("vae.decoder")
+    return report
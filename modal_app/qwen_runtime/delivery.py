@@ -0,0 +1,410 @@
+"""
+Webhook delivery of generation results to the Next.js app
+
+Shared by the GPU class (direct dispatch) and the legacy `process_job` relay so
+both report results in the same payload shape.
+
+Two transports are supported:
+- "json": the original body with the PNG inlined as `image_base64`
+- "multipart": a small JSON `payload` part plus the raw PNG as an `image` file
+  part, which avoids the ~33% base64 inflation and the extra string copies
+
+Results that were already uploaded by the worker (see `storage.store_result`)
+carry only `object_key`, `size_bytes`, `sha256` and `content_type`, and are
+always sent as a tiny JSON body.
+
+Delivery goes through `WebhookDeliverer`: one pooled httpx.AsyncClient,
+retries with exponential backoff and full jitter on connection errors, 429
+and 5xx, an `Idempotency-Key` header derived from the job ID, and optional
+batching of small status updates into one `{"updates": [...]}` POST. Requests
+that still fail are written to a `DeadLetterStore` for later replay. Sync
+callers (the GPU class, the relay) share a deliverer running on a background
+event loop through `deliver_result`; async handlers await their own.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from .telemetry import registry
+
+WEBHOOK_TRANSPORTS = ("json", "multipart")
+STORED_FIELDS = ("object_key", "size_bytes", "sha256", "content_type")
+
+
+def webhook_transport() -> str:
+    """Transport selected by TENKAIGEN_WEBHOOK_TRANSPORT (defaults to json)."""
+    transport = os.environ.get("TENKAIGEN_WEBHOOK_TRANSPORT", "json").lower()
+    return transport if transport in WEBHOOK_TRANSPORTS else "json"
+
+
+def result_format_for(transport: str) -> str:
+    """Result format the generator should produce for a given transport."""
+    return "bytes" if transport == "multipart" else "base64"
+
+
+def build_webhook_payload(job_id: str, result: dict, processing_time_ms: int) -> dict:
+    """Translate a generate() result dict into the JSON webhook body (no raw bytes)."""
+    payload = {
+        "job_id": job_id,
+        "processing_time_ms": processing_time_ms,
+    }
+    if result.get("success"):
+        payload.update({
+            "status": "completed",
+            "metadata": result["metadata"],
+            "content_type": result.get("content_type", "image/png"),
+        })
+        if "object_key" in result:
+            payload.update({field: result[field] for field in STORED_FIELDS if field in result})
+        elif "image_base64" in result:
+            payload["image_base64"] = result["image_base64"]
+    else:
+        payload.update({
+            "status": "failed",
+            "error": result.get("error", "Unknown error"),
+        })
+    return payload
+
+
+def build_webhook_request(
+    job_id: str,
+    result: dict,
+    processing_time_ms: int,
+    transport: str = "json",
+) -> dict:
+    """
+    Keyword arguments for `httpx.AsyncClient.post` carrying a job result
+
+    Accepts results in either format and converts as needed, so the transport
+    can be chosen independently of how the image was produced.
+    """
+    payload = build_webhook_payload(job_id, result, processing_time_ms)
+    if not result.get("success") or "object_key" in result:
+        return {"json": payload}
+
+    if transport == "multipart":
+        image_bytes = result.get("image_bytes")
+        if image_bytes is None:
+            image_bytes = base64.b64decode(result["image_base64"])
+        payload.pop("image_base64", None)
+        content_type = payload["content_type"]
+        filename = f"{job_id}.{content_type.split('/')[-1]}"
+        return {
+            "data": {"payload": json.dumps(payload)},
+            "files": {"image": (filename, image_bytes, content_type)},
+        }
+
+    if "image_base64" not in payload:
+        payload["image_base64"] = base64.b64encode(result["image_bytes"]).decode('utf-8')
+    return {"json": payload}
+
+
+def idempotency_key(job_id: str, kind: str) -> str:
+    """Stable per job and message kind, so the webhook can drop replays."""
+    return f"{job_id}:{kind}"
+
+
+def _retry_after(response: Any) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class DeadLetterStore:
+    """
+    Permanently failed deliveries as JSON files, one per job and kind
+
+    Multipart requests are stored in the JSON form (image inlined as base64)
+    so a replay does not depend on the transport setting.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key.replace(':', '__').replace('/', '_')}.json")
+
+    def add(self, key: str, url: str, request_kwargs: dict, error: str, attempts: int) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        record = {
+            "idempotency_key": key,
+            "url": url,
+            "json": _as_json_body(request_kwargs),
+            "error": error,
+            "attempts": attempts,
+            "failed_at": time.time(),
+        }
+        tmp = f"{self._path(key)}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, self._path(key))
+
+    def pending(self) -> List[dict]:
+        if not os.path.isdir(self.root):
+            return []
+        records = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.root, name)) as f:
+                    records.append(json.load(f))
+        return records
+
+    def remove(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+def _as_json_body(request_kwargs: dict) -> Any:
+    if "json" in request_kwargs:
+        return request_kwargs["json"]
+    payload = json.loads(request_kwargs["data"]["payload"])
+    _, image_bytes, _ = request_kwargs["files"]["image"]
+    payload["image_base64"] = base64.b64encode(image_bytes).decode("utf-8")
+    return payload
+
+
+def dead_letter_store_from_env() -> Optional[DeadLetterStore]:
+    root = os.environ.get("TENKAIGEN_DEAD_LETTER_DIR")
+    return DeadLetterStore(root) if root else None
+
+
+class WebhookDeliverer:
+    """
+    Async webhook client with retries, idempotency keys and status batching
+
+    Create and use it on a single event loop (the httpx pool is bound to it).
+
+    Args:
+        webhook_url: Target URL (TENKAIGEN_WEBHOOK_URL when omitted)
+        max_attempts: Attempts per request before dead-lettering
+        base_delay_s: Backoff base; attempt n waits uniform(0, base * 2**n)
+        max_delay_s: Backoff cap
+        timeout_s: Per-attempt timeout
+        batch_window_s: How long small status updates wait to share one POST
+            (TENKAIGEN_WEBHOOK_BATCH_MS, 0 sends each on its own)
+        max_batch: Updates per batched POST
+        dead_letters: Where permanently failed requests go
+        client: Preconfigured httpx.AsyncClient (e.g. with a mock transport)
+    """
+
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        max_attempts: int = 5,
+        base_delay_s: float = 0.5,
+        max_delay_s: float = 30.0,
+        timeout_s: float = 30.0,
+        batch_window_s: Optional[float] = None,
+        max_batch: int = 20,
+        dead_letters: Optional[DeadLetterStore] = None,
+        client: Any = None,
+    ):
+        import httpx
+
+        if batch_window_s is None:
+            batch_window_s = float(os.environ.get("TENKAIGEN_WEBHOOK_BATCH_MS", "0")) / 1000.0
+        self.webhook_url = webhook_url or os.environ.get("TENKAIGEN_WEBHOOK_URL")
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.batch_window_s = batch_window_s
+        self.max_batch = max(1, max_batch)
+        self.dead_letters = dead_letters
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout_s,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "retries": 0, "dead_lettered": 0, "batches": 0}
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+
+    async def post(self, key: str, request_kwargs: dict, dead_letter: bool = True) -> bool:
+        """POST with retries; dead-letters and returns False when every attempt fails."""
+        if not self.webhook_url:
+            print("⚠️ TENKAIGEN_WEBHOOK_URL not configured, skipping webhook")
+            return False
+        headers = {"Idempotency-Key": key}
+        error = "no attempt made"
+        reason = "exhausted"
+        start = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            delay = None
+            try:
+                response = await self.client.post(self.webhook_url, headers=headers, **request_kwargs)
+                if response.is_success:
+                    self.stats["sent"] += 1
+                    registry().observe("tenkaigen_webhook_seconds", time.perf_counter() - start, outcome="delivered")
+                    return True
+                error = f"HTTP {response.status_code}"
+                if response.status_code != 429 and response.status_code < 500:
+                    reason = "rejected"
+                    break  # the webhook rejected the payload; retrying will not help
+                delay = _retry_after(response)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if attempt + 1 < self.max_attempts:
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay if delay is not None else self._backoff(attempt))
+
+        registry().observe("tenkaigen_webhook_seconds", time.perf_counter() - start, outcome="failed")
+        registry().inc("tenkaigen_webhook_failures_total", reason=reason)
+        print(f"❌ Webhook delivery {key} failed after {attempt + 1} attempts: {error}")
+        if dead_letter and self.dead_letters is not None:
+            try:
+                self.dead_letters.add(key, self.webhook_url, request_kwargs, error, attempt + 1)
+                self.stats["dead_lettered"] += 1
+            except Exception as e:
+                print(f"⚠️ Could not dead-letter {key}: {e}")
+        return False
+
+    async def deliver(self, job_id: str, result: dict, processing_time_ms: int, transport: Optional[str] = None) -> bool:
+        """Deliver a job result; small JSON bodies may be batched."""
+        request_kwargs = build_webhook_request(job_id, result, processing_time_ms, transport or webhook_transport())
+        body = request_kwargs.get("json")
+        if body is not None and "image_base64" not in body:
+            return await self.send_status(body)
+        return await self.post(idempotency_key(job_id, "completed" if result.get("success") else "failed"), request_kwargs)
+
+    async def send_status(self, payload: dict) -> bool:
+        """Send a small JSON update, batched with others when a batch window is set."""
+        key = idempotency_key(payload["job_id"], payload.get("status", "status"))
+        if self.batch_window_s <= 0:
+            return await self.post(key, {"json": payload})
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(({**payload, "idempotency_key": key}, future))
+        if len(self._pending) >= self.max_batch:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+        return await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.batch_window_s)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if not batch:
+            return
+        updates = [payload for payload, _ in batch]
+        if len(updates) > 1:
+            self.stats["batches"] += 1
+            digest = hashlib.sha256(",".join(u["idempotency_key"] for u in updates).encode("utf-8")).hexdigest()
+            if await self.post(f"batch:{digest[:16]}", {"json": {"updates": updates}}, dead_letter=False):
+                outcomes = [True] * len(batch)
+            else:
+                # One bad update must not sink the others: resend them one by one
+                outcomes = await asyncio.gather(*(self.post(u["idempotency_key"], {"json": u}) for u in updates))
+        else:
+            outcomes = [await self.post(updates[0]["idempotency_key"], {"json": updates[0]})]
+        for (_, future), ok in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(ok)
+
+    async def replay_dead_letters(self) -> Dict[str, bool]:
+        """Re-send every dead-lettered request; successful ones are removed."""
+        if self.dead_letters is None:
+            return {}
+        outcome = {}
+        for record in self.dead_letters.pending():
+            key = record["idempotency_key"]
+            ok = await self.post(key, {"json": record["json"]})
+            if ok:
+                self.dead_letters.remove(key)
+            outcome[key] = ok
+        return outcome
+
+    async def aclose(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+        await self.client.aclose()
+
+
+class BackgroundDeliverer:
+    """Runs a WebhookDeliverer on a private event loop thread for sync callers."""
+
+    def __init__(self, **deliverer_kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="webhook-delivery", daemon=True)
+        self._thread.start()
+        self.deliverer: WebhookDeliverer = self._call(self._make(deliverer_kwargs)).result()
+
+    @staticmethod
+    async def _make(kwargs: dict) -> WebhookDeliverer:
+        return WebhookDeliverer(**kwargs)
+
+    def _call(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def deliver(self, job_id: str, result: dict, processing_time_ms: int, transport: Optional[str] = None) -> Future:
+        return self._call(self.deliverer.deliver(job_id, result, processing_time_ms, transport))
+
+    def close(self) -> None:
+        self._call(self.deliverer.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_background: Dict[Optional[str], BackgroundDeliverer] = {}
+_background_lock = threading.Lock()
+
+
+def _background_deliverer(webhook_url: Optional[str]) -> BackgroundDeliverer:
+    with _background_lock:
+        deliverer = _background.get(webhook_url)
+        if deliverer is None:
+            deliverer = BackgroundDeliverer(webhook_url=webhook_url, dead_letters=dead_letter_store_from_env())
+            _background[webhook_url] = deliverer
+        return deliverer
+
+
+def close_background_deliverers() -> None:
+    """Flush and close the shared deliverers (call on container exit)."""
+    with _background_lock:
+        deliverers = list(_background.values())
+        _background.clear()
+    for deliverer in deliverers:
+        deliverer.close()
+
+
+def deliver_result(
+    job_id: str,
+    result: dict,
+    processing_time_ms: int,
+    webhook_url: Optional[str] = None,
+    transport: Optional[str] = None,
+) -> bool:
+    """
+    POST a job result to the webhook, retrying transient failures
+
+    Falls back to TENKAIGEN_WEBHOOK_URL when no URL is given and to
+    TENKAIGEN_WEBHOOK_TRANSPORT when no transport is given. Blocks until the
+    webhook accepted the payload (True) or delivery was given up and
+    dead-lettered (False). Connections are pooled per process.
+    """
+    webhook_url = webhook_url or os.environ.get("TENKAIGEN_WEBHOOK_URL")
+    if not webhook_url:
+        print("⚠️ TENKAIGEN_WEBHOOK_URL not configured, skipping webhook")
+        return False
+    try:
+        return _background_deliverer(webhook_url).deliver(job_id, result, processing_time_ms, transport).result()
+    except Exception as _e:
+        print(f"❌ Webhook error for job {job_id}: {_e}")
+        return False
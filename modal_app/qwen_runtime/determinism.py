@@ -0,0 +1,50 @@
+"""
+Reproducibility mode for the GPU container (QWEN_DETERMINISTIC)
+
+Each job always draws its starting noise from its own CPU `torch.Generator`
+(batching.run_group), so a seed gives the same latents whatever else runs in
+the process or shares the batch, and the seed a job used is returned as
+`metadata.seed` even when the caller sent none.
+
+That alone does not make the output bit-identical. cuDNN autotuning picks
+kernels by timing, TF32 matmuls and atomics-based reductions vary between
+runs, and a job's numerics depend on the batch size it runs at. With
+QWEN_DETERMINISTIC=1 the container:
+- calls torch.use_deterministic_algorithms(True), so an op without a
+  deterministic kernel raises (at warm-up) rather than drifting silently
+- sets cudnn.deterministic, turns off cudnn.benchmark and TF32
+- sets CUBLAS_WORKSPACE_CONFIG before cuBLAS initialises
+- runs micro-batches of one and skips max-autotune compilation
+
+A seed then reproduces the same bytes on the same backend revision, GPU type
+and library versions. The mode is part of the result cache revision, so
+images from the two modes are never mixed.
+"""
+import os
+from typing import Any, Dict
+
+CUBLAS_WORKSPACE_CONFIG = ":4096:8"
+
+
+def deterministic_mode() -> bool:
+    return os.environ.get("QWEN_DETERMINISTIC", "0").lower() in ("1", "true", "yes")
+
+
+def configure_determinism() -> Dict[str, Any]:
+    """Apply the torch settings above; call before the first CUDA op. Returns what was set."""
+    os.environ.setdefault("CUBLAS_WORKSPACE_CONFIG", CUBLAS_WORKSPACE_CONFIG)
+    import torch
+
+    torch.use_deterministic_algorithms(True)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+    torch.backends.cuda.matmul.allow_tf32 = False
+    torch.backends.cudnn.allow_tf32 = False
+    settings = {
+        "deterministic_algorithms": torch.are_deterministic_algorithms_enabled(),
+        "cudnn_benchmark": torch.backends.cudnn.benchmark,
+        "tf32": torch.backends.cuda.matmul.allow_tf32,
+        "cublas_workspace_config": os.environ["CUBLAS_WORKSPACE_CONFIG"],
+    }
+    print(f"🎯 Deterministic mode: {settings}")
+    return settings
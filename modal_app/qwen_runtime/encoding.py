@@ -0,0 +1,172 @@
+"""
+Output encoding stage
+
+Turns PIL images into PNG, WebP or JPEG bytes with per-request settings, and
+runs the encode on a bounded worker pool so the pipeline thread can start on the
+next batch while the CPU compresses the previous one.
+
+The old behaviour, `save(format="PNG", optimize=True)`, runs PIL's exhaustive
+PNG filter search and is several times slower than a plain zlib level; it is
+still available as {"format": "png", "optimize": true}.
+"""
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from .metrics import PipelineMetrics
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    """
+    How to encode one output image
+
+    Args:
+        format: "png", "webp" or "jpeg"
+        compress_level: zlib level 0-9 for PNG, method 0-6 for WebP (effort)
+        optimize: PNG/JPEG exhaustive optimisation (slow, smaller output)
+        lossless: Lossless WebP instead of lossy
+        quality: Quality for lossy WebP/JPEG (also effort for lossless WebP)
+    """
+    format: str = "png"
+    compress_level: Optional[int] = 6
+    optimize: bool = False
+    lossless: bool = False
+    quality: Optional[int] = None
+
+    def __post_init__(self):
+        fmt = self.format.lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in CONTENT_TYPES:
+            raise ValueError(f"Unsupported output format: {self.format}")
+        object.__setattr__(self, "format", fmt)
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    def save_kwargs(self) -> dict:
+        """Keyword arguments for PIL's Image.save."""
+        if self.format == "png":
+            kwargs: dict = {"optimize": self.optimize}
+            if self.compress_level is not None:
+                kwargs["compress_level"] = self.compress_level
+            return kwargs
+        if self.format == "webp":
+            kwargs = {"lossless": self.lossless}
+            if self.compress_level is not None:
+                kwargs["method"] = min(self.compress_level, 6)
+            if self.quality is not None:
+                kwargs["quality"] = self.quality
+            return kwargs
+        return {
+            "quality": self.quality if self.quality is not None else 95,
+            "optimize": self.optimize,
+        }
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, options: Optional[dict]) -> "EncodeOptions":
+        """Build options from a request dict, falling back to QWEN_OUTPUT_ENCODING."""
+        if options is None:
+            return default_encode_options()
+        if isinstance(options, EncodeOptions):
+            return options
+        return cls(**options)
+
+
+def default_encode_options() -> "EncodeOptions":
+    """Container-wide default, configurable as JSON in QWEN_OUTPUT_ENCODING."""
+    raw = os.environ.get("QWEN_OUTPUT_ENCODING")
+    if not raw:
+        return EncodeOptions()
+    return EncodeOptions(**json.loads(raw))
+
+
+def encode_image(image: Any, options: EncodeOptions) -> bytes:
+    """Encode a PIL image with the given options."""
+    if options.format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format=options.format.upper(), **options.save_kwargs())
+    return buffer.getvalue()
+
+
+class EncoderPool:
+    """
+    Bounded CPU stage fed by the GPU thread
+
+    The pipeline thread pushes finished images onto a bounded queue and a small
+    pool of worker threads encodes (and, through the submitted callable, builds
+    results for) them. PIL releases the GIL while compressing, so encoding
+    overlaps with the next denoising call. When the queue is full `submit`
+    blocks, which applies backpressure to the GPU thread instead of letting
+    decoded images pile up in host memory.
+
+    Args:
+        max_workers: Encoder threads (QWEN_ENCODE_WORKERS, default 2)
+        max_queue: Queue capacity (QWEN_ENCODE_QUEUE_SIZE, default 4)
+        metrics: Optional PipelineMetrics for queue depth and backpressure
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        metrics: Optional[PipelineMetrics] = None,
+    ):
+        workers = max_workers or int(os.environ.get("QWEN_ENCODE_WORKERS", "2"))
+        capacity = max_queue or int(os.environ.get("QWEN_ENCODE_QUEUE_SIZE", "4"))
+        self.metrics = metrics
+        self._queue: "queue.Queue" = queue.Queue(maxsize=capacity)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"encoder-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future: Future = Future()
+        start = time.perf_counter()
+        self._queue.put((future, fn, args, kwargs))
+        if self.metrics is not None:
+            self.metrics.record_backpressure(time.perf_counter() - start)
+            self.metrics.observe_queue_depth(self._queue.qsize())
+        return future
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            future, fn, args, kwargs = item
+            if self.metrics is not None:
+                self.metrics.observe_queue_depth(self._queue.qsize())
+            start = time.perf_counter()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.record_encode(time.perf_counter() - start)
+
+    def shutdown(self) -> None:
+        for _ in self._workers:
+            self._queue.put(self._STOP)
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,444 @@
+"""
+Ingress web app: validated job submission, single and bulk
+
+`create_app` builds the FastAPI app served by the `fastapi_app` Modal function.
+Request bodies are validated with pydantic (`request_models`), and everything on
+the request path is async: dispatch awaits `.spawn.aio`, and anything that may
+block (result cache lookups) is pushed to a thread by the dispatcher.
+
+- POST /              one job, same body and response as before
+- POST /batch         {"jobs": [job, ...]}; valid jobs are fanned out in one
+                      dispatch call, invalid ones are reported per index
+- GET /status/{id}    queue position and ETA (queue dispatch mode only)
+- GET /progress/{id}  server-sent events with the job's queue position, then
+                      its denoising step (and latent preview), ending with
+                      "completed" or "failed" (see qwen_runtime.progress)
+- GET /metrics        fleet counters and histograms in the Prometheus text
+                      format (see qwen_runtime.telemetry)
+
+Single jobs default to the "interactive" priority and batched ones to
+"batch"; either can be overridden per job with "priority".
+
+When the queue's admission control turns a job away, POST / answers 503 with
+a Retry-After header, and /batch lists the job under "rejected" with its
+retry_after_s (503 as well if nothing was accepted).
+
+The app only knows a `dispatch(jobs, submitted_at)` coroutine, so the Modal
+routing (relay, direct, cached) stays in qwen_generator.py and the bench can
+swap in a stub spawn.
+
+fastapi and pydantic are imported lazily, like the other heavy dependencies in
+this package.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Literal, Optional, Sequence, Tuple
+
+from .progress import TERMINAL_STATES
+from .telemetry import registry
+
+DEFAULT_MAX_BATCH_JOBS = 1000
+# Concurrent spawn RPCs when a function has no spawn_map
+SPAWN_CONCURRENCY = 64
+# GET /progress: store reads, queue status reads, keep-alive comments, give up
+PROGRESS_POLL_S = 0.5
+PROGRESS_QUEUE_POLL_S = 2.0
+PROGRESS_KEEPALIVE_S = 15.0
+PROGRESS_TIMEOUT_S = 900.0
+
+
+@lru_cache(maxsize=1)
+def request_models() -> Tuple[type, type]:
+    """(GenerateRequest, BatchRequest) pydantic models."""
+    from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+    from .encoding import EncodeOptions
+
+    class GenerateRequest(BaseModel):
+        model_config = ConfigDict(extra="ignore")
+
+        job_id: str = Field(min_length=1)
+        prompt: str = ""
+        style: Optional[str] = None
+        width: int = Field(1664, ge=256, le=2048)
+        height: int = Field(928, ge=256, le=2048)
+        # torch.Generator.manual_seed takes at most a signed 64-bit value
+        seed: Optional[int] = Field(None, ge=0, le=2**63 - 1)
+        upload_url: Optional[str] = None
+        object_key: Optional[str] = None
+        user_id: Optional[str] = None
+        encoding: Optional[Dict[str, Any]] = None
+        priority: Optional[Literal["interactive", "batch"]] = None
+
+        @field_validator("encoding")
+        @classmethod
+        def check_encoding(cls, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            # Bad options would otherwise first fail in the cache key, as a 500
+            if value is not None:
+                try:
+                    EncodeOptions.from_dict(value)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"invalid encoding: {e}") from None
+            return value
+
+    class BatchRequest(BaseModel):
+        model_config = ConfigDict(extra="ignore")
+
+        # Items are validated one by one so a bad job doesn't reject the batch
+        jobs: List[Any] = Field(min_length=1)
+
+    return GenerateRequest, BatchRequest
+
+
+def describe_validation_error(error: Any) -> str:
+    """One-line summary of a pydantic ValidationError."""
+    parts = []
+    for item in error.errors():
+        where = ".".join(str(p) for p in item.get("loc", ())) or "body"
+        parts.append(f"{where}: {item.get('msg', 'invalid')}")
+    return "; ".join(parts)
+
+
+async def spawn_many(function: Any, rows: Sequence[Sequence[Any]]) -> None:
+    """
+    Spawn a Modal function once per row of positional arguments
+
+    Uses `spawn_map` (one call for the whole batch) when the client has it,
+    otherwise `.spawn.aio` per row with bounded concurrency.
+    """
+    if not rows:
+        return
+    if len(rows) == 1:
+        await function.spawn.aio(*rows[0])
+        return
+    spawn_map = getattr(function, "spawn_map", None)
+    if spawn_map is not None:
+        await spawn_map.aio(*zip(*rows))
+        return
+    limit = asyncio.Semaphore(SPAWN_CONCURRENCY)
+
+    async def one(row):
+        async with limit:
+            await function.spawn.aio(*row)
+
+    await asyncio.gather(*(one(row) for row in rows))
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def progress_events(
+    job_id: str,
+    read_progress: Callable[[str], Awaitable[Optional[dict]]],
+    job_status: Optional[Callable[[str], Awaitable[dict]]] = None,
+    poll_s: float = PROGRESS_POLL_S,
+    timeout_s: float = PROGRESS_TIMEOUT_S,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Server-sent events for one job
+
+    Polls the progress store and emits a "progress" event whenever the job's
+    entry changes. Until the GPU container reports a step, queue statuses are
+    emitted as "queue" events (at most every PROGRESS_QUEUE_POLL_S). Ends after
+    the terminal progress event, or with a "timeout" event.
+    """
+    yield f"retry: {int(poll_s * 4000)}\n\n"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
+    last_sent = loop.time()
+    last_update = None
+    last_queue: Optional[dict] = None
+    next_queue_poll = 0.0
+    while loop.time() < deadline:
+        if is_disconnected is not None and await is_disconnected():
+            return
+        now = loop.time()
+        entry = await read_progress(job_id)
+        if entry is not None and entry.get("updated_at") != last_update:
+            last_update = entry.get("updated_at")
+            last_sent = now
+            yield sse_event("progress", entry)
+            if entry.get("state") in TERMINAL_STATES:
+                return
+        elif entry is None and job_status is not None and now >= next_queue_poll:
+            next_queue_poll = now + PROGRESS_QUEUE_POLL_S
+            status = await job_status(job_id)
+            if status != last_queue:
+                last_queue = status
+                last_sent = now
+                yield sse_event("queue", {"job_id": job_id, **status})
+        if now - last_sent >= PROGRESS_KEEPALIVE_S:
+            last_sent = now
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(poll_s)
+    yield sse_event("timeout", {"job_id": job_id})
+
+
+def create_app(
+    dispatch: Callable[[List[Any], float], Awaitable[Optional[Dict[str, dict]]]],
+    webhook_factory: Optional[Callable[[], Any]] = None,
+    max_batch_jobs: Optional[int] = None,
+    job_status: Optional[Callable[[str], Awaitable[dict]]] = None,
+    metrics: Optional[Callable[[], Awaitable[str]]] = None,
+    progress: Optional[Callable[[str], Awaitable[Optional[dict]]]] = None,
+):
+    """
+    Build the ingress FastAPI app
+
+    Args:
+        dispatch: Coroutine taking validated GenerateRequests and the submit
+            time; may return queue statuses by job_id, where state "rejected"
+            (with retry_after_s) means the job was not accepted
+        webhook_factory: Returns a WebhookDeliverer for failure notifications;
+            None skips them
+        max_batch_jobs: Largest accepted /batch (TENKAIGEN_MAX_BATCH_JOBS,
+            default 1000)
+        job_status: Coroutine returning a job's queue status; None disables
+            GET /status
+        metrics: Coroutine returning the Prometheus exposition; None
+            disables GET /metrics
+        progress: Coroutine returning a job's progress entry (or None);
+            None disables GET /progress
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from pydantic import ValidationError
+
+    GenerateRequest, BatchRequest = request_models()
+    if max_batch_jobs is None:
+        max_batch_jobs = int(os.environ.get("TENKAIGEN_MAX_BATCH_JOBS", str(DEFAULT_MAX_BATCH_JOBS)))
+
+    web_app = FastAPI()
+    # Created on first use so the httpx pool binds to the server's event loop
+    webhook = {"deliverer": None, "tasks": set()}
+
+    def notify(payload: dict) -> None:
+        """Send a status update in the background without holding up the response."""
+        if webhook_factory is None:
+            return
+        if webhook["deliverer"] is None:
+            webhook["deliverer"] = webhook_factory()
+        task = asyncio.ensure_future(webhook["deliverer"].send_status(payload))
+        webhook["tasks"].add(task)
+        task.add_done_callback(webhook["tasks"].discard)
+
+    @web_app.on_event("shutdown")
+    async def close_webhook():
+        if webhook["tasks"]:
+            await asyncio.gather(*webhook["tasks"], return_exceptions=True)
+        if webhook["deliverer"] is not None:
+            await webhook["deliverer"].aclose()
+
+    def count(jobs: int, endpoint: str, outcome: str, **labels: Any) -> None:
+        if jobs:
+            registry().inc(f"tenkaigen_jobs_{outcome}_total", jobs, endpoint=endpoint, **labels)
+
+    def validate(raw: Any, priority: str) -> Tuple[Optional[Any], Optional[str]]:
+        """(job, None) for a valid job, (None, error) otherwise; missing prompts are reported to the webhook."""
+        try:
+            job = GenerateRequest.model_validate(raw)
+        except ValidationError as e:
+            return None, describe_validation_error(e)
+        if not job.prompt:
+            notify({"job_id": job.job_id, "status": "failed", "error": "Prompt is required"})
+            return None, "Prompt is required"
+        if job.priority is None:
+            job.priority = priority
+        return job, None
+
+    def overloaded(body: dict, retry_after_s: float) -> Any:
+        return JSONResponse(
+            status_code=503,
+            content=body,
+            headers={"Retry-After": str(int(math.ceil(retry_after_s)))},
+        )
+
+    async def read_json(request: Request) -> Tuple[Any, bool]:
+        try:
+            return await request.json(), True
+        except Exception:
+            return None, False
+
+    @web_app.get("/")
+    async def healthcheck():
+        return {"ok": True}
+
+    @web_app.post("/")
+    async def generate_endpoint_handler(request: Request):
+        """
+        Web endpoint for image generation
+
+        POST / with JSON body:
+        {
+            "job_id": "uuid",  // required - job ID from database
+            "prompt": "...",
+            "style": "Anime",  // optional
+            "width": 1664,     // optional, 256-2048
+            "height": 928,     // optional, 256-2048
+            "seed": 12345,     // optional
+            "upload_url": "https://...",  // optional presigned PUT URL
+            "object_key": "ai-generated/...",  // optional key for the upload
+            "user_id": "uuid", // optional, used in the default object key
+            "encoding": {"format": "webp", "lossless": true},  // optional
+            "priority": "interactive"  // optional, or "batch"
+        }
+
+        Calls webhook at completion to report results. Answers 422 with
+        {"success": false, "error"} for an invalid body (including encoding
+        options EncodeOptions rejects), and 503 with Retry-After when the
+        queue is too deep to meet the latency SLO.
+        """
+        submitted_at = time.time()
+        body, ok = await read_json(request)
+        if not ok:
+            count(1, "single", "rejected", reason="invalid")
+            return JSONResponse(status_code=422, content={"success": False, "error": "Invalid JSON body"})
+
+        job, error = validate(body, "interactive")
+        if job is None:
+            count(1, "single", "rejected", reason="invalid")
+            return JSONResponse(status_code=422, content={"success": False, "error": error})
+
+        print(f"🎨 Starting generation for job {job.job_id}")
+        status = (await dispatch([job], submitted_at) or {}).get(job.job_id, {})
+        if status.get("state") == "rejected":
+            count(1, "single", "rejected", reason="overloaded")
+            print(f"🚦 Rejected job {job.job_id}: retry after {status['retry_after_s']}s")
+            return overloaded(
+                {"success": False, "job_id": job.job_id, "error": "Overloaded, retry later", "retry_after_s": status["retry_after_s"]},
+                status["retry_after_s"],
+            )
+
+        count(1, "single", "accepted", priority=job.priority)
+        # Respond immediately; webhook will deliver results
+        response = {"success": True, "job_id": job.job_id}
+        if status.get("downgraded"):
+            response["downgraded"] = True
+        return response
+
+    @web_app.post("/batch")
+    async def batch_endpoint_handler(request: Request):
+        """
+        Bulk submission for catalog backfills
+
+        POST /batch with JSON body {"jobs": [<body accepted by POST />, ...]}
+
+        Returns the accepted job IDs and, per rejected item, its index, job_id
+        (if any) and the validation error, or "Overloaded" with retry_after_s
+        for jobs turned away by admission control. Jobs accepted at reduced
+        quality are listed in "downgraded". Accepted jobs report through the
+        webhook exactly like single submissions. Answers 422 with
+        {"success": false, "error"} when the body as a whole is invalid: not
+        JSON, not of this shape, or more than the per-batch job limit.
+        """
+        submitted_at = time.time()
+        body, ok = await read_json(request)
+        if not ok:
+            return JSONResponse(status_code=422, content={"success": False, "error": "Invalid JSON body"})
+        try:
+            batch = BatchRequest.model_validate(body)
+        except ValidationError as e:
+            return JSONResponse(status_code=422, content={"success": False, "error": describe_validation_error(e)})
+        if len(batch.jobs) > max_batch_jobs:
+            return JSONResponse(status_code=422, content={"success": False, "error": f"At most {max_batch_jobs} jobs per batch"})
+
+        valid, rejected = [], []
+        for index, raw in enumerate(batch.jobs):
+            job, error = validate(raw, "batch")
+            if job is None:
+                job_id = raw.get("job_id") if isinstance(raw, dict) else None
+                rejected.append({"index": index, "job_id": job_id, "error": error})
+            else:
+                valid.append((index, job))
+
+        statuses = {}
+        if valid:
+            print(f"🎨 Starting generation for {len(valid)} batched jobs")
+            statuses = await dispatch([job for _, job in valid], submitted_at) or {}
+
+        accepted, shed = [], []
+        for index, job in valid:
+            status = statuses.get(job.job_id, {})
+            if status.get("state") == "rejected":
+                shed.append({"index": index, "job_id": job.job_id, "error": "Overloaded", "retry_after_s": status["retry_after_s"]})
+            else:
+                accepted.append(job)
+        count(len(rejected), "batch", "rejected", reason="invalid")
+        count(len(shed), "batch", "rejected", reason="overloaded")
+        for priority in sorted({job.priority for job in accepted}):
+            count(sum(1 for job in accepted if job.priority == priority), "batch", "accepted", priority=priority)
+        rejected = sorted(rejected + shed, key=lambda item: item["index"])
+
+        response = {
+            "success": bool(accepted),
+            "job_ids": [job.job_id for job in accepted],
+            "rejected": rejected,
+        }
+        downgraded = [job.job_id for job in accepted if statuses.get(job.job_id, {}).get("downgraded")]
+        if downgraded:
+            response["downgraded"] = downgraded
+        if shed and not accepted:
+            return overloaded(response, min(item["retry_after_s"] for item in shed))
+        return response
+
+    @web_app.get("/status/{job_id}")
+    async def status_endpoint_handler(job_id: str):
+        """
+        Queue status of a job
+
+        Returns {"success": true, "job_id", "state", ...}: state "queued" adds
+        priority, position (jobs expected to start first) and eta_s (seconds
+        until the result); "running" adds running_s and eta_s; "unknown" means
+        the job finished, was served from the cache, or was never queued.
+        Downgraded jobs carry "downgraded": true.
+        """
+        if job_status is None:
+            return {"success": False, "error": "Queue status needs TENKAIGEN_DISPATCH_MODE=queue"}
+        return {"success": True, "job_id": job_id, **(await job_status(job_id))}
+
+    @web_app.get("/progress/{job_id}")
+    async def progress_endpoint_handler(job_id: str, request: Request):
+        """
+        Live progress of a job as server-sent events (text/event-stream)
+
+        "queue" events carry the GET /status payload while the job waits
+        (queue dispatch mode); "progress" events carry
+        {"job_id", "state", "step", "total_steps", "updated_at"} plus a
+        base64 JPEG "preview" when previews are on. The stream ends after a
+        "completed" or "failed" progress event; by then the webhook has the
+        result.
+        """
+        if progress is None:
+            return JSONResponse(status_code=404, content={"success": False, "error": "Progress streaming is disabled"})
+        events = progress_events(
+            job_id,
+            progress,
+            job_status,
+            poll_s=float(os.environ.get("TENKAIGEN_PROGRESS_POLL_S", str(PROGRESS_POLL_S))),
+            is_disconnected=request.is_disconnected,
+        )
+        return StreamingResponse(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @web_app.get("/metrics")
+    async def metrics_endpoint_handler():
+        """Prometheus scrape target: totals summed over every worker that pushes metrics."""
+        if metrics is None:
+            return PlainTextResponse("# metrics disabled\n", status_code=404)
+        return PlainTextResponse(await metrics(), media_type="text/plain; version=0.0.4")
+
+    return web_app
+
+
+def job_rows(jobs: Iterable[Any], columns: Sequence[str], **fixed: Any) -> List[Tuple[Any, ...]]:
+    """Positional argument rows for `spawn_many`; `fixed` fills columns not on the request."""
+    return [tuple(fixed[c] if c in fixed else getattr(job, c) for c in columns) for job in jobs]
@@ -0,0 +1,180 @@
+"""
+Thread-safe job queue state behind the `JobQueue` Modal class
+
+`JobQueueCore` combines the fair-share scheduler with in-flight coalescing
+under one lock. The Modal class adds what needs Modal: persisting entries to
+a Dict, spawning `QwenGenerator.run_job`, and the dispatcher thread; keeping
+the rest here means `sim_coalescing.py` and `sim_admission.py` can drive the
+exact same code on a CPU box.
+
+An entry is the dict the web endpoint submits:
+    {"job_id", "tenant", "priority", "submitted_at", "payload": run_job kwargs}
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .admission import AdmissionController
+from .coalescing import InFlightTable, request_fingerprint
+from .scheduler import FairScheduler, QueuedJob
+
+
+def entry_fingerprint(entry: dict) -> str:
+    payload = entry["payload"]
+    return request_fingerprint(
+        payload.get("prompt", ""),
+        payload.get("style"),
+        payload.get("width", 1664),
+        payload.get("height", 928),
+        payload.get("seed"),
+        encoding=payload.get("encoding"),
+        tenant=entry.get("tenant"),
+    )
+
+
+class JobQueueCore:
+    """
+    Args:
+        scheduler: Decides which leader runs next
+        coalesce: Attach identical in-flight requests to one leader
+            (TENKAIGEN_COALESCE, default on)
+        max_attempts: Dispatches per job before a lease expiry fails it
+            (TENKAIGEN_QUEUE_MAX_ATTEMPTS, default 2)
+        admission: Rejects or downgrades new leaders that would miss their
+            latency SLO; None admits everything
+    """
+
+    def __init__(
+        self,
+        scheduler: FairScheduler,
+        coalesce: bool = True,
+        max_attempts: int = 2,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.scheduler = scheduler
+        self.coalesce = coalesce
+        self.max_attempts = max(1, max_attempts)
+        self.admission = admission
+        self.table = InFlightTable(ttl_s=scheduler.lease_s)
+        self._lock = threading.Lock()
+
+    def submit(self, entries: List[dict], now: float, admit: bool = True) -> List[dict]:
+        """
+        Queue entries (or attach them to an identical leader); their statuses in order
+
+        A rejected entry is not kept anywhere; its status is
+        {"state": "rejected", "retry_after_s", "estimated_wait_s"}. admit=False
+        skips admission control, for entries accepted before a restart.
+        """
+        with self._lock:
+            rejected: Dict[str, dict] = {}
+            for entry in entries:
+                status = self._submit(entry, now, admit=admit)
+                if status is not None:
+                    rejected[entry["job_id"]] = status
+            return [rejected.get(entry["job_id"]) or self._status(entry["job_id"], now) for entry in entries]
+
+    def _submit(self, entry: dict, now: float, admit: bool = True) -> Optional[dict]:
+        job_id = entry["job_id"]
+        if self.table.knows(job_id) or self.scheduler.status(job_id, now)["state"] != "unknown":
+            return None  # same job_id submitted again
+        fingerprint = entry_fingerprint(entry) if self.coalesce else None
+        if fingerprint is not None and self.table.attach(fingerprint, job_id, entry) is not None:
+            return None  # followers cost no GPU time, so they are always admitted
+        job = QueuedJob(**entry)
+        self.scheduler.submit(job, now)
+        if not admit or self.admission is None:
+            return None
+        # Queued first so the estimate sees the job's fair-share position,
+        # not just the length of the queue
+        decision = self.admission.decide(
+            job.priority,
+            self.scheduler.position(job_id),
+            self.scheduler.running,
+            self.scheduler.slots,
+            width=job.payload.get("width"),
+            height=job.payload.get("height"),
+        )
+        if decision.action == "reject":
+            self.scheduler.cancel(job_id)
+            if fingerprint is not None:
+                self.table.finish(job_id)
+            return {
+                "state": "rejected",
+                "retry_after_s": decision.retry_after_s,
+                "estimated_wait_s": round(decision.estimated_wait_s, 1),
+            }
+        if decision.action == "downgrade":
+            job.payload = {**job.payload, "downgrade": decision.downgrade}
+            # The caller mirrors `entry`; a restored or replayed job must stay downgraded
+            entry["payload"] = job.payload
+        return None
+
+    def claim(self, now: float) -> Tuple[Optional[QueuedJob], List[str]]:
+        """
+        Next job to dispatch, plus the job IDs that failed by lease expiry
+
+        A job whose worker never reported back is queued again, keeping its
+        followers, until it has been dispatched max_attempts times; then it
+        and its followers are returned as failed. Followers left behind by a
+        coalescing entry that timed out on its own are submitted again, so the
+        first of them takes over as leader.
+        """
+        with self._lock:
+            failed = []
+            for job in self.scheduler.expire(now):
+                if job.attempts < self.max_attempts:
+                    job.started_at = None
+                    self.scheduler.submit(job, now)
+                    self.table.started(job.job_id, None)
+                    continue
+                failed.append(job.job_id)
+                failed.extend(f["job_id"] for f in self.table.finish(job.job_id))
+            for _, followers in self.table.expire(now):
+                for entry in followers:
+                    self._submit(entry, now, admit=False)
+            job = self.scheduler.next(now)
+            if job is not None:
+                job.attempts += 1
+                self.table.started(job.job_id, now)
+            return job, failed
+
+    def requeue(self, job_id: str, now: float) -> None:
+        with self._lock:
+            self.scheduler.requeue(job_id, now)
+
+    def complete(self, job_id: str, now: float, duration_s: Optional[float] = None) -> List[dict]:
+        """Release a leader's slot; returns the follower entries owed its result."""
+        with self._lock:
+            job = self.scheduler.complete(job_id, now, duration_s=duration_s)
+            if job is None:
+                # Reported after its lease expired: drop the retry
+                self.scheduler.cancel(job_id)
+            elif self.admission is not None and duration_s is not None:
+                self.admission.observe(
+                    duration_s,
+                    downgraded=bool(job.payload.get("downgrade")),
+                    width=job.payload.get("width"),
+                    height=job.payload.get("height"),
+                )
+            return self.table.finish(job_id)
+
+    def status(self, job_id: str, now: float) -> dict:
+        with self._lock:
+            return self._status(job_id, now)
+
+    def _status(self, job_id: str, now: float) -> dict:
+        leader = self.table.leader_of(job_id)
+        status = self.scheduler.status(leader or job_id, now)
+        job = self.scheduler.job(leader or job_id)
+        if job is not None and job.payload.get("downgrade"):
+            status["downgraded"] = True
+        if leader is not None:
+            status["coalesced_with"] = leader
+        return status
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self.scheduler.stats(), "coalescing": self.table.stats()}
+            if self.admission is not None:
+                stats["admission"] = self.admission.stats()
+            return stats
@@ -0,0 +1,131 @@
+"""
+In-process metrics for the generator container
+
+`PipelineMetrics` tracks how well GPU work (pipeline calls) overlaps with CPU
+post-processing (encode and delivery): GPU busy time, the fraction of the active
+span the GPU sat idle, encode queue depth and time the GPU thread spent blocked
+on a full queue. It also separates the first request a container serves from
+steady-state request latency, and breaks request latency down per resolution
+bucket.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class PipelineMetrics:
+    """Thread-safe counters for the GPU/CPU producer-consumer pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.gpu_calls = 0
+            self.gpu_busy_s = 0.0
+            self.first_gpu_start: Optional[float] = None
+            self.last_gpu_end: Optional[float] = None
+            self.items_encoded = 0
+            self.encode_busy_s = 0.0
+            self.backpressure_wait_s = 0.0
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self._depth_sum = 0
+            self._depth_samples = 0
+            self.requests = 0
+            self.first_request_s: Optional[float] = None
+            self._steady_latencies: deque = deque(maxlen=512)
+            self._bucket_counts: Dict[str, int] = {}
+            self._bucket_latencies: Dict[str, deque] = {}
+
+    @contextmanager
+    def gpu_span(self) -> Iterator[None]:
+        """Time one pipeline call (denoise + VAE decode)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.gpu_calls += 1
+                self.gpu_busy_s += end - start
+                if self.first_gpu_start is None:
+                    self.first_gpu_start = start
+                self.last_gpu_end = end
+
+    def observe_queue_depth(self, depth: int) -> None:
+        with self._lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._depth_sum += depth
+            self._depth_samples += 1
+
+    def record_backpressure(self, waited_s: float) -> None:
+        with self._lock:
+            self.backpressure_wait_s += waited_s
+
+    def record_encode(self, duration_s: float) -> None:
+        with self._lock:
+            self.items_encoded += 1
+            self.encode_busy_s += duration_s
+
+    def record_request(self, duration_s: float, bucket: Optional[str] = None) -> None:
+        """Latency of one served request; the first is kept apart from steady state."""
+        with self._lock:
+            self.requests += 1
+            if self.first_request_s is None:
+                self.first_request_s = duration_s
+            else:
+                self._steady_latencies.append(duration_s)
+            if bucket is not None:
+                self._bucket_counts[bucket] = self._bucket_counts.get(bucket, 0) + 1
+                self._bucket_latencies.setdefault(bucket, deque(maxlen=512)).append(duration_s)
+
+    def _bucket_stats(self) -> dict:
+        buckets = {}
+        for bucket, count in sorted(self._bucket_counts.items(), key=lambda kv: -kv[1]):
+            latencies = sorted(self._bucket_latencies[bucket])
+            buckets[bucket] = {
+                "requests": count,
+                "mean_s": round(statistics.fmean(latencies), 4),
+                "p50_s": round(statistics.median(latencies), 4),
+                "p95_s": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 4),
+            }
+        return buckets
+
+    def snapshot(self) -> dict:
+        """
+        Current figures as a plain dict
+
+        gpu_idle_fraction is measured over the span from the first pipeline call
+        starting to the last one ending, so it shows time lost between batches
+        (encoding in line, backpressure, or simply no work queued).
+        """
+        with self._lock:
+            span = 0.0
+            if self.first_gpu_start is not None and self.last_gpu_end is not None:
+                span = self.last_gpu_end - self.first_gpu_start
+            idle = 1.0 - (self.gpu_busy_s / span) if span > 0 else 0.0
+            steady = list(self._steady_latencies)
+            return {
+                "gpu_calls": self.gpu_calls,
+                "gpu_busy_s": round(self.gpu_busy_s, 4),
+                "gpu_active_span_s": round(span, 4),
+                "gpu_idle_fraction": round(max(0.0, idle), 4),
+                "items_encoded": self.items_encoded,
+                "encode_busy_s": round(self.encode_busy_s, 4),
+                "backpressure_wait_s": round(self.backpressure_wait_s, 4),
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "mean_queue_depth": round(self._depth_sum / self._depth_samples, 3)
+                if self._depth_samples else 0.0,
+                "requests": self.requests,
+                "first_request_s": round(self.first_request_s, 4) if self.first_request_s is not None else None,
+                "steady_state_mean_s": round(statistics.fmean(steady), 4) if steady else None,
+                "steady_state_p50_s": round(statistics.median(steady), 4) if steady else None,
+                "buckets": self._bucket_stats(),
+            }
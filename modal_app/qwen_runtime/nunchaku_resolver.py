@@ -0,0 +1,192 @@
+"""
+Locate Nunchaku's QwenImage transformer class, memoized per Nunchaku version
+
+The class has moved between modules across Nunchaku releases, so the first
+start tries a list of known module paths and, failing that, walks the package.
+The resolved (module, class) pair is stored in a small JSON file on the model
+volume keyed by the installed Nunchaku version; later starts do a single direct
+import. The full scan only runs on a cache miss or when the cached entry no
+longer imports.
+
+The class is resolved in the snapshot stage, where the volume must not be
+written, so the generator passes save=False there and stores the result with
+`remember_transformer_class` (then commits the volume) once the GPU stage runs.
+
+`package` and `candidates` are parameters so the resolver and cache can be
+exercised against a fake package tree on sys.path.
+"""
+import importlib
+import inspect
+import json
+import os
+import pkgutil
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+CANDIDATE_MODULES = [
+    "{pkg}.models.transformers.transformer_qwenimage",
+    "{pkg}.models.transformers.transformer_qwen_image",
+    "{pkg}.models.transformers.qwenimage",
+    "{pkg}.models.transformers.qwen_image",
+    "{pkg}.models.cv.transformers.qwenimage",
+    "{pkg}.models.cv.transformers.qwen_image",
+    "{pkg}.models.cv.transformers.transformer_qwenimage",
+    "{pkg}.models.cv.transformers.transformer_qwen_image",
+    "{pkg}.diffusers.models.transformers.qwenimage",
+    "{pkg}.diffusers.models.transformers.qwen_image",
+    "{pkg}.diffusers.transformers.qwenimage",
+    "{pkg}.diffusers.transformers.qwen_image",
+    "{pkg}.models.hub.transformers.qwenimage",
+    "{pkg}.models.hub.transformers.qwen_image",
+    "{pkg}.models.transformers",
+    "{pkg}.models",
+    "{pkg}.diffusers",
+]
+CLASS_NAMES = [
+    "NunchakuQwenImageTransformer2DModel",
+    "QwenImageTransformer2DModel",
+    "NunchakuQwenImageTransformer",
+    "QwenImageTransformer",
+    "NunchakuQwenImageModel",
+]
+
+
+def package_version(package: str) -> str:
+    from importlib import metadata
+
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        mod = importlib.import_module(package)
+        return str(getattr(mod, "__version__", "unknown"))
+
+
+def _load_cache(path: Optional[str]) -> Dict[str, dict]:
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: Optional[str], cache: Dict[str, dict]) -> bool:
+    if not path:
+        return False
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f"⚠️ Could not persist Nunchaku resolver cache to {path}: {e}")
+        return False
+
+
+def scan_for_transformer(
+    package: str = "nunchaku",
+    candidates: Sequence[str] = CANDIDATE_MODULES,
+    class_names: Sequence[str] = CLASS_NAMES,
+    importer: Callable[[str], Any] = importlib.import_module,
+) -> Tuple[type, str]:
+    """
+    Full discovery: known module paths first, then one walk of the package
+
+    Returns the transformer class and the module it was found in.
+    """
+    for template in candidates:
+        mod_name = template.format(pkg=package)
+        try:
+            mod = importer(mod_name)
+        except Exception:
+            continue
+        for cls_name in class_names:
+            if hasattr(mod, cls_name):
+                return getattr(mod, cls_name), mod_name
+
+    # Walk the package to discover the class dynamically
+    try:
+        root = importer(package)
+    except Exception as e:
+        raise ImportError(f"Unable to import {package}: {e}") from e
+
+    print(f"🔎 Scanning {package} package for Qwen transformer classes...")
+    discovered: List[Tuple[type, str]] = []
+    related_modules: List[str] = []
+    for _, name, _ in pkgutil.walk_packages(root.__path__, root.__name__ + "."):
+        if len(related_modules) < 20 and any(x in name.lower() for x in ("qwen", "transform", "image")):
+            related_modules.append(name)
+        try:
+            mod = importer(name)
+        except Exception:
+            continue
+        for _, obj in inspect.getmembers(mod, inspect.isclass):
+            # Candidate if class name references qwen and transformer (image optional)
+            nm = obj.__name__.lower()
+            if "qwen" in nm and ("transform" in nm or "image" in nm):
+                # Prefer more specific names first
+                if "transform" in nm and ("image" in nm or "2d" in nm):
+                    print(f"🔎 Found candidate class {obj.__name__} in {name}")
+                    return obj, name
+                discovered.append((obj, name))
+    if discovered:
+        print(f"🔎 Using first discovered candidate {discovered[0][0].__name__} from {discovered[0][1]}")
+        return discovered[0]
+    # Log a subset of module names to help debugging
+    print(f"📋 {package} modules (sample): {related_modules}")
+    raise ImportError(f"Unable to locate {package} QwenImage transformer class in installed package")
+
+
+def resolve_transformer_class(
+    package: str = "nunchaku",
+    cache_path: Optional[str] = None,
+    version: Optional[str] = None,
+    candidates: Sequence[str] = CANDIDATE_MODULES,
+    class_names: Sequence[str] = CLASS_NAMES,
+    importer: Callable[[str], Any] = importlib.import_module,
+    save: bool = True,
+) -> Tuple[type, str]:
+    """
+    Resolve the transformer class, using the per-version cache when possible
+
+    Args:
+        package: Top-level package to search
+        cache_path: JSON cache location (e.g. on the model volume); None disables it
+        version: Installed package version; read from package metadata when omitted
+        candidates: Module path templates with a `{pkg}` placeholder
+        class_names: Class names to look for in candidate modules
+        importer: Import function (injectable for a fake package tree)
+        save: Write a fresh resolution to the cache; pass False where the
+            cache file must not be written yet and call
+            `remember_transformer_class` later
+
+    Returns:
+        The transformer class and the module it was imported from
+    """
+    version = version or package_version(package)
+    cache = _load_cache(cache_path)
+    entry = cache.get(version)
+    if entry:
+        try:
+            mod = importer(entry["module"])
+            return getattr(mod, entry["class"]), entry["module"]
+        except Exception as e:
+            print(f"⚠️ Cached Nunchaku class {entry} no longer imports ({e}); rescanning")
+
+    cls, mod_name = scan_for_transformer(package, candidates, class_names, importer)
+    if save:
+        remember_transformer_class(cache_path, version, mod_name, cls.__name__)
+    return cls, mod_name
+
+
+def remember_transformer_class(cache_path: Optional[str], version: str, module: str, class_name: str) -> bool:
+    """Store a resolution in the cache; True if the file was written (commit the volume then)."""
+    cache = _load_cache(cache_path)
+    entry = {"module": module, "class": class_name}
+    if cache.get(version) == entry:
+        return False
+    cache[version] = entry
+    return _save_cache(cache_path, cache)
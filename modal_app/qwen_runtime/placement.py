@@ -0,0 +1,155 @@
+"""
+VRAM-aware placement planner for the Qwen-Image pipeline
+
+Picks how the pipeline components are placed on the GPU from the card's
+free/total memory and the size of each component:
+
+- "gpu": everything resident, no offload (fastest)
+- "model_offload": one whole component on the GPU at a time
+  (`enable_model_cpu_offload`)
+- "nunchaku_block_offload": Nunchaku transformer keeps `num_blocks_on_gpu`
+  blocks resident and streams the rest; other components are offloaded
+  sequentially (as in data/qwen-image-lightning.py)
+- "sequential_offload": every layer streamed over PCIe on each step (slowest,
+  only when nothing else fits)
+
+`plan_placement` is pure arithmetic so it can be exercised with made-up memory
+figures; `read_vram`, `component_sizes` and `apply_placement` touch torch.
+"""
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+PLACEMENT_MODES = ("gpu", "model_offload", "nunchaku_block_offload", "sequential_offload")
+GiB = 1024 ** 3
+
+
+@dataclass
+class PlacementPlan:
+    mode: str
+    reason: str
+    total_vram_gb: float
+    free_vram_gb: float
+    model_gb: float
+    largest_component: Optional[str] = None
+    num_blocks_on_gpu: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def plan_placement(
+    total_vram_bytes: int,
+    free_vram_bytes: int,
+    component_bytes: Dict[str, int],
+    use_nunchaku: bool,
+    transformer_blocks: Optional[int] = None,
+    headroom_bytes: Optional[int] = None,
+    override: Optional[str] = None,
+) -> PlacementPlan:
+    """
+    Choose a placement for the given memory budget
+
+    Args:
+        total_vram_bytes: Card capacity
+        free_vram_bytes: Memory currently free on the card
+        component_bytes: Parameter + buffer bytes per pipeline component
+        use_nunchaku: Whether the transformer is a Nunchaku model (supports
+            per-block offload)
+        transformer_blocks: Number of transformer blocks, for sizing
+            num_blocks_on_gpu
+        headroom_bytes: Memory kept free for activations and the VAE decode
+            (QWEN_VRAM_HEADROOM_GB, default 4 GB)
+        override: Force a mode (QWEN_PLACEMENT); still sized for block offload
+    """
+    if headroom_bytes is None:
+        headroom_bytes = int(float(os.environ.get("QWEN_VRAM_HEADROOM_GB", "4")) * GiB)
+    if override is None:
+        override = os.environ.get("QWEN_PLACEMENT") or None
+    if override is not None and override not in PLACEMENT_MODES:
+        raise ValueError(f"Unknown placement mode {override!r}; expected one of {PLACEMENT_MODES}")
+
+    budget = free_vram_bytes - headroom_bytes
+    model_bytes = sum(component_bytes.values())
+    largest_name, largest_bytes = max(component_bytes.items(), key=lambda kv: kv[1], default=(None, 0))
+
+    def make(mode: str, reason: str, num_blocks: Optional[int] = None) -> PlacementPlan:
+        return PlacementPlan(
+            mode=mode,
+            reason=reason,
+            total_vram_gb=round(total_vram_bytes / GiB, 2),
+            free_vram_gb=round(free_vram_bytes / GiB, 2),
+            model_gb=round(model_bytes / GiB, 2),
+            largest_component=largest_name,
+            num_blocks_on_gpu=num_blocks,
+        )
+
+    def blocks_that_fit() -> int:
+        transformer_bytes = component_bytes.get("transformer", 0)
+        if not transformer_blocks or transformer_bytes <= 0:
+            return 1
+        # Integer arithmetic: a float per-block size can drop a block that fits exactly
+        return max(1, min(transformer_blocks, budget * transformer_blocks // transformer_bytes))
+
+    if override == "nunchaku_block_offload" and not use_nunchaku:
+        return make("sequential_offload", "QWEN_PLACEMENT asked for block offload but Nunchaku is not loaded")
+    if override is not None:
+        num_blocks = blocks_that_fit() if override == "nunchaku_block_offload" else None
+        return make(override, "forced by QWEN_PLACEMENT", num_blocks)
+
+    if model_bytes <= budget:
+        return make("gpu", f"whole model ({model_bytes / GiB:.1f} GB) fits in free VRAM")
+    if largest_bytes <= budget:
+        return make(
+            "model_offload",
+            f"largest component {largest_name} ({largest_bytes / GiB:.1f} GB) fits; model does not",
+        )
+    if use_nunchaku and "transformer" in component_bytes:
+        num_blocks = blocks_that_fit()
+        return make(
+            "nunchaku_block_offload",
+            f"{largest_name} ({largest_bytes / GiB:.1f} GB) exceeds budget; keeping {num_blocks} blocks resident",
+            num_blocks,
+        )
+    return make(
+        "sequential_offload",
+        f"{largest_name} ({largest_bytes / GiB:.1f} GB) exceeds budget ({budget / GiB:.1f} GB)",
+    )
+
+
+def read_vram(device: int = 0) -> Dict[str, int]:
+    """Free and total bytes on a CUDA device."""
+    import torch
+
+    free, total = torch.cuda.mem_get_info(device)
+    return {"free": int(free), "total": int(total)}
+
+
+def component_sizes(pipe: Any) -> Dict[str, int]:
+    """Bytes of parameters and buffers for each torch module in the pipeline."""
+    import torch
+
+    sizes = {}
+    for name, component in getattr(pipe, "components", {}).items():
+        if isinstance(component, torch.nn.Module):
+            sizes[name] = sum(
+                t.numel() * t.element_size()
+                for t in list(component.parameters()) + list(component.buffers())
+            )
+    return sizes
+
+
+def apply_placement(pipe: Any, plan: PlacementPlan) -> None:
+    """Configure the pipeline for the chosen plan."""
+    if plan.mode == "gpu":
+        pipe.to("cuda")
+    elif plan.mode == "model_offload":
+        pipe.enable_model_cpu_offload()
+    elif plan.mode == "nunchaku_block_offload":
+        pipe.transformer.set_offload(
+            True, use_pin_memory=False, num_blocks_on_gpu=plan.num_blocks_on_gpu or 1
+        )
+        pipe._exclude_from_cpu_offload.append("transformer")
+        pipe.enable_sequential_cpu_offload()
+    else:
+        pipe.enable_sequential_cpu_offload()
@@ -0,0 +1,346 @@
+"""
+Per-step generation progress for GET /progress/{job_id}
+
+Each job with a `ProgressReporter` is reported on from the pipeline's
+`callback_on_step_end` (`ProgressCallback`, added by batching.run_group). A step
+only updates the job's state in memory, so the denoising loop never waits on
+I/O. The container's `ProgressPublisher` thread writes whatever changed to the
+shared store at most every TENKAIGEN_PROGRESS_INTERVAL_S seconds, in one
+`update` call for every job in the container. Steps between writes are
+dropped; only the newest state of a job matters. The terminal state is
+written synchronously once the webhook has the result, so a client that sees
+it can read the job from the database straight away.
+
+Terminal entries carry `expires_at`, TENKAIGEN_PROGRESS_RETAIN_S after the
+terminal write. Every publisher sweeps the store for expired terminal entries
+(its own and those of containers that have exited) at most once per retention
+period and when it closes, so the store only holds recent jobs.
+
+The store is anything with dict-style `get`, `update`, `items` and `pop`: the
+"tenkaigen-progress" modal.Dict in production, a plain dict in benches. A
+job's entry looks like:
+
+    {"job_id": "...", "state": "running", "step": 3, "total_steps": 4,
+     "updated_at": 1730000000.0, "preview": "<base64 JPEG>"}
+
+with state "running", "completed" or "failed" (plus "error" and
+"expires_at").
+
+With TENKAIGEN_PROGRESS_PREVIEW_S set, running entries also carry a preview
+of the current latents, rendered at most that often. `LatentPreviewer` maps
+latents to RGB with a per-channel linear projection fitted once against a real
+VAE decode (the first previewed generation, normally the warm-up), so a
+preview costs one small matmul instead of a VAE pass.
+"""
+import base64
+import io
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_INTERVAL_S = 0.5
+DEFAULT_RETAIN_S = 120.0
+TERMINAL_STATES = ("completed", "failed")
+
+
+def progress_enabled() -> bool:
+    return os.environ.get("TENKAIGEN_PROGRESS", "1").lower() in ("1", "true", "yes")
+
+
+class ProgressPublisher:
+    """
+    Coalesces progress updates and writes them to the shared store in the background
+
+    Args:
+        store: Dict-like shared store
+        interval_s: Minimum seconds between background writes
+        retain_s: How long terminal entries stay readable before a sweep
+            deletes them
+    """
+
+    def __init__(self, store: Any, interval_s: float = DEFAULT_INTERVAL_S, retain_s: float = DEFAULT_RETAIN_S):
+        self.store = store
+        self.interval_s = interval_s
+        self.retain_s = retain_s
+        self.writes = 0
+        self.swept = 0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._states: Dict[str, dict] = {}
+        self._dirty: set = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def reporter(self, job_id: str, previewer: Optional["LatentPreviewer"] = None) -> "ProgressReporter":
+        return ProgressReporter(job_id, self, previewer)
+
+    def publish(self, job_id: str, **fields: Any) -> None:
+        """Merge fields into the job's state; written on the next background flush."""
+        with self._lock:
+            state = self._states.setdefault(job_id, {"job_id": job_id})
+            state.update(fields)
+            state["updated_at"] = time.time()
+            self._dirty.add(job_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="progress-publish", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def flush(self) -> int:
+        """Write every changed state now; returns how many were written."""
+        with self._write_lock:
+            with self._lock:
+                batch = {}
+                for job_id in self._dirty:
+                    state = self._states[job_id]
+                    if state.get("state") in TERMINAL_STATES:
+                        del self._states[job_id]
+                        state.pop("preview", None)
+                        state.pop("preview_image", None)
+                        state["expires_at"] = state["updated_at"] + self.retain_s
+                    batch[job_id] = state
+                self._dirty.clear()
+                images = {job_id: state.pop("preview_image") for job_id, state in batch.items() if state.get("preview_image") is not None}
+                batch = {job_id: dict(state) for job_id, state in batch.items()}
+            if not batch:
+                return 0
+            # JPEG encoding happens here, off the denoising loop
+            for job_id, image in images.items():
+                preview = batch[job_id]["preview"] = _encode_preview(image)
+                with self._lock:
+                    current = self._states.get(job_id)
+                    if current is not None and "preview_image" not in current:
+                        current["preview"] = preview
+            try:
+                self.store.update(**batch)
+                self.writes += 1
+            except Exception as e:
+                print(f"⚠️ Could not publish progress: {e}")
+            return len(batch)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Delete terminal entries past their `expires_at` from the store; returns how many."""
+        now = time.time() if now is None else now
+        self._next_sweep = now + self.retain_s
+        removed = 0
+        try:
+            for job_id, entry in list(self.store.items()):
+                if entry.get("state") in TERMINAL_STATES and entry.get("expires_at", now) <= now:
+                    try:
+                        self.store.pop(job_id)
+                    except KeyError:
+                        continue  # swept by another container
+                    removed += 1
+        except Exception as e:
+            print(f"⚠️ Could not sweep progress entries: {e}")
+        self.swept += removed
+        return removed
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(1.0, self.interval_s * 2))
+        self.flush()
+        self.sweep()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            # Wakes on publish, or after a retention period to sweep
+            self._wake.wait(timeout=self.retain_s)
+            self._wake.clear()
+            self.flush()
+            if time.time() >= self._next_sweep:
+                self.sweep()
+            # The rate limit: updates arriving meanwhile are merged into one write
+            self._stop.wait(self.interval_s)
+
+
+class ProgressReporter:
+    """One job's progress; `step` is cheap enough for the denoising loop."""
+
+    def __init__(self, job_id: str, publisher: Optional[ProgressPublisher], previewer: Optional["LatentPreviewer"] = None):
+        self.job_id = job_id
+        self.publisher = publisher
+        self.previewer = previewer
+
+    def start(self) -> None:
+        """Mark the job as picked up by a container (step 0)."""
+        if self.publisher is not None:
+            self.publisher.publish(self.job_id, state="running", step=0)
+
+    def step(self, step: int, total_steps: int, preview: Any = None) -> None:
+        if self.publisher is None:
+            return
+        fields: Dict[str, Any] = {"state": "running", "step": step, "total_steps": total_steps}
+        if preview is not None:
+            fields["preview_image"] = preview
+        self.publisher.publish(self.job_id, **fields)
+
+    def finish(self, success: bool, error: Optional[str] = None) -> None:
+        """Write the terminal state now (call once the result has been delivered)."""
+        if self.publisher is None:
+            return
+        fields: Dict[str, Any] = {"state": "completed" if success else "failed"}
+        if error:
+            fields["error"] = error
+        self.publisher.publish(self.job_id, **fields)
+        self.publisher.flush()
+
+
+class ProgressCallback:
+    """
+    `callback_on_step_end` for one pipeline call: reports each job's step
+
+    Args:
+        reporters: One entry per item in the call, None for untracked items
+        total_steps: Steps the call runs
+        width, height: Generation size, needed to unpack latents for previews
+    """
+
+    def __init__(self, reporters: Sequence[Optional[ProgressReporter]], total_steps: int, width: int, height: int):
+        self.reporters = list(reporters)
+        self.total_steps = total_steps
+        self.width = width
+        self.height = height
+        self.previewer = next((r.previewer for r in self.reporters if r is not None and r.previewer is not None), None)
+        self._final_latents: Any = None
+
+    @property
+    def wants_latents(self) -> bool:
+        return self.previewer is not None
+
+    def __call__(self, pipe: Any, step: int, timestep: Any, callback_kwargs: dict) -> dict:
+        previews: List[Any] = []
+        latents = callback_kwargs.get("latents")
+        previewer = self.previewer
+        if previewer is not None and latents is not None:
+            try:
+                if previewer.fitted and previewer.due():
+                    previews = previewer.render(pipe, latents, self.width, self.height)
+                elif not previewer.fitted and step + 1 == self.total_steps:
+                    self._final_latents = previewer.spatial(pipe, latents, self.width, self.height)
+            except Exception as e:
+                print(f"⚠️ Latent preview failed ({e}); disabling previews")
+                self.previewer = None
+        for index, reporter in enumerate(self.reporters):
+            if reporter is not None:
+                reporter.step(step + 1, self.total_steps, previews[index] if index < len(previews) else None)
+        return callback_kwargs
+
+    def fit_preview(self, images: Sequence[Any]) -> None:
+        """Fit the previewer against this call's decoded images if it still needs it."""
+        if self.previewer is None or self._final_latents is None or self.previewer.fitted:
+            return
+        try:
+            self.previewer.fit(self._final_latents, images)
+        except Exception as e:
+            print(f"⚠️ Could not fit the latent preview ({e})")
+        self._final_latents = None
+
+
+class LatentPreviewer:
+    """
+    Cheap latent-to-RGB decoder for progress previews
+
+    A least-squares fit of RGB = latents @ W + b per latent pixel, against a
+    real decode downsampled to the latent grid. Previews come out at latent
+    resolution (1/8 of the image per side).
+
+    Args:
+        interval_s: Minimum seconds between previews (across the container)
+    """
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.weights: Any = None  # (channels + 1, 3) float tensor
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def fitted(self) -> bool:
+        return self.weights is not None
+
+    def due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last < self.interval_s:
+                return False
+            self._last = now
+            return True
+
+    @staticmethod
+    def spatial(pipe: Any, latents: Any, width: int, height: int) -> Any:
+        """(batch, channels, h, w) latents, unpacking QwenImage's 2x2 patch sequence."""
+        unpack = getattr(pipe, "_unpack_latents", None)
+        if latents.dim() == 3 and unpack is not None:
+            latents = unpack(latents, height, width, pipe.vae_scale_factor)
+        if latents.dim() == 5:
+            latents = latents[:, :, 0]
+        return latents.detach().float()
+
+    def fit(self, latents: Any, images: Sequence[Any]) -> None:
+        import numpy as np
+        import torch
+
+        batch, channels, h, w = latents.shape
+        inputs = latents.cpu().permute(0, 2, 3, 1).reshape(-1, channels)
+        inputs = torch.cat([inputs, torch.ones(inputs.shape[0], 1)], dim=1)
+        targets = torch.from_numpy(np.stack([
+            np.asarray(image.convert("RGB").resize((w, h)), dtype=np.float32) / 255.0 for image in images[:batch]
+        ])).reshape(-1, 3)
+        self.weights = torch.linalg.lstsq(inputs, targets).solution
+        print(f"🖼️ Latent preview fitted on {batch} image(s) at {w}x{h}")
+
+    def render(self, pipe: Any, latents: Any, width: int, height: int) -> list:
+        import torch
+        from PIL import Image
+
+        spatial = self.spatial(pipe, latents, width, height)
+        batch, channels, h, w = spatial.shape
+        weights = self.weights.to(spatial.device)
+        rgb = spatial.permute(0, 2, 3, 1).reshape(-1, channels) @ weights[:-1] + weights[-1]
+        pixels = rgb.clamp(0, 1).mul(255).to(torch.uint8).reshape(batch, h, w, 3).cpu().numpy()
+        return [Image.fromarray(item) for item in pixels]
+
+
+def _encode_preview(image: Any) -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=70)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+_publisher: Optional[ProgressPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def progress_publisher(store: Any, interval_s: Optional[float] = None) -> Optional[ProgressPublisher]:
+    """The process-wide publisher (created on first call), or None when TENKAIGEN_PROGRESS is off."""
+    global _publisher
+    if not progress_enabled():
+        return None
+    with _publisher_lock:
+        if _publisher is None:
+            if interval_s is None:
+                interval_s = float(os.environ.get("TENKAIGEN_PROGRESS_INTERVAL_S", str(DEFAULT_INTERVAL_S)))
+            retain_s = float(os.environ.get("TENKAIGEN_PROGRESS_RETAIN_S", str(DEFAULT_RETAIN_S)))
+            _publisher = ProgressPublisher(store, interval_s, retain_s)
+        return _publisher
+
+
+def stop_publishing() -> None:
+    """Flush and stop the process-wide publisher."""
+    global _publisher
+    with _publisher_lock:
+        publisher, _publisher = _publisher, None
+    if publisher is not None:
+        publisher.close()
+
+
+def latent_previewer() -> Optional[LatentPreviewer]:
+    """A LatentPreviewer when TENKAIGEN_PROGRESS_PREVIEW_S is set, else None."""
+    interval_s = float(os.environ.get("TENKAIGEN_PROGRESS_PREVIEW_S", "0"))
+    return LatentPreviewer(interval_s) if interval_s > 0 else None
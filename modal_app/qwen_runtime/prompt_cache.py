@@ -0,0 +1,148 @@
+"""
+Prompt-embedding cache for the Qwen2.5-VL text encoder
+
+Each pipeline call normally re-encodes every prompt and the negative prompt.
+The negative prompt is almost always the constant " ", and enhanced prompts
+repeat whenever a design is retried or shared, so `PromptEmbeddingCache` keeps
+their embeddings around:
+
+- pinned entries (the default negative prompt) are encoded once at startup and
+  stay on the execution device
+- other prompts go through an LRU keyed by their token IDs, stored on the host
+  and copied to the device per call
+
+For a batch the per-prompt embeddings are right-padded to the longest one with
+a zeroed mask, the same layout `QwenImagePipeline.encode_prompt` produces for a
+list of prompts, and handed to the pipeline as prompt_embeds /
+prompt_embeds_mask (and the negative_* equivalents). Encoder calls that are
+skipped also skip the encoder's offload traffic.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .telemetry import registry
+
+# Matches QwenImagePipeline.__call__'s default
+MAX_SEQUENCE_LENGTH = 512
+
+
+class PromptEmbeddingCache:
+    """
+    Callable returning pipeline embedding kwargs for a batch of prompts
+
+    Args:
+        pipe: A loaded QwenImagePipeline (needs encode_prompt and tokenizer)
+        max_entries: LRU capacity (QWEN_PROMPT_CACHE_SIZE, default 256)
+        max_sequence_length: Embedding length cap, as passed to the pipeline
+    """
+
+    def __init__(self, pipe: Any, max_entries: Optional[int] = None, max_sequence_length: int = MAX_SEQUENCE_LENGTH):
+        if max_entries is None:
+            max_entries = int(os.environ.get("QWEN_PROMPT_CACHE_SIZE", "256"))
+        self.pipe = pipe
+        self.max_entries = max(1, max_entries)
+        self.max_sequence_length = max_sequence_length
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[Any, Any]]" = OrderedDict()
+        self._pinned: Dict[Tuple[int, ...], Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def token_key(self, prompt: str) -> Tuple[int, ...]:
+        """Token IDs of the prompt as the pipeline's text encoder sees it."""
+        pipe = self.pipe
+        template = getattr(pipe, "prompt_template_encode", "{}")
+        drop_idx = getattr(pipe, "prompt_template_encode_start_idx", 0)
+        max_length = getattr(pipe, "tokenizer_max_length", 1024) + drop_idx
+        ids = pipe.tokenizer(template.format(prompt), max_length=max_length, truncation=True)["input_ids"]
+        return tuple(ids)
+
+    def _encode(self, prompt: str, device: Any) -> Tuple[Any, Any]:
+        import torch
+
+        with torch.inference_mode():
+            embeds, mask = self.pipe.encode_prompt(
+                prompt=[prompt], device=device, max_sequence_length=self.max_sequence_length
+            )
+        if mask is None:
+            mask = torch.ones(embeds.shape[:2], dtype=torch.long, device=embeds.device)
+        return embeds, mask
+
+    def pin(self, prompt: str) -> None:
+        """Encode a prompt now and keep it on the execution device permanently."""
+        device = self.pipe._execution_device
+        self._pinned[self.token_key(prompt)] = self._encode(prompt, device)
+
+    def _lookup(self, prompt: str, device: Any) -> Tuple[Any, Any]:
+        key = self.token_key(prompt)
+        pinned = self._pinned.get(key)
+        if pinned is not None:
+            with self._lock:
+                self.hits += 1
+            registry().inc("tenkaigen_cache_lookups_total", cache="prompt", outcome="pinned")
+            return pinned
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if cached is not None:
+            registry().inc("tenkaigen_cache_lookups_total", cache="prompt", outcome="hit")
+            embeds, mask = cached
+            return embeds.to(device, non_blocking=True), mask.to(device, non_blocking=True)
+
+        registry().inc("tenkaigen_cache_lookups_total", cache="prompt", outcome="miss")
+        embeds, mask = self._encode(prompt, device)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (embeds.to("cpu"), mask.to("cpu"))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return embeds, mask
+
+    def embed(self, prompts: List[str]) -> Tuple[Any, Any]:
+        """Stacked (embeds, mask) for a batch, right-padded to the longest prompt."""
+        import torch
+
+        device = self.pipe._execution_device
+        items = [self._lookup(p, device) for p in prompts]
+        if len(items) == 1:
+            return items[0]
+        length = max(e.shape[1] for e, _ in items)
+        embeds, masks = [], []
+        for e, m in items:
+            pad = length - e.shape[1]
+            if pad:
+                e = torch.cat([e, e.new_zeros(e.shape[0], pad, e.shape[2])], dim=1)
+                m = torch.cat([m, m.new_zeros(m.shape[0], pad)], dim=1)
+            embeds.append(e)
+            masks.append(m)
+        return torch.cat(embeds, dim=0), torch.cat(masks, dim=0)
+
+    def __call__(self, prompts: List[str], negative_prompts: List[str]) -> dict:
+        """Pipeline kwargs replacing prompt / negative_prompt."""
+        prompt_embeds, prompt_embeds_mask = self.embed(prompts)
+        negative_embeds, negative_mask = self.embed(negative_prompts)
+        return {
+            "prompt_embeds": prompt_embeds,
+            "prompt_embeds_mask": prompt_embeds_mask,
+            "negative_prompt_embeds": negative_embeds,
+            "negative_prompt_embeds_mask": negative_mask,
+            "max_sequence_length": self.max_sequence_length,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,35 @@
+"""
+Style-specific prompt enhancement
+
+Lives outside QwenGenerator so CPU-side code (the relay worker, the web
+endpoint) can compute the same enhanced prompt the GPU container will use, e.g.
+to key the result cache.
+"""
+from typing import Optional
+
+# Base quality enhancer for all styles
+QUALITY_MAGIC = "Ultra HD, 4K, cinematic composition"
+
+# Style-specific enhancements
+STYLE_ENHANCEMENTS = {
+    "Anime": ", vibrant colors, detailed shading, anime art style, high quality illustration",
+    "Line Art": ", clean lines, minimalist design, vector art style, simple elegant composition",
+    "Flat Logo": ", flat design, bold shapes, modern minimalist logo, clean vector graphics",
+    "Watercolor": ", watercolor painting style, soft blending, artistic brush strokes, delicate colors",
+    "Abstract": ", abstract art, geometric shapes, modern composition, bold colors",
+    "Minimalist": ", minimalist design, simple clean composition, negative space, elegant simplicity",
+    "Vintage": ", vintage art style, retro aesthetic, aged texture, classic design",
+    "Grunge": ", grunge texture, distressed style, urban aesthetic, rough edges",
+    "Standard": ", professional design, balanced composition, high quality"
+}
+
+
+def enhance_prompt(prompt: str, style: Optional[str]) -> str:
+    """
+    Enhance prompt with style-specific additions
+
+    The LLM already expanded the prompt, but we can add
+    quality boosters and style-specific tags here
+    """
+    enhancement = STYLE_ENHANCEMENTS.get(style, STYLE_ENHANCEMENTS["Standard"])
+    return f"{prompt}{enhancement}. {QUALITY_MAGIC}."
@@ -0,0 +1,565 @@
+"""
+Content-addressed cache of finished generations
+
+The storefront re-submits identical requests (retries, shared designs). With a
+fixed seed the output is a pure function of the enhanced prompt, the sampling
+parameters, the output encoding and the loaded model, so the encoded image can
+be served again instead of regenerated.
+
+Two tiers sit behind `ResultCache`:
+- `MemoryLRU`: per-container, evicts least recently used entries by byte size
+- a persistent store shared by all containers: `DirectoryStore` (files on a
+  Modal volume of its own) or `S3Store` (objects under a prefix in the B2 bucket)
+
+The GPU container publishes the revision of the backend it loaded. Keys are
+`<revision id>/<digest>`, so each revision's entries live under their own
+directory or prefix, and entries written under another revision or older than
+the TTL are treated as misses: swapping the model invalidates the cache.
+Containers running different revisions side by side (a rolling deploy, the
+standard fallback, QWEN_DETERMINISTIC) each keep their own entries; only
+entries past the TTL are pruned. Jobs without a seed are never cached.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+from .batching import GenerationJob, resolve_sampling
+from .encoding import EncodeOptions
+from .telemetry import registry
+
+CACHE_BACKENDS = ("off", "volume", "s3")
+DEFAULT_TTL_S = 7 * 24 * 3600
+
+
+def backend_revision(use_nunchaku: bool, weights: str, **versions: Optional[str]) -> dict:
+    """
+    Describe the loaded backend; `id` changes whenever any field does
+
+    Args:
+        use_nunchaku: Lightning (Nunchaku) or standard pipeline
+        weights: Checkpoint identifier, e.g. the Nunchaku safetensors filename
+        versions: Library versions that affect the output (diffusers, nunchaku)
+    """
+    revision = {
+        "backend": "nunchaku" if use_nunchaku else "standard",
+        "use_nunchaku": use_nunchaku,
+        "weights": weights,
+        "versions": {name: v for name, v in sorted(versions.items()) if v is not None},
+    }
+    blob = json.dumps(revision, sort_keys=True).encode("utf-8")
+    revision["id"] = hashlib.sha256(blob).hexdigest()[:16]
+    return revision
+
+
+def request_key(job: GenerationJob, enhanced_prompt: str, revision: dict) -> Optional[str]:
+    """
+    Deterministic key for a job under a backend revision
+
+    Returns None for jobs that cannot be cached (no seed).
+    """
+    if job.seed is None:
+        return None
+    steps, cfg = resolve_sampling(job.num_inference_steps, job.cfg_scale, revision["use_nunchaku"])
+    fields = {
+        "prompt": enhanced_prompt,
+        "negative_prompt": job.negative_prompt,
+        "width": int(job.width),
+        "height": int(job.height),
+        "output": [job.output_width, job.output_height, job.fit],
+        "steps": steps,
+        "cfg_scale": cfg,
+        "seed": int(job.seed),
+        "encoding": EncodeOptions.from_dict(job.encoding).to_dict(),
+        "revision": revision["id"],
+    }
+    blob = json.dumps(fields, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+@dataclass
+class CachedResult:
+    image: bytes
+    content_type: str
+    metadata: dict
+    revision: str
+    created_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.image)
+
+    def header(self) -> dict:
+        """Everything except the image bytes, for the persistent tier."""
+        fields = asdict(self)
+        fields.pop("image")
+        fields["size"] = self.size
+        return fields
+
+
+class MemoryLRU:
+    """In-process LRU bounded by total image bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResult) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class DirectoryStore:
+    """
+    Persistent tier as files under a directory, typically on the Modal volume
+
+    Each entry is `<digest>.bin` plus a `<digest>.json` header under its
+    revision's directory, sharded by the first two hex digits. With a
+    `modal.Volume` (the result cache's own, so reloads never touch the model
+    volume), writes are committed and reads reload at most once per interval
+    so other containers see new entries.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        volume: Any = None,
+        commit_interval_s: float = 5.0,
+        reload_interval_s: float = 5.0,
+    ):
+        self.root = root
+        self.volume = volume
+        self.commit_interval_s = commit_interval_s
+        self.reload_interval_s = reload_interval_s
+        self._last_commit = 0.0
+        self._last_reload = 0.0
+        self._lock = threading.Lock()
+
+    def _paths(self, key: str):
+        revision, _, digest = key.rpartition("/")
+        base = os.path.join(self.root, revision, digest[:2], digest)
+        return f"{base}.json", f"{base}.bin"
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _maybe_commit(self, force: bool = False) -> None:
+        if self.volume is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_commit < self.commit_interval_s:
+                return
+            self._last_commit = now
+        try:
+            self.volume.commit()
+        except Exception as e:
+            print(f"⚠️ Result cache volume commit failed: {e}")
+
+    def refresh(self, force: bool = False) -> None:
+        """Reload the volume so entries committed by other containers become visible."""
+        if self.volume is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_reload < self.reload_interval_s:
+                return
+            self._last_reload = now
+        try:
+            self.volume.reload()
+        except Exception as e:
+            print(f"⚠️ Result cache volume reload failed: {e}")
+
+    def head(self, key: str) -> Optional[dict]:
+        header_path, _ = self._paths(key)
+        try:
+            with open(header_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        header = self.head(key)
+        if header is None:
+            return None
+        _, image_path = self._paths(key)
+        try:
+            with open(image_path, "rb") as f:
+                image = f.read()
+        except OSError:
+            return None
+        header.pop("size", None)
+        return CachedResult(image=image, **header)
+
+    def put(self, key: str, entry: CachedResult) -> None:
+        header_path, image_path = self._paths(key)
+        # Image first: a header without its image would read as a broken entry
+        self._write(image_path, entry.image)
+        self._write(header_path, json.dumps(entry.header()).encode("utf-8"))
+        self._maybe_commit()
+
+    def delete(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def read_revision(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.root, "revision.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_revision(self, revision: dict) -> None:
+        self._write(os.path.join(self.root, "revision.json"), json.dumps(revision).encode("utf-8"))
+        self._maybe_commit(force=True)
+
+    def prune(self, ttl_s: float) -> int:
+        """Delete entries older than the TTL, under every revision; returns the count."""
+        removed = 0
+        now = time.time()
+        if not os.path.isdir(self.root):
+            return 0
+        for revision in os.listdir(self.root):
+            revision_dir = os.path.join(self.root, revision)
+            if not os.path.isdir(revision_dir):
+                continue
+            for shard in os.listdir(revision_dir):
+                shard_dir = os.path.join(revision_dir, shard)
+                if not os.path.isdir(shard_dir):
+                    continue
+                for name in os.listdir(shard_dir):
+                    if not name.endswith(".json"):
+                        continue
+                    key = f"{revision}/{name[:-len('.json')]}"
+                    header = self.head(key)
+                    if header is None or now - header.get("created_at", 0) > ttl_s:
+                        self.delete(key)
+                        removed += 1
+                _remove_if_empty(shard_dir)
+            _remove_if_empty(revision_dir)
+        if removed:
+            self._maybe_commit(force=True)
+        return removed
+
+
+def _remove_if_empty(path: str) -> None:
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+class S3Store:
+    """
+    Persistent tier as objects under a prefix in an S3-compatible bucket
+
+    Entries are `<prefix><revision id>/<digest>.bin` and `.json`. Stale entries are rejected on read; expire the prefix with a bucket
+    lifecycle rule rather than listing it here.
+    """
+
+    def __init__(self, client: Any, bucket: str, prefix: str = "result-cache/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}")["Body"].read()
+        except Exception:
+            return None
+
+    def refresh(self, force: bool = False) -> None:
+        pass
+
+    def head(self, key: str) -> Optional[dict]:
+        raw = self._get(f"{key}.json")
+        return json.loads(raw) if raw else None
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        header = self.head(key)
+        image = self._get(f"{key}.bin") if header is not None else None
+        if image is None:
+            return None
+        header.pop("size", None)
+        return CachedResult(image=image, **header)
+
+    def put(self, key: str, entry: CachedResult) -> None:
+        self.client.put_object(
+            Bucket=self.bucket, Key=f"{self.prefix}{key}.bin", Body=entry.image, ContentType=entry.content_type
+        )
+        self.client.put_object(
+            Bucket=self.bucket, Key=f"{self.prefix}{key}.json",
+            Body=json.dumps(entry.header()).encode("utf-8"), ContentType="application/json",
+        )
+
+    def delete(self, key: str) -> None:
+        for suffix in (".bin", ".json"):
+            try:
+                self.client.delete_object(Bucket=self.bucket, Key=f"{self.prefix}{key}{suffix}")
+            except Exception:
+                pass
+
+    def read_revision(self) -> Optional[dict]:
+        raw = self._get("revision.json")
+        return json.loads(raw) if raw else None
+
+    def write_revision(self, revision: dict) -> None:
+        self.client.put_object(
+            Bucket=self.bucket, Key=f"{self.prefix}revision.json",
+            Body=json.dumps(revision).encode("utf-8"), ContentType="application/json",
+        )
+
+    def prune(self, ttl_s: float) -> int:
+        return 0
+
+
+class ResultCache:
+    """
+    Two-tier result cache with hit/miss/eviction counters
+
+    Args:
+        memory: In-process tier
+        store: Persistent tier shared across containers (optional)
+        ttl_s: Maximum entry age
+        revision_refresh_s: How long a CPU-side container trusts the published
+            revision before reading it again
+    """
+
+    def __init__(
+        self,
+        memory: MemoryLRU,
+        store: Any = None,
+        ttl_s: float = DEFAULT_TTL_S,
+        revision_refresh_s: float = 30.0,
+    ):
+        self.memory = memory
+        self.store = store
+        self.ttl_s = ttl_s
+        self.revision_refresh_s = revision_refresh_s
+        self._revision: Optional[dict] = None
+        self._revision_read_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+
+    def publish_revision(self, revision: dict) -> None:
+        """
+        Record the backend this container loaded (GPU side)
+
+        When it differs from the stored revision, the stored one is replaced
+        (CPU-side containers key new lookups by it) and expired entries are
+        pruned. Entries of the previous revision stay for containers still
+        running it.
+        """
+        self._revision = revision
+        self._revision_read_at = float("inf")  # never re-read: this container is the source
+        if self.store is None:
+            return
+        try:
+            previous = self.store.read_revision()
+            if previous is None or previous.get("id") != revision["id"]:
+                print(f"🗂️ Result cache revision {revision['id']} (was {previous and previous.get('id')})")
+                self.store.write_revision(revision)
+                removed = self.store.prune(self.ttl_s)
+                if removed:
+                    print(f"🧹 Pruned {removed} expired result cache entries")
+        except Exception as e:
+            print(f"⚠️ Could not publish result cache revision: {e}")
+
+    def current_revision(self) -> Optional[dict]:
+        """The published backend revision (CPU side reads it from the store)."""
+        now = time.monotonic()
+        if self._revision is not None and now - self._revision_read_at < self.revision_refresh_s:
+            return self._revision
+        if self.store is not None:
+            try:
+                self.store.refresh()
+                revision = self.store.read_revision()
+            except Exception:
+                revision = None
+            if revision is not None:
+                self._revision = revision
+                self._revision_read_at = now
+        return self._revision
+
+    def key_for(self, job: GenerationJob, enhanced_prompt: str) -> Optional[str]:
+        """`<revision id>/<digest>`, or None when the job can't be cached."""
+        revision = self.current_revision()
+        if revision is None:
+            return None
+        digest = request_key(job, enhanced_prompt, revision)
+        return f"{revision['id']}/{digest}" if digest is not None else None
+
+    def _fresh(self, header: dict) -> bool:
+        revision = self.current_revision()
+        return (
+            revision is not None
+            and header.get("revision") == revision["id"]
+            and time.time() - header.get("created_at", 0) <= self.ttl_s
+        )
+
+    def contains(self, key: str) -> bool:
+        """Cheap existence check (no image read from the persistent tier)."""
+        entry = self.memory.get(key)
+        if entry is not None and self._fresh(entry.header()):
+            return True
+        if self.store is None:
+            return False
+        header = self.store.head(key)
+        return header is not None and self._fresh(header)
+
+    def lookup(self, key: str) -> Optional[CachedResult]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            if self._fresh(entry.header()):
+                with self._lock:
+                    self.hits += 1
+                    self.memory_hits += 1
+                registry().inc("tenkaigen_cache_lookups_total", cache="result", outcome="memory_hit")
+                return entry
+            self.memory.discard(key)
+            with self._lock:
+                self.stale += 1
+
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is None:
+                # May have been written by another container since the last reload
+                self.store.refresh()
+                entry = self.store.get(key)
+            if entry is not None:
+                if self._fresh(entry.header()):
+                    self.memory.put(key, entry)
+                    with self._lock:
+                        self.hits += 1
+                    registry().inc("tenkaigen_cache_lookups_total", cache="result", outcome="hit")
+                    return entry
+                with self._lock:
+                    self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+        registry().inc("tenkaigen_cache_lookups_total", cache="result", outcome="miss")
+        return None
+
+    def put_result(self, key: str, result: dict) -> None:
+        """Store a successful generate() result in both tiers."""
+        revision = self.current_revision()
+        if revision is None or not result.get("success"):
+            return
+        image = result.get("image_bytes")
+        if image is None:
+            image = base64.b64decode(result["image_base64"])
+        entry = CachedResult(
+            image=bytes(image),
+            content_type=result.get("content_type", "image/png"),
+            metadata=dict(result.get("metadata", {})),
+            revision=revision["id"],
+            created_at=time.time(),
+        )
+        self.memory.put(key, entry)
+        if self.store is not None:
+            try:
+                self.store.put(key, entry)
+            except Exception as e:
+                print(f"⚠️ Result cache write failed: {e}")
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "stores": self.stores,
+                "evictions": self.memory.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "revision": self._revision and self._revision.get("id"),
+                "memory": self.memory.stats(),
+            }
+
+
+def cached_result(entry: CachedResult, job: GenerationJob) -> dict:
+    """Turn a cache entry into a generate() result for this job."""
+    metadata = {**entry.metadata, "prompt": job.prompt, "style": job.style, "cache": "hit"}
+    result: Dict[str, Any] = {"success": True, "content_type": entry.content_type, "metadata": metadata}
+    if job.result_format == "bytes":
+        result["image_bytes"] = entry.image
+    else:
+        result["image_base64"] = base64.b64encode(entry.image).decode("utf-8")
+    return result
+
+
+def result_cache_from_env(root: str, volume: Any = None) -> Optional[ResultCache]:
+    """
+    Build the cache configured by QWEN_RESULT_CACHE ("off", "volume", "s3")
+
+    Args:
+        root: Directory for the volume tier
+        volume: modal.Volume mounted at (a parent of) root, for commit/reload;
+            reload() remounts it, so it should hold nothing but the cache
+    """
+    backend = os.environ.get("QWEN_RESULT_CACHE", "volume").lower()
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown QWEN_RESULT_CACHE {backend!r}; expected one of {CACHE_BACKENDS}")
+    if backend == "off":
+        return None
+    if backend == "s3":
+        from .storage import make_s3_client
+        store = S3Store(
+            make_s3_client(),
+            os.environ.get("B2_S3_BUCKET", "dev-test-tenkaigen"),
+            os.environ.get("QWEN_RESULT_CACHE_PREFIX", "result-cache/"),
+        )
+    else:
+        store = DirectoryStore(root, volume=volume)
+    memory = MemoryLRU(int(float(os.environ.get("QWEN_RESULT_CACHE_MEMORY_MB", "256")) * 1024 * 1024))
+    return ResultCache(memory, store, ttl_s=float(os.environ.get("QWEN_RESULT_CACHE_TTL_S", str(DEFAULT_TTL_S))))
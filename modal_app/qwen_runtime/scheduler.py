@@ -0,0 +1,385 @@
+"""
+Priority and fair-share scheduling for the GPU pool
+
+`FairScheduler` decides which queued job gets the next free GPU slot:
+
+- priority classes are served in order ("interactive" before "batch"), so a
+  catalog backfill never sits in front of a customer in the designer;
+  `min_running` can reserve slots for a lower class so it is never starved
+- within a class, tenants (user_id, or job_id for anonymous jobs) share slots
+  by start-time fair queuing: the tenant that has received the least service
+  goes next, and a tenant returning from idle starts level with the others
+  (no banked credit, no leftover debt)
+- each tenant has at most `tenant_max_in_flight` jobs of a class running; a
+  capped tenant is skipped rather than holding up everybody else
+
+It is a plain in-memory data structure with an explicit clock (every method
+takes `now`), so `sim_scheduler.py` can replay thousands of jobs
+deterministically. It is not thread-safe; `JobQueue` in qwen_generator.py
+serializes access to it.
+"""
+import heapq
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+PRIORITIES = ("interactive", "batch")
+
+
+@dataclass
+class QueuedJob:
+    job_id: str
+    tenant: str
+    priority: str = "interactive"
+    payload: Dict[str, Any] = field(default_factory=dict)
+    cost: float = 1.0
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    seq: int = 0
+    attempts: int = 0
+
+
+class FairScheduler:
+    """
+    Args:
+        slots: Jobs that may run at once across the GPU pool
+        tenant_max_in_flight: Running jobs allowed per tenant and class, as
+            one number or a {priority: limit} dict
+        priorities: Class names, highest priority first
+        min_running: Slots a class may claim ahead of higher classes while it
+            has fewer than this many jobs running
+        service_time_s: Initial estimate of one job's run time, for ETAs
+        lease_s: Running jobs not completed within this are released by
+            `expire` (lost workers); None never expires them
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        tenant_max_in_flight: Union[int, Dict[str, int]] = 2,
+        priorities: Sequence[str] = PRIORITIES,
+        min_running: Optional[Dict[str, int]] = None,
+        service_time_s: float = 15.0,
+        lease_s: Optional[float] = None,
+    ):
+        self.slots = max(1, slots)
+        self.priorities = tuple(priorities)
+        if isinstance(tenant_max_in_flight, int):
+            tenant_max_in_flight = {p: tenant_max_in_flight for p in self.priorities}
+        self.tenant_max_in_flight = {p: max(1, tenant_max_in_flight.get(p, 1)) for p in self.priorities}
+        self.min_running = dict(min_running or {})
+        self.service_time_s = service_time_s
+        self.lease_s = lease_s
+        self._queues: Dict[str, Dict[str, Deque[QueuedJob]]] = {p: {} for p in self.priorities}
+        self._vtime: Dict[str, Dict[str, float]] = {p: {} for p in self.priorities}
+        # Start tag of the last job dispatched per class (the SFQ virtual clock)
+        self._clock: Dict[str, float] = {p: 0.0 for p in self.priorities}
+        # One (vtime, head seq, tenant) entry per active tenant; stale entries are skipped
+        self._heads: Dict[str, List[Tuple[float, int, str]]] = {p: [] for p in self.priorities}
+        self._queued: Dict[str, QueuedJob] = {}
+        self._running: Dict[str, QueuedJob] = {}
+        self._tenant_running: Dict[Tuple[str, str], int] = {}
+        self._class_running: Dict[str, int] = {p: 0 for p in self.priorities}
+        self._seq = 0
+        self.completed = 0
+        self.expired = 0
+
+    # -- queue mutation ---------------------------------------------------
+
+    def submit(self, job: QueuedJob, now: float) -> bool:
+        """Queue a job; False if its job_id is already queued or running."""
+        if job.priority not in self._queues:
+            raise ValueError(f"Unknown priority {job.priority!r}; expected one of {self.priorities}")
+        if job.job_id in self._queued or job.job_id in self._running:
+            return False
+        self._seq += 1
+        job.seq = self._seq
+        job.submitted_at = job.submitted_at or now
+        queues = self._queues[job.priority]
+        vtime = self._vtime[job.priority]
+        if job.tenant not in queues:
+            # New or returning from idle: neither credit for time spent away
+            # nor debt for jobs that already ran (the clock can stall while a
+            # crowd of one-job tenants drains, which would starve them)
+            vtime[job.tenant] = self._clock[job.priority]
+            queues[job.tenant] = deque()
+        queues[job.tenant].append(job)
+        if len(queues[job.tenant]) == 1:
+            self._push_head(job.priority, job.tenant)
+        self._queued[job.job_id] = job
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._queued.pop(job_id, None)
+        if job is None:
+            return False
+        queue = self._queues[job.priority][job.tenant]
+        was_head = queue[0] is job
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.priority][job.tenant]
+        elif was_head:
+            self._push_head(job.priority, job.tenant)
+        return True
+
+    def next(self, now: float) -> Optional[QueuedJob]:
+        """Claim a slot for the next job to run, or None when none can start."""
+        if len(self._running) >= self.slots:
+            return None
+        job = None
+        for priority in self.priorities:
+            if self._class_running[priority] < self.min_running.get(priority, 0):
+                job = self._pick(priority)
+                if job is not None:
+                    break
+        if job is None:
+            for priority in self.priorities:
+                job = self._pick(priority)
+                if job is not None:
+                    break
+        if job is None:
+            return None
+
+        queues = self._queues[job.priority]
+        vtime = self._vtime[job.priority]
+        self._clock[job.priority] = max(self._clock[job.priority], vtime[job.tenant])
+        vtime[job.tenant] += job.cost
+        queues[job.tenant].popleft()
+        if queues[job.tenant]:
+            self._push_head(job.priority, job.tenant)
+        else:
+            del queues[job.tenant]
+        if len(vtime) > 2 * len(queues) + 1024:
+            self._forget_idle(job.priority)
+        del self._queued[job.job_id]
+        job.started_at = now
+        self._running[job.job_id] = job
+        key = (job.priority, job.tenant)
+        self._tenant_running[key] = self._tenant_running.get(key, 0) + 1
+        self._class_running[job.priority] += 1
+        return job
+
+    def complete(self, job_id: str, now: float, duration_s: Optional[float] = None) -> Optional[QueuedJob]:
+        """Release a running job's slot and fold its run time into the ETA estimate."""
+        job = self._release(job_id)
+        if job is None:
+            return None
+        self.completed += 1
+        if duration_s is None and job.started_at is not None:
+            duration_s = now - job.started_at
+        if duration_s is not None and duration_s > 0:
+            self.service_time_s += 0.1 * (duration_s - self.service_time_s)
+        return job
+
+    def requeue(self, job_id: str, now: float) -> bool:
+        """Put a running job back in the queue (its dispatch failed)."""
+        job = self._release(job_id)
+        if job is None:
+            return False
+        job.started_at = None
+        return self.submit(job, now)
+
+    def expire(self, now: float) -> List[QueuedJob]:
+        """Release running jobs whose lease ran out."""
+        if self.lease_s is None:
+            return []
+        stale = [j.job_id for j in self._running.values() if now - j.started_at > self.lease_s]
+        self.expired += len(stale)
+        return [self._release(job_id) for job_id in stale]
+
+    def _release(self, job_id: str) -> Optional[QueuedJob]:
+        job = self._running.pop(job_id, None)
+        if job is None:
+            return None
+        key = (job.priority, job.tenant)
+        remaining = self._tenant_running[key] - 1
+        if remaining:
+            self._tenant_running[key] = remaining
+        else:
+            del self._tenant_running[key]
+        self._class_running[job.priority] -= 1
+        return job
+
+    def _forget_idle(self, priority: str) -> None:
+        # Idle tenants at or behind the clock would restart from it anyway
+        clock = self._clock[priority]
+        queues = self._queues[priority]
+        vtime = self._vtime[priority]
+        for tenant in [t for t, v in vtime.items() if t not in queues and v <= clock]:
+            del vtime[tenant]
+
+    def _push_head(self, priority: str, tenant: str) -> None:
+        queue = self._queues[priority][tenant]
+        heapq.heappush(self._heads[priority], (self._vtime[priority][tenant], queue[0].seq, tenant))
+
+    def _pick(self, priority: str) -> Optional[QueuedJob]:
+        """Head job of the least-served tenant under its cap; leaves its heap entry popped."""
+        heads = self._heads[priority]
+        queues = self._queues[priority]
+        capped = []
+        best = None
+        while heads:
+            entry = heads[0]
+            _, seq, tenant = entry
+            queue = queues.get(tenant)
+            if queue is None or queue[0].seq != seq:
+                heapq.heappop(heads)  # stale: dispatched or cancelled since
+                continue
+            if self.in_flight(priority, tenant) >= self.tenant_max_in_flight[priority]:
+                capped.append(heapq.heappop(heads))
+                continue
+            best = queue[0]
+            heapq.heappop(heads)
+            break
+        for entry in capped:
+            heapq.heappush(heads, entry)
+        return best
+
+    # -- introspection ----------------------------------------------------
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def job(self, job_id: str) -> Optional[QueuedJob]:
+        """A queued or running job."""
+        return self._queued.get(job_id) or self._running.get(job_id)
+
+    def in_flight(self, priority: str, tenant: str) -> int:
+        return self._tenant_running.get((priority, tenant), 0)
+
+    def startable(self, priority: Optional[str] = None) -> bool:
+        """Whether a queued job (of `priority`, or any class) is under its tenant cap."""
+        for p in (priority,) if priority else self.priorities:
+            for tenant in self._queues[p]:
+                if self.in_flight(p, tenant) < self.tenant_max_in_flight[p]:
+                    return True
+        return False
+
+    def position(self, job_id: str) -> Optional[int]:
+        """
+        Jobs expected to start before this one if nothing else arrives
+
+        Counts every queued job of a higher class, plus the jobs of its own
+        class whose fair-share start precedes it. Tenant caps are ignored here
+        and accounted for in `eta`.
+        """
+        job = self._queued.get(job_id)
+        if job is None:
+            return None
+        ahead = 0
+        for priority in self.priorities:
+            if priority == job.priority:
+                break
+            ahead += sum(len(q) for q in self._queues[priority].values())
+
+        vtime = self._vtime[job.priority]
+        start = vtime[job.tenant]
+        for queued in self._queues[job.priority][job.tenant]:
+            if queued is job:
+                break
+            start += queued.cost
+            ahead += 1
+        for tenant, queue in self._queues[job.priority].items():
+            if tenant == job.tenant:
+                continue
+            t = vtime[tenant]
+            for queued in queue:
+                if (t, queued.seq) >= (start, job.seq):
+                    break
+                t += queued.cost
+                ahead += 1
+        return ahead
+
+    def eta(self, job_id: str, now: float) -> Optional[float]:
+        """Estimated seconds until the job's result is ready."""
+        job = self._running.get(job_id)
+        if job is not None:
+            return max(0.0, job.started_at + self.service_time_s - now)
+        ahead = self.position(job_id)
+        if ahead is None:
+            return None
+        job = self._queued[job_id]
+        free = max(0, self.slots - len(self._running))
+        if ahead < free:
+            pool_wait = 0.0
+        else:
+            pool_wait = (ahead - free) // self.slots * self.service_time_s + self.service_time_s / 2
+        # A capped tenant drains its own queue tenant_max_in_flight at a time
+        own_ahead = 0
+        for queued in self._queues[job.priority][job.tenant]:
+            if queued is job:
+                break
+            own_ahead += 1
+        tenant_wait = own_ahead // self.tenant_max_in_flight[job.priority] * self.service_time_s
+        return max(pool_wait, tenant_wait) + self.service_time_s
+
+    def status(self, job_id: str, now: float) -> dict:
+        if job_id in self._running:
+            job = self._running[job_id]
+            return {
+                "state": "running",
+                "priority": job.priority,
+                "position": 0,
+                "running_s": round(now - job.started_at, 3),
+                "eta_s": round(self.eta(job_id, now), 1),
+            }
+        if job_id in self._queued:
+            job = self._queued[job_id]
+            return {
+                "state": "queued",
+                "priority": job.priority,
+                "position": self.position(job_id),
+                "queued_s": round(now - job.submitted_at, 3),
+                "eta_s": round(self.eta(job_id, now), 1),
+            }
+        return {"state": "unknown"}
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "running": len(self._running),
+            "queued": {p: sum(len(q) for q in self._queues[p].values()) for p in self.priorities},
+            "running_by_class": dict(self._class_running),
+            "tenants_queued": sum(len(self._queues[p]) for p in self.priorities),
+            "service_time_s": round(self.service_time_s, 3),
+            "completed": self.completed,
+            "expired": self.expired,
+        }
+
+    def running_jobs(self) -> List[QueuedJob]:
+        return list(self._running.values())
+
+
+def parse_limits(raw: str) -> Union[int, Dict[str, int]]:
+    """"4" applies to every class; "interactive=2,batch=4" sets them per class."""
+    if "=" not in raw:
+        return int(raw)
+    limits = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def scheduler_from_env(slots: Optional[int] = None) -> FairScheduler:
+    """
+    FairScheduler configured from the environment
+
+    TENKAIGEN_QUEUE_SLOTS (default 8), TENKAIGEN_TENANT_MAX_IN_FLIGHT
+    (default "interactive=2,batch=4"), TENKAIGEN_BATCH_MIN_SLOTS (default 0),
+    TENKAIGEN_QUEUE_SERVICE_S (default 15) and TENKAIGEN_QUEUE_LEASE_S
+    (default 900, the GPU function timeout).
+    """
+    if slots is None:
+        slots = int(os.environ.get("TENKAIGEN_QUEUE_SLOTS", "8"))
+    lease = float(os.environ.get("TENKAIGEN_QUEUE_LEASE_S", "900"))
+    return FairScheduler(
+        slots=slots,
+        tenant_max_in_flight=parse_limits(os.environ.get("TENKAIGEN_TENANT_MAX_IN_FLIGHT", "interactive=2,batch=4")),
+        min_running={"batch": int(os.environ.get("TENKAIGEN_BATCH_MIN_SLOTS", "0"))},
+        service_time_s=float(os.environ.get("TENKAIGEN_QUEUE_SERVICE_S", "15")),
+        lease_s=lease if lease > 0 else None,
+    )
@@ -0,0 +1,160 @@
+"""
+Cold-start helpers: Nunchaku artifact manifest and startup phase timing
+
+The Nunchaku wheel is resolved when the Modal image is built (see
+`bake_nunchaku` in qwen_generator.py), which writes a manifest describing what
+was installed. At container start `check_nunchaku_manifest` compares it with
+the running environment, so a bad image fails fast with a clear message instead
+of falling into pip installs or source builds inside `@modal.enter()`.
+
+Startup is split into two stages: "cpu" (imports and weight loading into host
+memory, captured by Modal's memory snapshot) and "gpu" (placement, worker
+threads and warm-up, run after every restore). `StartupTimer` times both.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+NUNCHAKU_MANIFEST_PATH = "/opt/tenkaigen/nunchaku_manifest.json"
+
+
+class NunchakuArtifactError(RuntimeError):
+    """The image does not contain a usable Nunchaku build."""
+
+
+def check_nunchaku_manifest(
+    path: str = NUNCHAKU_MANIFEST_PATH,
+    torch_version: Optional[str] = None,
+    nunchaku_version: Optional[str] = None,
+) -> dict:
+    """
+    Validate the build-time manifest against the running environment
+
+    Args:
+        path: Manifest location
+        torch_version: Running torch version (read from torch when omitted)
+        nunchaku_version: Installed nunchaku version (read from package
+            metadata when omitted)
+
+    Returns:
+        The manifest dict
+
+    Raises:
+        NunchakuArtifactError: Missing manifest, failed build, or a version
+            mismatch between what was baked and what is installed
+    """
+    if not os.path.exists(path):
+        raise NunchakuArtifactError(
+            f"Nunchaku manifest {path} not found; the image was built without the bake_nunchaku step. "
+            "Redeploy to rebuild the image, or unset ENABLE_NUNCHAKU."
+        )
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get("error"):
+        raise NunchakuArtifactError(
+            f"Nunchaku could not be installed at image build time: {manifest['error']}"
+        )
+
+    if torch_version is None:
+        import torch
+        torch_version = torch.__version__
+    if manifest.get("torch") != torch_version:
+        raise NunchakuArtifactError(
+            f"Nunchaku was built for torch {manifest.get('torch')} but torch {torch_version} is installed"
+        )
+
+    if nunchaku_version is None:
+        from importlib import metadata
+        try:
+            nunchaku_version = metadata.version("nunchaku")
+        except metadata.PackageNotFoundError:
+            nunchaku_version = None
+    if manifest.get("nunchaku") != nunchaku_version:
+        raise NunchakuArtifactError(
+            f"Manifest records nunchaku {manifest.get('nunchaku')} but {nunchaku_version} is installed"
+        )
+    return manifest
+
+
+def warmup_sizes(raw: Optional[str] = None) -> List[Tuple[int, int]]:
+    """
+    Sizes to warm up at: QWEN_WARMUP_SIZES ("1664x928,1024x1024"), otherwise
+    every resolution bucket
+
+    Each size gets its own dummy generation so per-shape work (kernel
+    selection, allocator growth, compiled graphs) is done before serving.
+    """
+    from .buckets import bucket_table_from_env, parse_buckets
+
+    if raw is None:
+        raw = os.environ.get("QWEN_WARMUP_SIZES")
+    if raw is not None:
+        return parse_buckets(raw)
+    return bucket_table_from_env().buckets or [(1664, 928), (1024, 1024)]
+
+
+class StartupTimer:
+    """
+    Wall-clock duration of each named cold-start phase
+
+    Phases (import, weight_load, ...) nest inside stages ("cpu", "gpu"). A
+    timer created before a memory snapshot is restored along with it, so the
+    cpu stage of a restored container reports the figures from the container
+    that took the snapshot; `snapshot_gap_s` is the wall time between the cpu
+    stage ending and the gpu stage starting (near zero without a restore).
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.stages: Dict[str, float] = {}
+        self._stage_wall: Dict[str, Tuple[float, float]] = {}
+        self._created = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        wall_start = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            self._stage_wall[name] = (wall_start, time.time())
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Accumulate so a phase can be re-entered (e.g. a retried load)
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def stage_windows(self) -> Dict[str, Tuple[float, float]]:
+        """Wall-clock (start, end) of each stage, for attaching cold starts to job traces."""
+        return dict(self._stage_wall)
+
+    def report(self) -> dict:
+        # perf_counter does not carry across a snapshot restore, so with stages
+        # the total is their sum rather than the time since construction
+        total = sum(self.stages.values()) if self.stages else time.perf_counter() - self._created
+        report = {
+            "phases_s": {name: round(duration, 3) for name, duration in self.phases.items()},
+            "total_s": round(total, 3),
+        }
+        if self.stages:
+            report["stages_s"] = {name: round(duration, 3) for name, duration in self.stages.items()}
+        if "cpu" in self._stage_wall and "gpu" in self._stage_wall:
+            gap = self._stage_wall["gpu"][0] - self._stage_wall["cpu"][1]
+            report["snapshot_gap_s"] = round(max(0.0, gap), 3)
+        return report
+
+    def log(self) -> None:
+        report = self.report()
+        parts = ", ".join(f"{name} {duration:.2f}s" for name, duration in report["phases_s"].items())
+        stages = ", ".join(f"{name} {duration:.2f}s" for name, duration in report.get("stages_s", {}).items())
+        if stages:
+            parts = f"{parts} [{stages}]"
+        print(f"⏱️ Startup {report['total_s']:.2f}s: {parts}")
@@ -0,0 +1,131 @@
+"""
+Direct-to-object-storage upload from the GPU worker
+
+Instead of shipping the PNG through the webhook and letting Next.js upload it to
+B2, the worker PUTs the image straight into S3-compatible storage and the
+webhook only carries the object key, size and checksum.
+
+Two ways to authorise the upload:
+- a presigned PUT URL passed in the job body (`upload_url`), or
+- credentials from the environment (the same B2_S3_* variables the frontend
+  uses), enabled with TENKAIGEN_DIRECT_UPLOAD=1
+
+Point B2_S3_ENDPOINT at a local MinIO, or pass a stub client to `upload_image`
+as `sim_storage.py` does, to exercise this without B2.
+"""
+import hashlib
+import os
+from typing import Any, Optional
+
+
+def direct_upload_enabled() -> bool:
+    return str(os.environ.get("TENKAIGEN_DIRECT_UPLOAD", "0")).lower() in ("1", "true", "yes")
+
+
+def object_key_for(job_id: str, user_id: Optional[str] = None, ext: str = "png") -> str:
+    """Key layout matching the webhook route: {prefix}{user_id}/{job_id}.{ext}."""
+    prefix = os.environ.get("B2_S3_PREFIX", "ai-generated/")
+    owner = user_id or "modal"
+    return f"{prefix}{owner}/{job_id}.{ext}"
+
+
+def make_s3_client() -> Any:
+    """boto3 S3 client configured from the B2_S3_* environment variables."""
+    import boto3
+
+    return boto3.client(
+        "s3",
+        endpoint_url=os.environ.get("B2_S3_ENDPOINT") or None,
+        region_name=os.environ.get("B2_S3_REGION", "us-east-005"),
+        aws_access_key_id=os.environ.get("B2_S3_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.environ.get("B2_S3_SECRET_ACCESS_KEY"),
+    )
+
+
+def upload_image(
+    image_bytes: bytes,
+    object_key: str,
+    content_type: str = "image/png",
+    presigned_url: Optional[str] = None,
+    client: Any = None,
+    bucket: Optional[str] = None,
+) -> dict:
+    """
+    Upload one image and describe the stored object
+
+    Uses the presigned URL when given, otherwise an S3 client (the one passed
+    in, or one built from the environment). Raises on upload failure.
+
+    Returns:
+        dict with object_key, size_bytes, sha256 and content_type
+    """
+    sha256 = hashlib.sha256(image_bytes).hexdigest()
+    if presigned_url:
+        import httpx
+
+        response = httpx.put(
+            presigned_url,
+            content=image_bytes,
+            headers={"Content-Type": content_type},
+            timeout=60,
+        )
+        response.raise_for_status()
+    else:
+        client = client or make_s3_client()
+        client.put_object(
+            Bucket=bucket or os.environ.get("B2_S3_BUCKET", "dev-test-tenkaigen"),
+            Key=object_key,
+            Body=image_bytes,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000",
+            Metadata={"sha256": sha256},
+        )
+    return {
+        "object_key": object_key,
+        "size_bytes": len(image_bytes),
+        "sha256": sha256,
+        "content_type": content_type,
+    }
+
+
+def wants_direct_upload(upload_url: Optional[str]) -> bool:
+    """True when a job should be uploaded by the worker rather than the webhook."""
+    return bool(upload_url) or direct_upload_enabled()
+
+
+def store_result(
+    job_id: str,
+    result: dict,
+    upload_url: Optional[str] = None,
+    object_key: Optional[str] = None,
+    user_id: Optional[str] = None,
+    client: Any = None,
+) -> dict:
+    """
+    Upload the image in a successful result and return a reference-only result
+
+    The returned dict drops `image_bytes`/`image_base64` and carries the
+    storage reference instead. On upload failure the original result is
+    returned unchanged so the webhook can still deliver the image inline.
+    """
+    if not result.get("success"):
+        return result
+    image_bytes = result.get("image_bytes")
+    if image_bytes is None:
+        import base64
+        image_bytes = base64.b64decode(result["image_base64"])
+
+    content_type = result.get("content_type", "image/png")
+    key = object_key or object_key_for(job_id, user_id, ext=content_type.split("/")[-1])
+    try:
+        stored = upload_image(
+            image_bytes, key, content_type=content_type, presigned_url=upload_url, client=client
+        )
+    except Exception as e:
+        print(f"⚠️ Direct upload failed for job {job_id}, falling back to inline delivery: {e}")
+        return result
+
+    print(f"☁️ Uploaded {stored['size_bytes']} bytes to {stored['object_key']}")
+    reference = {k: v for k, v in result.items() if k not in ("image_bytes", "image_base64")}
+    reference.update(stored)
+    return reference
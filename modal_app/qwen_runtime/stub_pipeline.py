@@ -0,0 +1,131 @@
+"""
+Stub stand-in for QwenImagePipeline
+
+Mimics the call signature of diffusers' QwenImagePipeline closely enough for the
+generator code paths (batching, result fan-out, encoding) to run on CPU without
+torch or model weights. Output images are flat colour fills derived from the
+prompt and seed so results are deterministic and distinguishable per item.
+With `textured=True` they get seeded noise instead, so encoding costs roughly
+what it does for a real design. `load_delay_s` and `transfer_delay_s` stand in
+for weight loading and the host-to-device copy, so the snapshot-friendly
+cpu/gpu startup split can be timed without a GPU. A `callback_on_step_end`
+is called after each simulated step, as diffusers does.
+"""
+import hashlib
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, List, Optional, Sequence, Union
+
+
+def _seed_of(generator: Any) -> Optional[int]:
+    """Extract a seed from a torch.Generator, an int, or None."""
+    if generator is None:
+        return None
+    if isinstance(generator, int):
+        return generator
+    initial_seed = getattr(generator, "initial_seed", None)
+    if callable(initial_seed):
+        return int(initial_seed())
+    return None
+
+
+class StubQwenPipeline:
+    """
+    Drop-in replacement for QwenImagePipeline used for CPU testing
+
+    Args:
+        step_delay_s: Seconds to sleep per denoising step to simulate GPU time
+        fail_on: Optional substring; any prompt containing it raises RuntimeError
+        textured: Fill images with seeded smooth noise instead of a flat colour
+        load_delay_s: Seconds to sleep on construction (weight loading)
+        transfer_delay_s: Seconds to sleep in `to()` (moving weights to the GPU)
+    """
+
+    def __init__(
+        self,
+        step_delay_s: float = 0.0,
+        fail_on: Optional[str] = None,
+        textured: bool = False,
+        load_delay_s: float = 0.0,
+        transfer_delay_s: float = 0.0,
+    ):
+        self.step_delay_s = step_delay_s
+        self.fail_on = fail_on
+        self.textured = textured
+        self.transfer_delay_s = transfer_delay_s
+        self.device = "cpu"
+        self.calls: List[dict] = []
+        self._lock = threading.Lock()
+        if load_delay_s:
+            time.sleep(load_delay_s)
+
+    def to(self, device: str) -> "StubQwenPipeline":
+        """Pretend to move the weights; only sleeps and records the device."""
+        if self.transfer_delay_s:
+            time.sleep(self.transfer_delay_s)
+        self.device = device
+        return self
+
+    def __call__(
+        self,
+        prompt: Union[str, Sequence[str]],
+        negative_prompt: Union[str, Sequence[str], None] = None,
+        width: int = 1024,
+        height: int = 1024,
+        num_inference_steps: int = 4,
+        generator: Any = None,
+        num_images_per_prompt: int = 1,
+        callback_on_step_end: Any = None,
+        **kwargs,
+    ) -> SimpleNamespace:
+        from PIL import Image
+
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        generators = generator if isinstance(generator, (list, tuple)) else [generator] * len(prompts)
+        if len(generators) != len(prompts):
+            raise ValueError(
+                f"Got {len(generators)} generators for a batch of {len(prompts)} prompts"
+            )
+
+        with self._lock:
+            self.calls.append({
+                "prompt": prompts,
+                "negative_prompt": negative_prompt,
+                "width": width,
+                "height": height,
+                "num_inference_steps": num_inference_steps,
+                "seeds": [_seed_of(g) for g in generators],
+                **kwargs,
+            })
+
+        if self.fail_on is not None and any(self.fail_on in p for p in prompts):
+            raise RuntimeError(f"Stub pipeline failure for prompt containing {self.fail_on!r}")
+
+        if callback_on_step_end is not None:
+            for step in range(num_inference_steps):
+                if self.step_delay_s:
+                    time.sleep(self.step_delay_s)
+                callback_on_step_end(self, step, num_inference_steps - step, {})
+        elif self.step_delay_s:
+            time.sleep(self.step_delay_s * num_inference_steps)
+
+        images = []
+        for p, g in zip(prompts, generators):
+            digest = hashlib.sha256(f"{p}|{_seed_of(g)}".encode("utf-8")).digest()
+            for _ in range(num_images_per_prompt):
+                if self.textured:
+                    images.append(self._textured(width, height, digest))
+                else:
+                    images.append(Image.new("RGB", (width, height), tuple(digest[:3])))
+        return SimpleNamespace(images=images)
+
+    @staticmethod
+    def _textured(width: int, height: int, digest: bytes):
+        from PIL import Image
+
+        rng = random.Random(digest)
+        small = (max(1, width // 8), max(1, height // 8))
+        noise = rng.randbytes(small[0] * small[1] * 3)
+        return Image.frombytes("RGB", small, noise).resize((width, height), Image.BICUBIC)
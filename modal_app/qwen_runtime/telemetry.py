@@ -0,0 +1,273 @@
+"""
+Fleet-wide counters and histograms in the Prometheus text format
+
+`PipelineMetrics` describes one GPU container; capacity planning needs totals
+across every container. Code anywhere in a process records into the
+process-wide `registry()`:
+
+    registry().inc("tenkaigen_jobs_accepted_total", endpoint="single", priority="interactive")
+    registry().observe("tenkaigen_generation_seconds", 11.2, backend="nunchaku", resolution="1664x928")
+
+A `MetricsPusher` thread writes the registry's cumulative totals to a shared
+store under the process's own key every TENKAIGEN_METRICS_PUSH_S seconds. The
+store is anything with dict-style `[key] = value`, `items()` and `pop()`: the
+"tenkaigen-metrics" modal.Dict in production, a plain dict in benches. Since
+each worker only ever overwrites its own key, pushes need no locking and a
+repeated push is harmless. `collect` sums every worker's totals and `render`
+formats them for GET /metrics on the ingress. Entries not updated for
+TENKAIGEN_METRICS_RETENTION_S are dropped, which Prometheus' rate() treats
+as a counter reset.
+
+Metric names, help text and histogram buckets are declared in `METRICS`;
+`render` skips names it doesn't know so a typo can't leak into the scrape.
+"""
+import atexit
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+# name -> (type, help, histogram buckets)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    "tenkaigen_jobs_accepted_total": (
+        "counter", "Jobs accepted by the ingress, by endpoint and priority", (),
+    ),
+    "tenkaigen_jobs_rejected_total": (
+        "counter", "Jobs the ingress turned away, by endpoint and reason (invalid, overloaded)", (),
+    ),
+    "tenkaigen_generation_seconds": (
+        "histogram", "Time from a job reaching the micro-batcher to its encoded image, by backend and generation size",
+        (1, 2.5, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 300),
+    ),
+    "tenkaigen_webhook_seconds": (
+        "histogram", "Webhook delivery time including retries, by outcome (delivered, failed)",
+        (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+    ),
+    "tenkaigen_webhook_failures_total": (
+        "counter", "Webhook deliveries given up, by reason (rejected: 4xx, exhausted: retries used up)", (),
+    ),
+    "tenkaigen_cache_lookups_total": (
+        "counter", "Result and prompt cache lookups, by cache and outcome (memory_hit, hit, pinned, miss)", (),
+    ),
+    "tenkaigen_cold_starts_total": (
+        "counter", "GPU containers started, by backend", (),
+    ),
+    "tenkaigen_cold_start_seconds": (
+        "histogram", "GPU container startup time by stage (cpu is the snapshotted figure on restored containers)",
+        (1, 5, 10, 20, 30, 60, 90, 120, 180, 300, 600),
+    ),
+}
+
+DEFAULT_PUSH_S = 15.0
+DEFAULT_RETENTION_S = 7 * 24 * 3600.0
+
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    """Canonical Prometheus label set: sorted keys, escaped values, no braces."""
+    parts = []
+    for key in sorted(labels):
+        value = str(labels[key]).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return ",".join(parts)
+
+
+class Registry:
+    """Thread-safe cumulative counters and histograms for one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, float]] = {}
+        # Per label set: non-cumulative bucket counts (+Inf last), sum, count
+        self._histograms: Dict[str, Dict[str, dict]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = format_labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        bounds = METRICS[name][2]
+        key = format_labels(labels)
+        index = next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": [0] * (len(bounds) + 1), "sum": 0.0, "count": 0}
+            hist["buckets"][index] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def snapshot(self) -> dict:
+        """Cumulative totals as plain data (safe to pickle into a modal.Dict)."""
+        with self._lock:
+            return {
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+                "histograms": {
+                    name: {key: {**hist, "buckets": list(hist["buckets"])} for key, hist in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+
+class MetricsPusher:
+    """
+    Writes a registry's totals to the shared store on an interval
+
+    Args:
+        registry: What to push
+        store: Dict-like shared store
+        worker_id: This process's key in the store
+        interval_s: Seconds between pushes
+    """
+
+    def __init__(self, registry: Registry, store: Any, worker_id: str, interval_s: float = DEFAULT_PUSH_S):
+        self.registry = registry
+        self.store = store
+        self.worker_id = worker_id
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def push(self) -> bool:
+        try:
+            self.store[self.worker_id] = {"updated_at": time.time(), **self.registry.snapshot()}
+            return True
+        except Exception as e:
+            print(f"⚠️ Could not push metrics: {e}")
+            return False
+
+    def start(self) -> "MetricsPusher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="metrics-push", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the thread and push one last time."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s)
+        self.push()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.push()
+
+
+_registry = Registry()
+_pusher: Optional[MetricsPusher] = None
+_pusher_lock = threading.Lock()
+
+
+def registry() -> Registry:
+    """The process-wide registry."""
+    return _registry
+
+
+def metrics_enabled() -> bool:
+    return os.environ.get("TENKAIGEN_METRICS", "1").lower() in ("1", "true", "yes")
+
+
+def start_pushing(store: Any, role: str, interval_s: Optional[float] = None) -> Optional[MetricsPusher]:
+    """
+    Push this process's registry to `store` in the background (once per process)
+
+    The key is `role` plus the Modal task ID, so a restarted container starts
+    a new series. Returns the pusher, or None when TENKAIGEN_METRICS is off.
+    """
+    global _pusher
+    if not metrics_enabled():
+        return None
+    with _pusher_lock:
+        if _pusher is None:
+            if interval_s is None:
+                interval_s = float(os.environ.get("TENKAIGEN_METRICS_PUSH_S", str(DEFAULT_PUSH_S)))
+            worker_id = f"{role}:{os.environ.get('MODAL_TASK_ID') or uuid.uuid4().hex[:12]}"
+            _pusher = MetricsPusher(_registry, store, worker_id, interval_s).start()
+            # Best effort for functions without an exit hook
+            atexit.register(stop_pushing)
+        return _pusher
+
+
+def stop_pushing() -> None:
+    global _pusher
+    with _pusher_lock:
+        pusher, _pusher = _pusher, None
+    if pusher is not None:
+        pusher.stop()
+
+
+def collect(store: Any, now: Optional[float] = None, retention_s: Optional[float] = None) -> dict:
+    """Sum every worker's totals in `store`, dropping entries older than the retention."""
+    if now is None:
+        now = time.time()
+    if retention_s is None:
+        retention_s = float(os.environ.get("TENKAIGEN_METRICS_RETENTION_S", str(DEFAULT_RETENTION_S)))
+    counters: Dict[str, Dict[str, float]] = {}
+    histograms: Dict[str, Dict[str, dict]] = {}
+    workers = 0
+    for worker_id, entry in list(store.items()):
+        if now - entry.get("updated_at", 0.0) > retention_s:
+            store.pop(worker_id, None)
+            continue
+        workers += 1
+        for name, series in entry.get("counters", {}).items():
+            merged = counters.setdefault(name, {})
+            for key, value in series.items():
+                merged[key] = merged.get(key, 0.0) + value
+        for name, series in entry.get("histograms", {}).items():
+            merged = histograms.setdefault(name, {})
+            for key, hist in series.items():
+                total = merged.get(key)
+                if total is None or len(total["buckets"]) != len(hist["buckets"]):
+                    # A worker on other bucket bounds (mid-deploy) replaces rather than corrupts
+                    merged[key] = {**hist, "buckets": list(hist["buckets"])}
+                    continue
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], hist["buckets"])]
+                total["sum"] += hist["sum"]
+                total["count"] += hist["count"]
+    return {"counters": counters, "histograms": histograms, "workers": workers}
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _series(name: str, key: str, value: float, extra: str = "") -> str:
+    labels = ",".join(part for part in (key, extra) if part)
+    return f"{name}{{{labels}}} {_number(value)}" if labels else f"{name} {_number(value)}"
+
+
+def render(snapshot: dict) -> str:
+    """Prometheus text exposition (format 0.0.4) of a `collect` result."""
+    lines: List[str] = []
+    for name, (kind, help_text, bounds) in METRICS.items():
+        if kind == "counter":
+            series = snapshot.get("counters", {}).get(name)
+        else:
+            series = snapshot.get("histograms", {}).get(name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in sorted(series):
+            if kind == "counter":
+                lines.append(_series(name, key, series[key]))
+                continue
+            hist = series[key]
+            cumulative = 0
+            for bound, count in zip(tuple(bounds) + (math.inf,), hist["buckets"]):
+                cumulative += count
+                lines.append(_series(f"{name}_bucket", key, cumulative, f'le="{_number(bound)}"'))
+            lines.append(_series(f"{name}_sum", key, hist["sum"]))
+            lines.append(_series(f"{name}_count", key, hist["count"]))
+    lines.append("# HELP tenkaigen_metrics_workers Workers whose totals are included")
+    lines.append("# TYPE tenkaigen_metrics_workers gauge")
+    lines.append(f"tenkaigen_metrics_workers {snapshot.get('workers', 0)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,251 @@
+"""
+Per-job span trees
+
+A `Trace` records where one job's time went, as a tree of spans with wall-clock
+start and end times:
+
+    job
+    ├── queue              submitted -> dispatched by JobQueue (queue mode)
+    ├── container_acquire  dispatched (or submitted) -> running in a GPU container
+    │   └── enter.cpu / enter.gpu   cold start, when this job paid for it
+    ├── generate
+    │   ├── result_cache
+    │   ├── batch_wait     micro-batch window
+    │   ├── encode_prompt
+    │   ├── denoise
+    │   │   └── step 0..n-1  (step 0 also covers latent preparation)
+    │   ├── decode         VAE decode and postprocessing
+    │   └── encode         fit to the output size and image encoding
+    ├── upload
+    └── deliver
+
+Spans around GPU work carry `gpu_peak_mb`: the allocated-memory high-water
+mark since the pipeline call started, as of the end of the span. It is read
+from torch's allocator counters (no device sync) and left out when torch or
+CUDA is not loaded.
+
+Spans can be added from any thread (the pipeline and encoder threads add
+theirs to the job's trace), and intervals measured elsewhere can be recorded
+after the fact with `add`, which is how one batched pipeline call ends up in
+the trace of every job in the batch.
+
+TENKAIGEN_TRACE selects the export: "json" (default) logs each finished trace
+as one JSON line, "otel" emits it through the OpenTelemetry API (configure
+the SDK/exporter with the usual OTEL_* variables), "off" records nothing.
+The tree also goes into the webhook `metadata.trace`, without the deliver
+span, which ends after the webhook is sent. `bench_tracing.py` measures the
+overhead.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_MODES = ("off", "json", "otel")
+
+
+def trace_mode() -> str:
+    mode = os.environ.get("TENKAIGEN_TRACE", "json").lower()
+    if mode in ("0", "false", "no", "none"):
+        return "off"
+    return mode if mode in TRACE_MODES else "json"
+
+
+def gpu_peak_bytes() -> Optional[int]:
+    """Allocated-memory high-water mark, or None without an initialized CUDA torch."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return int(torch.cuda.max_memory_allocated())
+
+
+def reset_gpu_peak() -> None:
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.reset_peak_memory_stats()
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "attrs", "children")
+
+    def __init__(self, name: str, start: float, end: Optional[float] = None, attrs: Optional[dict] = None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs = attrs or {}
+        self.children: List["Span"] = []
+
+    def to_dict(self, origin: float) -> dict:
+        """Times in ms relative to `origin` (the root's start)."""
+        end = self.end if self.end is not None else time.time()
+        item = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+        }
+        if self.attrs:
+            item["attrs"] = self.attrs
+        if self.children:
+            item["children"] = [child.to_dict(origin) for child in sorted(self.children, key=lambda s: s.start)]
+        return item
+
+
+class Trace:
+    """
+    Span tree for one job
+
+    Args:
+        name: Root span name
+        start: Root start time (time.time()); now when omitted, or e.g. the
+            ingress submit time so queueing is inside the tree
+        trace_id: Shared with the spans exported to OpenTelemetry; random
+            when omitted
+        attrs: Root attributes (job_id, ...)
+    """
+
+    def __init__(self, name: str, start: Optional[float] = None, trace_id: Optional[str] = None, **attrs: Any):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.root = Span(name, start if start is not None else time.time(), attrs=attrs)
+        # Where spans without an explicit parent go; moved by callers as the
+        # job passes through stages (e.g. to the "generate" span)
+        self.current = self.root
+        self.marks: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        parent: Optional[Span] = None,
+        **attrs: Any,
+    ) -> Span:
+        """Record an interval measured elsewhere."""
+        span = Span(name, start, end, attrs)
+        with self._lock:
+            (parent or self.current).children.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attrs: Any) -> Iterator[Span]:
+        span = self.add(name, time.time(), None, parent, **attrs)
+        try:
+            yield span
+        finally:
+            span.end = time.time()
+
+    def mark(self, name: str) -> None:
+        self.marks[name] = time.time()
+
+    def attach(self, tree: dict, parent: Optional[Span] = None) -> None:
+        """Graft a `to_dict` tree from another process (e.g. the GPU container) under parent."""
+        base = tree.get("origin")
+        if base is None:
+            return
+        self._graft(tree, base, parent or self.current)
+
+    def _graft(self, item: dict, origin: float, parent: Span) -> None:
+        start = origin + item["start_ms"] / 1000
+        span = self.add(item["name"], start, start + item["duration_ms"] / 1000, parent, **item.get("attrs", {}))
+        for child in item.get("children", ()):
+            self._graft(child, origin, span)
+
+    def finish(self) -> None:
+        if self.root.end is None:
+            self.root.end = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            tree = self.root.to_dict(self.root.start)
+        tree["trace_id"] = self.trace_id
+        tree["origin"] = self.root.start
+        return tree
+
+    def export(self, mode: Optional[str] = None) -> None:
+        """Finish the trace and emit it as configured (TENKAIGEN_TRACE)."""
+        self.finish()
+        mode = mode or trace_mode()
+        if mode == "otel" and _export_otel(self):
+            return
+        if mode != "off":
+            print(json.dumps({"event": "trace", **self.to_dict()}, separators=(",", ":")))
+
+
+def start_trace(name: str, start: Optional[float] = None, **attrs: Any) -> Optional[Trace]:
+    """A new Trace, or None when TENKAIGEN_TRACE is off."""
+    if trace_mode() == "off":
+        return None
+    return Trace(name, start=start, **attrs)
+
+
+def span(trace: Optional[Trace], name: str, parent: Optional[Span] = None, **attrs: Any):
+    """`trace.span(...)`, or a no-op context when tracing is off."""
+    if trace is None:
+        return nullcontext()
+    return trace.span(name, parent, **attrs)
+
+
+class StepRecorder:
+    """
+    `callback_on_step_end` for diffusers pipelines: timestamps each denoising step
+
+    Added to the pipeline call only when a job in the batch is traced.
+    """
+
+    def __init__(self):
+        self.steps: List[tuple] = []  # (end time, gpu peak bytes)
+
+    def __call__(self, pipe: Any, step: int, timestep: Any, callback_kwargs: dict) -> dict:
+        self.steps.append((time.time(), gpu_peak_bytes()))
+        return callback_kwargs
+
+    def record(self, trace: Trace, call_start: float, call_end: float, end_peak: Optional[int], **attrs: Any) -> None:
+        """Add denoise (with one child per step) and decode spans to a job's trace."""
+        if not self.steps:
+            trace.add("pipeline", call_start, call_end, **_peak(end_peak), **attrs)
+            return
+        denoise_end, denoise_peak = self.steps[-1]
+        denoise = trace.add("denoise", call_start, denoise_end, **_peak(denoise_peak), **attrs)
+        previous = call_start
+        for index, (end, peak) in enumerate(self.steps):
+            trace.add("step", previous, end, denoise, index=index, **_peak(peak))
+            previous = end
+        trace.add("decode", denoise_end, call_end, **_peak(end_peak))
+
+
+def _peak(peak_bytes: Optional[int]) -> dict:
+    return {} if peak_bytes is None else {"gpu_peak_mb": round(peak_bytes / 2**20, 1)}
+
+
+_otel_warned = False
+
+
+def _export_otel(trace: Trace) -> bool:
+    """Emit the tree as OpenTelemetry spans; False (JSON fallback) without the API."""
+    global _otel_warned
+    try:
+        from opentelemetry import trace as otel
+    except ImportError:
+        if not _otel_warned:
+            print("⚠️ TENKAIGEN_TRACE=otel but opentelemetry is not installed; logging traces as JSON")
+            _otel_warned = True
+        return False
+
+    tracer = otel.get_tracer("tenkaigen")
+
+    def emit(span: Span, context: Any) -> None:
+        attributes = {key: value for key, value in span.attrs.items() if isinstance(value, (str, bool, int, float))}
+        attributes["tenkaigen.trace_id"] = trace.trace_id
+        otel_span = tracer.start_span(span.name, context=context, start_time=int(span.start * 1e9), attributes=attributes)
+        child_context = otel.set_span_in_context(otel_span)
+        for child in span.children:
+            emit(child, child_context)
+        otel_span.end(end_time=int((span.end if span.end is not None else time.time()) * 1e9))
+
+    with trace._lock:
+        emit(trace.root, None)
+    return True
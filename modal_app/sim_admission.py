@@ -0,0 +1,242 @@
+"""
+Simulation: admission control under a traffic spike
+
+Replays an arrival trace through `qwen_runtime.job_queue.JobQueueCore` (the
+state behind the `JobQueue` Modal class) on a discrete-event clock, once with
+`AdmissionController` and once admitting everything, and reports per priority
+class how many jobs were admitted, downgraded and rejected, and the latency
+(submit to result) of the admitted ones against the class SLO.
+
+Rejected clients come back once after the Retry-After they were given
+(--retries), like the frontend does. Downgraded jobs run for
+`downgrade_speedup` of their normal time at their size, under the default
+bucket table, which has no smaller bucket for some sizes (1024x1024).
+
+The default trace is a seeded hour of mixed traffic at --load of the pool's
+capacity with a 10-minute spike at --spike x that rate. --trace replays a
+JSON-lines file instead, one arrival per line:
+    {"at": 12.5, "priority": "interactive", "tenant": "user-3", "duration": 14.2, "width": 1472, "height": 1104}
+(tenant, duration and size are optional).
+
+Exits non-zero if the p95 latency of admitted interactive jobs exceeds the
+SLO by more than --tolerance (admission works from a mean run time, so jobs
+admitted right at the limit can land a little over it), or if the same trace
+gives a different result twice.
+
+Usage:
+    python modal_app/sim_admission.py
+    python modal_app/sim_admission.py --load 0.8 --spike 4 --slo interactive=90,batch=600
+    python modal_app/sim_admission.py --trace arrivals.jsonl
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import random
+import sys
+from typing import Dict, List, Optional
+
+from qwen_runtime.admission import DEFAULT_SIZE, AdmissionController, DEFAULT_SLO_S, downgrade_speedup, parse_mapping
+from qwen_runtime.buckets import DEFAULT_BUCKETS, BucketTable
+from qwen_runtime.job_queue import JobQueueCore
+from qwen_runtime.scheduler import FairScheduler, parse_limits
+
+BUCKETS = BucketTable(DEFAULT_BUCKETS)
+# Requested sizes in the synthetic trace: storefront 16:9 mostly, then the other ratios
+SIZES = [(1664, 928)] * 4 + [(928, 1664), (1472, 1104), (1584, 1056), (1024, 1024)]
+
+
+def make_trace(seed: int, slots: int, service_s: float, load: float, spike: float, hours: float) -> List[dict]:
+    """Arrivals sorted by time: dicts with job_id, tenant, priority, at, duration, size."""
+    rng = random.Random(seed)
+    capacity = slots / service_s  # jobs per second the pool can finish
+    horizon = hours * 3600.0
+    spike_start, spike_end = horizon / 3, horizon / 3 + 600.0
+    users = [f"user-{u}" for u in range(300)]
+    batch_tenants = ["catalog", "partner-a", "partner-b"]
+    trace = []
+    t = 0.0
+    while True:
+        rate = capacity * load * (spike if spike_start <= t < spike_end else 1.0)
+        t += rng.expovariate(rate)
+        if t >= horizon:
+            break
+        interactive = rng.random() < 0.6
+        trace.append({
+            "job_id": f"job-{len(trace)}",
+            "tenant": rng.choice(users) if interactive else rng.choice(batch_tenants),
+            "priority": "interactive" if interactive else "batch",
+            "at": t,
+            "duration": service_s * rng.lognormvariate(0, 0.25),
+            "size": rng.choice(SIZES),
+        })
+    return trace
+
+
+def load_trace(path: str, service_s: float) -> List[dict]:
+    trace = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            i = len(trace)
+            trace.append({
+                "job_id": row.get("job_id", f"job-{i}"),
+                "tenant": row.get("tenant") or f"tenant-{i}",
+                "priority": row.get("priority", "interactive"),
+                "at": float(row["at"]),
+                "duration": float(row.get("duration", service_s)),
+                "size": (int(row.get("width", DEFAULT_SIZE[0])), int(row.get("height", DEFAULT_SIZE[1]))),
+            })
+    trace.sort(key=lambda j: j["at"])
+    return trace
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))]
+
+
+def speedup(job: dict) -> float:
+    return downgrade_speedup(job["downgrade"], *job["size"], BUCKETS)
+
+
+def simulate(trace: List[dict], core: JobQueueCore, slo_s: Dict[str, float], retries: int) -> dict:
+    events = []  # (time, order, kind, job_id)
+    order = 0
+    for job in trace:
+        heapq.heappush(events, (job["at"], order, "arrive", job["job_id"]))
+        order += 1
+    by_id = {job["job_id"]: job for job in trace}
+    attempts: Dict[str, int] = {}
+    finished: Dict[str, float] = {}
+    downgraded = set()
+    rejected = set()
+    retry_after: List[float] = []
+    digest = hashlib.sha256()
+
+    while events:
+        now, _, kind, job_id = heapq.heappop(events)
+        job = by_id[job_id]
+        if kind == "arrive":
+            attempts[job_id] = attempts.get(job_id, 0) + 1
+            entry = {
+                "job_id": job_id,
+                "tenant": job["tenant"],
+                "priority": job["priority"],
+                "submitted_at": now,
+                "payload": {"job_id": job_id, "prompt": job_id, "width": job["size"][0], "height": job["size"][1]},
+            }
+            status = core.submit([entry], now)[0]
+            digest.update(f"{job_id}:{status['state']}@{now:.6f};".encode())
+            if status["state"] == "rejected":
+                retry_after.append(status["retry_after_s"])
+                if attempts[job_id] <= retries:
+                    heapq.heappush(events, (now + status["retry_after_s"], order, "arrive", job_id))
+                    order += 1
+                else:
+                    rejected.add(job_id)
+        else:
+            duration = job["duration"] * (speedup(job) if job_id in downgraded else 1.0)
+            core.complete(job_id, now, duration_s=duration)
+            finished[job_id] = now
+
+        while True:
+            started, _ = core.claim(now)
+            if started is None:
+                break
+            real = by_id[started.job_id]
+            duration = real["duration"]
+            if started.payload.get("downgrade"):
+                downgraded.add(started.job_id)
+                real["downgrade"] = started.payload["downgrade"]
+                duration *= speedup(real)
+            heapq.heappush(events, (now + duration, order, "done", started.job_id))
+            order += 1
+
+    report = {"digest": digest.hexdigest()[:16]}
+    for priority in sorted({job["priority"] for job in trace}):
+        jobs = [job for job in trace if job["priority"] == priority]
+        # Latency counts from the first attempt, so a retry's wait is included
+        latencies = [finished[j["job_id"]] - j["at"] for j in jobs if j["job_id"] in finished]
+        slo = slo_s.get(priority)
+        met = sum(1 for latency in latencies if slo is None or latency <= slo)
+        report[priority] = {
+            "jobs": len(jobs),
+            "completed": len(latencies),
+            "rejected": sum(1 for j in jobs if j["job_id"] in rejected),
+            "retried": sum(1 for j in jobs if attempts.get(j["job_id"], 0) > 1),
+            "downgraded": sum(1 for j in jobs if j["job_id"] in downgraded),
+            "slo_s": slo,
+            "slo_attainment": round(met / len(latencies), 4) if latencies else None,
+            "latency_p50_s": round(percentile(latencies, 0.5), 1),
+            "latency_p95_s": round(percentile(latencies, 0.95), 1),
+            "latency_max_s": round(max(latencies), 1) if latencies else 0.0,
+        }
+    report["retry_after_p50_s"] = percentile(retry_after, 0.5)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="JSON-lines arrival trace (default: synthetic)")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--tenant-max-in-flight", default="interactive=2,batch=4", help="One limit, or per class")
+    parser.add_argument("--service-s", type=float, default=12.0, help="Median job run time")
+    parser.add_argument("--load", type=float, default=0.7, help="Baseline arrival rate as a share of capacity")
+    parser.add_argument("--spike", type=float, default=3.0, help="Arrival rate multiplier during the spike")
+    parser.add_argument("--hours", type=float, default=1.0)
+    parser.add_argument("--slo", help="Per-class SLO, e.g. interactive=120,batch=900")
+    parser.add_argument("--downgrade-at", type=float, default=0.5)
+    parser.add_argument("--retries", type=int, default=1, help="Times a rejected client retries after Retry-After")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed p95 overshoot of the interactive SLO, as a fraction")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace, args.service_s)
+    else:
+        trace = make_trace(args.seed, args.slots, args.service_s, args.load, args.spike, args.hours)
+    slo_s = parse_mapping(args.slo) if args.slo else dict(DEFAULT_SLO_S)
+
+    def core(admission: Optional[AdmissionController]) -> JobQueueCore:
+        scheduler = FairScheduler(
+            slots=args.slots,
+            tenant_max_in_flight=parse_limits(args.tenant_max_in_flight),
+            service_time_s=args.service_s,
+        )
+        return JobQueueCore(scheduler, coalesce=False, admission=admission)
+
+    def controlled() -> JobQueueCore:
+        return core(AdmissionController(
+            slo_s=slo_s, downgrade_at=args.downgrade_at, service_time_s=args.service_s, buckets=BUCKETS
+        ))
+
+    # Each run mutates the trace rows (downgrade), so give each its own copy
+    first = simulate([dict(j) for j in trace], controlled(), slo_s, args.retries)
+    again = simulate([dict(j) for j in trace], controlled(), slo_s, args.retries)
+    unlimited = simulate([dict(j) for j in trace], core(None), slo_s, args.retries)
+
+    deterministic = first["digest"] == again["digest"]
+    interactive = first.get("interactive", {})
+    slo = interactive.get("slo_s")
+    breached = bool(interactive.get("completed")) and slo is not None and (
+        interactive["latency_p95_s"] > slo * (1.0 + args.tolerance)
+    )
+    report = {
+        "arrivals": len(trace),
+        "admission": first,
+        "no_admission": unlimited,
+        "deterministic": deterministic,
+        "interactive_slo_breached": breached,
+    }
+    print(json.dumps(report, indent=2))
+    if breached or not deterministic:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
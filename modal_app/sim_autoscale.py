@@ -0,0 +1,233 @@
+"""
+Replay: predicted GPU cost vs queue wait for a warm-container policy
+
+Replays an arrival trace through a model of the GPU pool, once with today's
+settings (no minimum, no buffer, containers released after
+--scaledown-window idle seconds) and once per --headroom value with
+`qwen_runtime.autoscaling.Autoscaler` setting min/buffer containers every
+--interval seconds, as `JobQueue` does in production.
+
+The pool model follows Modal's autoscaler closely enough for comparing
+policies: jobs wait in a FIFO capped at --slots running jobs (JobQueue), each
+container runs --inputs jobs at once, containers are started whenever the
+dispatched jobs plus the buffer exceed warm capacity (or the pool is under
+the minimum) and take --cold-start-s to become ready, and a container idle
+for the scaledown window is stopped if the pool is above its target. Wait is
+arrival to start of generation, so it includes cold starts.
+
+The default trace is a seeded synthetic day with a night trough, a morning
+ramp and a few bursts. --trace replays a JSON-lines file, one arrival per line:
+    {"at": 12.5, "duration": 14.2}
+(duration is optional; "at" is seconds from the start of the trace).
+
+Usage:
+    python modal_app/sim_autoscale.py
+    python modal_app/sim_autoscale.py --headroom 0,0.5,1,2 --utilization 0.6
+    python modal_app/sim_autoscale.py --trace arrivals.jsonl --gpu-hourly 1.10
+"""
+import argparse
+import json
+import math
+import random
+from collections import deque
+from typing import List, Optional
+
+from qwen_runtime.autoscaling import AutoscalePolicy, Autoscaler
+
+
+def make_trace(seed: int, peak_per_min: float, service_s: float, hours: float) -> List[dict]:
+    """Arrivals sorted by time: dicts with at and duration."""
+    rng = random.Random(seed)
+
+    def profile(hour: float) -> float:
+        hour %= 24
+        if hour < 7:
+            return 0.01
+        if hour < 9:
+            return 0.01 + 0.99 * (hour - 7) / 2  # morning ramp
+        if hour < 18:
+            return 1.0 - 0.2 * abs(hour - 13) / 5
+        if hour < 23:
+            return 0.8 - 0.7 * (hour - 18) / 5
+        return 0.02
+
+    horizon = hours * 3600.0
+    bursts = [(rng.uniform(9, 20) * 3600.0, rng.randint(20, 60)) for _ in range(int(3 * hours / 24) or 1)]
+    trace = []
+    t = 0.0
+    peak = peak_per_min / 60.0
+    while True:
+        # Thinning: draw at the peak rate, keep with probability profile(t)
+        t += rng.expovariate(peak)
+        if t >= horizon:
+            break
+        if rng.random() < profile(t / 3600.0):
+            trace.append({"at": t, "duration": service_s * rng.lognormvariate(0, 0.25)})
+    for at, size in bursts:
+        if at < horizon:
+            for _ in range(size):
+                trace.append({"at": at + rng.uniform(0, 30), "duration": service_s * rng.lognormvariate(0, 0.25)})
+    trace.sort(key=lambda j: j["at"])
+    return trace
+
+
+def load_trace(path: str, service_s: float) -> List[dict]:
+    trace = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                trace.append({"at": float(row["at"]), "duration": float(row.get("duration", service_s))})
+    trace.sort(key=lambda j: j["at"])
+    return trace
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))]
+
+
+def replay(trace: List[dict], args, autoscaler: Optional[Autoscaler]) -> dict:
+    dt = args.step_s
+    per = args.inputs
+    queue: deque = deque()  # waiting in JobQueue: (arrived_at, duration)
+    pending: deque = deque()  # dispatched, waiting for a container
+    containers = []  # {"ready_at", "busy", "idle_since"}
+    running = []  # (end, container, duration)
+    min_containers, buffer_containers = args.min_containers, args.buffer_containers
+    waits = []
+    container_s = 0.0
+    busy_input_s = 0.0
+    cold_starts = 0
+    changes = []
+    next_arrival = 0
+    next_policy = 0.0
+    end_at = (trace[-1]["at"] if trace else 0.0) + 3600.0
+    t = 0.0
+
+    while t < end_at or queue or pending or running:
+        # Arrivals
+        while next_arrival < len(trace) and trace[next_arrival]["at"] <= t:
+            job = trace[next_arrival]
+            queue.append((job["at"], job["duration"]))
+            if autoscaler is not None:
+                autoscaler.observe_arrival(job["at"])
+            next_arrival += 1
+        # Completions
+        still = []
+        for end, container, duration in running:
+            if end <= t:
+                container["busy"] -= 1
+                if container["busy"] == 0:
+                    container["idle_since"] = t
+                if autoscaler is not None:
+                    autoscaler.observe_service(duration)
+            else:
+                still.append((end, container, duration))
+        running = still
+        # JobQueue dispatches up to its slots
+        while queue and len(pending) + len(running) < args.slots:
+            pending.append(queue.popleft())
+        # Inputs land on warm containers with room
+        warm = [c for c in containers if c["ready_at"] <= t]
+        for container in warm:
+            while pending and container["busy"] < per:
+                arrived_at, duration = pending.popleft()
+                waits.append(t - arrived_at)
+                container["busy"] += 1
+                container["idle_since"] = None
+                running.append((t + duration, container, duration))
+                busy_input_s += duration
+        # Modal's side: start containers for unplaced inputs plus the buffer, keep the minimum
+        demand = math.ceil((len(pending) + len(running)) / per)
+        target = max(min_containers, demand + buffer_containers if demand or min_containers else 0)
+        while len(containers) < target:
+            containers.append({"ready_at": t + args.cold_start_s, "busy": 0, "idle_since": t + args.cold_start_s})
+            cold_starts += 1
+        idle = sorted(
+            (c for c in containers if c["busy"] == 0 and c["idle_since"] is not None and c["ready_at"] <= t),
+            key=lambda c: c["idle_since"],
+        )
+        for container in idle:
+            if len(containers) <= target:
+                break
+            if t - container["idle_since"] >= args.scaledown_window:
+                containers.remove(container)
+        container_s += len(containers) * dt
+        # The controller, on JobQueue's schedule
+        if autoscaler is not None and t >= next_policy:
+            autoscaler.observe_queue(len(queue), len(pending) + len(running))
+            rec = autoscaler.update(t)
+            if rec is not None:
+                min_containers, buffer_containers = rec.settings()
+                changes.append((round(t / 3600.0, 2), min_containers, buffer_containers))
+            next_policy = t + args.interval
+        t += dt
+
+    gpu_hours = container_s / 3600.0
+    return {
+        "jobs": len(waits),
+        "wait_p50_s": round(percentile(waits, 0.5), 1),
+        "wait_p95_s": round(percentile(waits, 0.95), 1),
+        "wait_p99_s": round(percentile(waits, 0.99), 1),
+        "wait_max_s": round(max(waits), 1) if waits else 0.0,
+        "cold_start_waits": sum(1 for w in waits if w >= args.cold_start_s / 2),
+        "gpu_hours": round(gpu_hours, 2),
+        "cost_usd": round(gpu_hours * args.gpu_hourly, 2),
+        "utilization": round(busy_input_s / (container_s * per), 4) if container_s else 0.0,
+        "cold_starts": cold_starts,
+        "setting_changes": len(changes),
+        "first_changes": changes[:6],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="JSON-lines arrival trace (default: synthetic day)")
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--peak-per-min", type=float, default=60.0, help="Synthetic trace: arrivals per minute at peak")
+    parser.add_argument("--service-s", type=float, default=12.0, help="Median job run time")
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--slots", type=int, default=32, help="JobQueue slots (TENKAIGEN_QUEUE_SLOTS)")
+    parser.add_argument("--inputs", type=int, default=4, help="Jobs per container (QWEN_MAX_CONCURRENT_INPUTS)")
+    parser.add_argument("--cold-start-s", type=float, default=60.0)
+    parser.add_argument("--scaledown-window", type=float, default=300.0)
+    parser.add_argument("--min-containers", type=int, default=0, help="Baseline minimum")
+    parser.add_argument("--buffer-containers", type=int, default=0, help="Baseline buffer")
+    parser.add_argument("--gpu-hourly", type=float, default=1.10, help="USD per container-hour")
+    parser.add_argument("--headroom", default="0,0.5,1", help="Comma-separated headroom values to replay")
+    parser.add_argument("--utilization", type=float, default=0.9)
+    parser.add_argument("--drain-s", type=float, default=120.0)
+    parser.add_argument("--floor", type=int, default=0, help="Controller's min_floor")
+    parser.add_argument("--down-after-s", type=float, default=900.0)
+    parser.add_argument("--window-s", type=float, default=600.0)
+    parser.add_argument("--interval", type=float, default=30.0, help="Seconds between controller updates")
+    parser.add_argument("--step-s", type=float, default=1.0, help="Simulation time step")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace, args.service_s)
+    else:
+        trace = make_trace(args.seed, args.peak_per_min, args.service_s, args.hours)
+
+    report = {"arrivals": len(trace), "baseline": replay(trace, args, None), "controller": []}
+    for headroom in (float(h) for h in args.headroom.split(",") if h.strip()):
+        policy = AutoscalePolicy(
+            inputs_per_container=args.inputs,
+            target_utilization=args.utilization,
+            headroom=headroom,
+            drain_s=args.drain_s,
+            min_floor=args.floor,
+            max_containers=math.ceil(args.slots / args.inputs),
+            scale_down_after_s=args.down_after_s,
+            window_s=args.window_s,
+        )
+        result = replay(trace, args, Autoscaler(policy, service_time_s=args.service_s))
+        report["controller"].append({"headroom": headroom, **result})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Simulation: grouping, batch splitting and result fan-out on the stub pipeline
+
+Runs mixed jobs through `group_jobs`, `run_batch` and the `MicroBatcher` with
+the stub pipeline, whose images are a flat colour derived from each item's
+prompt and seed, so a result handed to the wrong job shows in its pixels.
+
+Checks, exiting non-zero on failure:
+- jobs with different (width, height, steps, cfg) never share a group or a
+  pipeline call, and every job lands in exactly one group
+- max_batch_size splits a larger compatible group into calls of at most that
+  size, earliest arrivals first
+- results come back in submission order, each with its own prompt, seed and
+  image, also for concurrent submissions to the micro-batcher
+- a job that fails to encode fails alone; a pipeline call that raises fails
+  only the jobs in that call
+
+Usage:
+    python modal_app/sim_batching.py
+    python modal_app/sim_batching.py --jobs 64 --batch-size 3
+
+Requires Pillow (in the Modal image).
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import random
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from qwen_runtime.batching import GenerationJob, MicroBatcher, batch_key, group_jobs, run_batch
+from qwen_runtime.stub_pipeline import StubQwenPipeline
+
+SIZES = [(256, 256), (320, 192), (192, 320)]
+STEPS = [None, 2, 3]
+CFGS = [None, 2.0]
+
+
+def enhance(prompt, style):
+    return f"{prompt} [{style}]"
+
+
+def colour_of(job: GenerationJob, seed: int) -> tuple:
+    """The stub's fill for this job: the first bytes of sha256(enhanced prompt | seed)."""
+    return tuple(hashlib.sha256(f"{enhance(job.prompt, job.style)}|{seed}".encode()).digest()[:3])
+
+
+def make_jobs(count: int, rng: random.Random) -> list:
+    jobs = []
+    for i in range(count):
+        width, height = rng.choice(SIZES)
+        jobs.append(GenerationJob(
+            prompt=f"design {i}", style="Anime", width=width, height=height,
+            num_inference_steps=rng.choice(STEPS), cfg_scale=rng.choice(CFGS), seed=1000 + i,
+        ))
+    return jobs
+
+
+def check_results(name, jobs, results, violations, failing=()):
+    for index, (job, result) in enumerate(zip(jobs, results)):
+        if index in failing:
+            if result.get("success"):
+                violations.append(f"{name}: job {index} should have failed")
+            continue
+        if not result.get("success"):
+            violations.append(f"{name}: job {index} failed: {result.get('error')}")
+            continue
+        metadata = result["metadata"]
+        if metadata["prompt"] != job.prompt or metadata["seed"] != job.seed:
+            violations.append(f"{name}: job {index} got the result of {metadata['prompt']!r}")
+            continue
+        key = batch_key(job, True)
+        ran = (metadata["width"], metadata["height"], metadata["steps"], metadata["cfg_scale"])
+        if ran != (key.width, key.height, key.steps, key.cfg_scale):
+            violations.append(f"{name}: job {index} ran with {ran}, expected {tuple(key)}")
+        image = Image.open(io.BytesIO(result["image_bytes"]))
+        if image.size != (job.width, job.height) or image.convert("RGB").getpixel((0, 0)) != colour_of(job, job.seed):
+            violations.append(f"{name}: job {index} got another job's image")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    violations = []
+    jobs = make_jobs(args.jobs, rng)
+    for job in jobs:
+        job.result_format = "bytes"
+        job.encoding = {"format": "png"}
+    keys = [batch_key(job, True) for job in jobs]
+
+    # Grouping
+    groups = group_jobs(jobs, use_nunchaku=True, max_batch_size=args.batch_size)
+    placed = sorted(i for group in groups for i in group)
+    if placed != list(range(len(jobs))):
+        violations.append("group_jobs lost or duplicated jobs")
+    for group in groups:
+        if len({keys[i] for i in group}) != 1:
+            violations.append(f"group {group} mixes sampling parameters")
+        if len(group) > args.batch_size:
+            violations.append(f"group {group} exceeds max_batch_size {args.batch_size}")
+        if group != sorted(group):
+            violations.append(f"group {group} is out of arrival order")
+    if [group[0] for group in groups] != sorted(group[0] for group in groups):
+        violations.append("groups are not ordered by their first job")
+    per_key = Counter(keys)
+    expected_groups = sum(-(-count // args.batch_size) for count in per_key.values())
+    if len(groups) != expected_groups:
+        violations.append(f"{len(groups)} groups, expected {expected_groups}")
+    # Splitting: every full group of a key is filled before the next one starts
+    for key in per_key:
+        sizes = [len(group) for group in groups if keys[group[0]] == key]
+        if any(size != args.batch_size for size in sizes[:-1]):
+            violations.append(f"{key} split unevenly: {sizes}")
+
+    def run(batch, pipe):
+        return [future.result() for future in run_batch(
+            pipe, batch, use_nunchaku=True, enhance_prompt=enhance,
+            max_batch_size=args.batch_size, generator_factory=lambda seed: seed,
+        )]
+
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink):
+        # Fan-out in submission order, one pipeline call per group
+        pipe = StubQwenPipeline()
+        check_results("run_batch", jobs, run(jobs, pipe), violations)
+        if len(pipe.calls) != len(groups):
+            violations.append(f"{len(pipe.calls)} pipeline calls for {len(groups)} groups")
+        for call in pipe.calls:
+            if len(call["prompt"]) > args.batch_size:
+                violations.append(f"a pipeline call ran {len(call['prompt'])} prompts")
+
+        # One item that cannot be encoded, inside a full batch
+        same = [GenerationJob(prompt=f"same {i}", style="Anime", width=256, height=256, seed=i,
+                              result_format="bytes", encoding={"format": "png"}) for i in range(max(args.batch_size, 2))]
+        same[1].encoding = {"format": "bmp"}
+        pipe = StubQwenPipeline()
+        check_results("bad encoding", same, run(same, pipe), violations, failing={1})
+        if len(pipe.calls) != -(-len(same) // args.batch_size):
+            violations.append(f"bad encoding: the failing item changed the calls ({len(pipe.calls)})")
+
+        # A pipeline call that raises: only the jobs in that call fail
+        mixed = [GenerationJob(prompt=f"mixed {i}", style="Anime", width=256, height=256, seed=i,
+                               result_format="bytes", encoding={"format": "png"}) for i in range(2 * args.batch_size)]
+        mixed[0].prompt = "mixed 0 BOOM"
+        alone = GenerationJob(prompt="alone BOOM", style="Anime", width=320, height=192, seed=99,
+                              result_format="bytes", encoding={"format": "png"})
+        batch = mixed + [alone]
+        results = run(batch, StubQwenPipeline(fail_on="BOOM"))
+        first_call = set(group_jobs(batch, True, args.batch_size)[0])
+        check_results("pipeline failure", batch, results, violations, failing=first_call | {len(batch) - 1})
+
+        # Concurrent submissions through the micro-batcher
+        pipe = StubQwenPipeline(step_delay_s=0.001)
+        batcher = MicroBatcher(
+            lambda batch: run_batch(pipe, batch, use_nunchaku=True, enhance_prompt=enhance,
+                                    max_batch_size=args.batch_size, generator_factory=lambda seed: seed),
+            window_s=0.02,
+            max_batch_size=args.batch_size,
+        )
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            concurrent = list(pool.map(lambda job: batcher.submit(job).result(), jobs))
+        batcher.close()
+        check_results("micro-batcher", jobs, concurrent, violations)
+        for call in pipe.calls:
+            if len(call["prompt"]) > args.batch_size:
+                violations.append(f"micro-batcher: a call ran {len(call['prompt'])} prompts")
+        call_sizes = Counter(len(call["prompt"]) for call in pipe.calls)
+
+    report = {
+        "jobs": args.jobs,
+        "batch_size": args.batch_size,
+        "distinct_keys": len(per_key),
+        "groups": len(groups),
+        "micro_batcher_call_sizes": dict(sorted(call_sizes.items())),
+        "violations": violations[:10],
+        "violation_count": len(violations),
+    }
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Simulation: concurrent duplicate submissions through JobQueueCore
+
+Drives `qwen_runtime.job_queue.JobQueueCore`, the same state the `JobQueue`
+Modal class wraps, from many client threads at once. Clients double-click and
+retry (the same request under new job IDs, and the same job ID again) while a
+dispatcher thread hands jobs to a pool of fake GPU workers. A share of the
+workers "crash" without reporting back, so lease expiry has to dispatch their
+jobs again (or fail them, with their followers, after the last attempt).
+
+Checks, exiting non-zero on failure:
+- every job ID receives exactly one result (or one failure)
+- a job's result is the one generated for its own request fingerprint
+- no fingerprint ever runs twice at the same time
+- repeated job IDs are ignored
+- nothing is left in the queue or the coalescing table at the end
+- the same seeded request from many tenants at once never coalesces across
+  tenants, and with direct upload every job's result points at its own
+  object_key, each written to the (stub) bucket
+
+Usage:
+    python modal_app/sim_coalescing.py
+    python modal_app/sim_coalescing.py --clients 32 --requests 2000 --crash-rate 0.02
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from qwen_runtime.coalescing import follower_result
+from qwen_runtime.job_queue import JobQueueCore, entry_fingerprint
+from qwen_runtime.scheduler import FairScheduler
+from qwen_runtime.storage import store_result
+
+
+class StubS3:
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, **kwargs):
+        with self.lock:
+            self.objects[kwargs["Key"]] = kwargs["Body"]
+
+
+def upload_targets(clients: int, copies: int, violations: list) -> dict:
+    """Identical seeded requests from every client at once, each with its own object_key."""
+    os.environ["TENKAIGEN_DIRECT_UPLOAD"] = "1"  # uploads with credentials, here the stub client
+    core = JobQueueCore(FairScheduler(slots=4))
+    s3 = StubS3()
+    delivered = {}
+    payload = {"prompt": "shared design", "style": "Anime", "width": 1024, "height": 1024, "seed": 42}
+
+    def client(index: int):
+        for copy in range(copies):
+            job_id = f"u{index}-{copy}"
+            entry = {
+                "job_id": job_id,
+                "tenant": f"user-{index}",
+                "priority": "interactive",
+                "submitted_at": time.time(),
+                "payload": {
+                    "job_id": job_id, **payload, "user_id": f"user-{index}",
+                    "object_key": f"ai-generated/user-{index}/{job_id}.png",
+                },
+            }
+            core.submit([entry], time.time())
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            job, _ = core.claim(time.time())
+            if job is None:
+                break
+            generated = {"success": True, "image_bytes": b"png:" + job.job_id.encode(), "content_type": "image/png"}
+            stored = store_result(job.job_id, generated, None, job.payload["object_key"], job.payload["user_id"], client=s3)
+            delivered[job.job_id] = stored
+            for follower in core.complete(job.job_id, time.time()):
+                target = {"job_id": follower["job_id"], **follower["payload"]}
+                if follower["tenant"] != job.tenant:
+                    violations.append(f"{follower['job_id']} coalesced with another tenant's {job.job_id}")
+                delivered[follower["job_id"]] = follower_result(generated, target, client=s3)
+
+    for index in range(clients):
+        for copy in range(copies):
+            job_id = f"u{index}-{copy}"
+            key = f"ai-generated/user-{index}/{job_id}.png"
+            result = delivered.get(job_id)
+            if result is None:
+                violations.append(f"{job_id} received no result")
+            elif result.get("object_key") != key:
+                violations.append(f"{job_id} got object_key {result.get('object_key')}, expected {key}")
+            elif key not in s3.objects:
+                violations.append(f"{job_id}'s object {key} was never written")
+    return {"jobs": clients * copies, "gpu_runs": clients, "objects_written": len(s3.objects)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="Distinct requests across all clients")
+    parser.add_argument("--duplicate-rate", type=float, default=0.3, help="Share of requests sent again under a new job ID")
+    parser.add_argument("--retry-rate", type=float, default=0.1, help="Share of job IDs submitted twice")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--run-ms", type=float, default=5.0)
+    parser.add_argument("--crash-rate", type=float, default=0.01, help="Share of runs that never report back")
+    parser.add_argument("--lease-ms", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    core = JobQueueCore(FairScheduler(slots=args.slots, tenant_max_in_flight=4, lease_s=args.lease_ms / 1000.0))
+    lock = threading.Lock()
+    delivered = Counter()
+    results = {}
+    expected = {}
+    running = Counter()
+    violations = []
+    runs = Counter()
+    crashes = [0]
+    submitted_ids = set()
+    done = threading.Event()
+
+    def deliver(job_id: str, fingerprint: str):
+        with lock:
+            delivered[job_id] += 1
+            results[job_id] = fingerprint
+
+    def worker(job):
+        fingerprint = entry_fingerprint({"payload": job.payload, "tenant": job.tenant})
+        with lock:
+            running[fingerprint] += 1
+            runs[fingerprint] += 1
+            if running[fingerprint] > 1:
+                violations.append(f"{fingerprint[:8]} running twice at once")
+        time.sleep(args.run_ms / 1000.0 * random.uniform(0.5, 1.5))
+        with lock:
+            running[fingerprint] -= 1
+            crash = random.random() < args.crash_rate
+            crashes[0] += crash
+        if crash:
+            return  # lost worker: the lease has to recover the job
+        followers = core.complete(job.job_id, time.time())
+        deliver(job.job_id, fingerprint)
+        for follower in followers:
+            deliver(follower["job_id"], fingerprint)
+
+    def dispatcher():
+        while not done.is_set():
+            job, failed = core.claim(time.time())
+            for job_id in failed:
+                deliver(job_id, "failed")
+            if job is None:
+                time.sleep(0.001)
+                continue
+            threading.Thread(target=worker, args=(job,), daemon=True).start()
+
+    def client(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        tenant = f"user-{index}"
+        for n in range(args.requests // args.clients):
+            payload = {"prompt": f"design {index}-{n}", "style": "Anime", "width": 1024, "height": 1024, "seed": None}
+            copies = 2 if rng.random() < args.duplicate_rate else 1
+            for copy in range(copies):
+                job_id = f"{index}-{n}-{copy}"
+                entry = {
+                    "job_id": job_id,
+                    "tenant": tenant,
+                    "priority": "interactive",
+                    "submitted_at": time.time(),
+                    "payload": {"job_id": job_id, **payload},
+                }
+                with lock:
+                    expected[job_id] = entry_fingerprint(entry)
+                    submitted_ids.add(job_id)
+                core.submit([entry], time.time())
+                if rng.random() < args.retry_rate:
+                    core.submit([entry], time.time())  # frontend retry with the same job ID
+                time.sleep(rng.uniform(0, 0.002))
+
+    start = time.perf_counter()
+    threading.Thread(target=dispatcher, daemon=True).start()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        with lock:
+            if len(delivered) == len(submitted_ids):
+                break
+        time.sleep(0.01)
+    done.set()
+    wall_s = time.perf_counter() - start
+
+    for job_id, fingerprint in expected.items():
+        if delivered[job_id] != 1:
+            violations.append(f"{job_id} received {delivered[job_id]} results")
+        elif results[job_id] not in (fingerprint, "failed"):
+            violations.append(f"{job_id} received another request's result")
+    stats = core.stats()
+    if stats["running"] or sum(stats["queued"].values()) or stats["coalescing"]["in_flight"]:
+        violations.append(f"queue not drained: {stats}")
+    uploads = upload_targets(args.clients, 3, violations)
+
+    report = {
+        "jobs": len(expected),
+        "distinct_requests": len(set(expected.values())),
+        "gpu_runs": sum(runs.values()),
+        "crashed_runs": crashes[0],
+        "coalesced": stats["coalescing"]["coalesced"],
+        "lease_expired": stats["expired"],
+        "failed_after_retries": sum(1 for r in results.values() if r == "failed"),
+        "wall_s": round(wall_s, 3),
+        "direct_upload": uploads,
+        "violations": violations[:10],
+        "violation_count": len(violations),
+    }
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
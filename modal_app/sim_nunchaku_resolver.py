@@ -0,0 +1,146 @@
+"""
+Simulation: Nunchaku transformer resolution against fake package trees
+
+Writes throwaway packages to a temp directory on sys.path, laid out like
+different Nunchaku releases, and resolves the transformer class in each
+through a counting importer, with the per-version cache in a temp file.
+
+Checks, exiting non-zero on failure:
+- a class at a known module path is found without walking the package
+- a class at an unknown path is found by the walk, past modules that fail
+  to import
+- a package without the class raises ImportError
+- save=False leaves the cache file alone; remember_transformer_class writes
+  it once and reports an unchanged entry as such
+- a cached version resolves with a single import
+- a new version, or a cached module that no longer imports, scans again
+
+Usage:
+    python modal_app/sim_nunchaku_resolver.py
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
+
+from qwen_runtime.nunchaku_resolver import remember_transformer_class, resolve_transformer_class, scan_for_transformer
+
+CLASS_SOURCE = "class NunchakuQwenImageTransformer2DModel:\n    pass\n"
+
+
+def write_tree(root: str, package: str, files: dict) -> None:
+    """files: module path relative to the package ("models/x.py") -> source."""
+    for relative, source in {"__init__.py": "", **files}.items():
+        path = os.path.join(root, package, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Every directory is a package, as in the real tree
+        init = os.path.join(os.path.dirname(path), "__init__.py")
+        if not os.path.exists(init):
+            open(init, "w").close()
+        with open(path, "w") as f:
+            f.write(source)
+
+
+class CountingImporter:
+    def __init__(self):
+        self.imported = []
+
+    def __call__(self, name: str):
+        self.imported.append(name)
+        return importlib.import_module(name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.parse_args()
+
+    violations = []
+    report = {}
+    with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(io.StringIO()):
+        sys.path.insert(0, root)
+        write_tree(root, "fake_nunchaku_known", {
+            "models/transformers/transformer_qwenimage.py": CLASS_SOURCE,
+        })
+        write_tree(root, "fake_nunchaku_moved", {
+            "broken.py": "raise RuntimeError('needs a GPU')\n",
+            "ops/blocks.py": "class AttentionBlock:\n    pass\n",
+            "ops/qwen_dit.py": CLASS_SOURCE,
+        })
+        write_tree(root, "fake_nunchaku_empty", {"models/flux.py": "class FluxTransformer:\n    pass\n"})
+
+        # Known module path: candidates only, no walk
+        importer = CountingImporter()
+        cls, module = scan_for_transformer("fake_nunchaku_known", importer=importer)
+        report["known_path_imports"] = len(importer.imported)
+        if module != "fake_nunchaku_known.models.transformers.transformer_qwenimage":
+            violations.append(f"known path resolved to {module}")
+        if "fake_nunchaku_known" in importer.imported:
+            violations.append("known path walked the package")
+
+        # Unknown path: found by the walk, past a module that raises
+        importer = CountingImporter()
+        try:
+            cls, module = scan_for_transformer("fake_nunchaku_moved", importer=importer)
+            report["walk_imports"] = len(importer.imported)
+            if (module, cls.__name__) != ("fake_nunchaku_moved.ops.qwen_dit", "NunchakuQwenImageTransformer2DModel"):
+                violations.append(f"walk resolved to {module}.{cls.__name__}")
+        except ImportError as e:
+            violations.append(f"walk did not find the moved class: {e}")
+
+        # No class anywhere
+        try:
+            scan_for_transformer("fake_nunchaku_empty")
+            violations.append("package without the class did not raise")
+        except ImportError:
+            pass
+
+        # Cache: deferred write, single-import hit, version change, stale entry
+        cache_path = os.path.join(root, "volume", "nunchaku_resolver.json")
+        cls, module = resolve_transformer_class("fake_nunchaku_moved", cache_path, version="1.0", save=False)
+        if os.path.exists(cache_path):
+            violations.append("save=False wrote the cache file")
+        if not remember_transformer_class(cache_path, "1.0", module, cls.__name__):
+            violations.append("remember_transformer_class did not write a new entry")
+        if remember_transformer_class(cache_path, "1.0", module, cls.__name__):
+            violations.append("remember_transformer_class rewrote an unchanged entry")
+
+        importer = CountingImporter()
+        resolve_transformer_class("fake_nunchaku_moved", cache_path, version="1.0", importer=importer)
+        report["cached_imports"] = len(importer.imported)
+        if importer.imported != ["fake_nunchaku_moved.ops.qwen_dit"]:
+            violations.append(f"cache hit imported {importer.imported}")
+
+        importer = CountingImporter()
+        resolve_transformer_class("fake_nunchaku_moved", cache_path, version="1.1", importer=importer)
+        if len(importer.imported) <= 1:
+            violations.append("new version did not rescan")
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if set(cached) != {"1.0", "1.1"}:
+            violations.append(f"cache holds versions {sorted(cached)}, expected 1.0 and 1.1")
+
+        # The release moved the class again: the cached module is gone
+        os.remove(os.path.join(root, "fake_nunchaku_moved", "ops", "qwen_dit.py"))
+        write_tree(root, "fake_nunchaku_moved", {"models/transformers/qwen_image.py": CLASS_SOURCE})
+        sys.modules.pop("fake_nunchaku_moved.ops.qwen_dit", None)
+        importlib.invalidate_caches()
+        cls, module = resolve_transformer_class("fake_nunchaku_moved", cache_path, version="1.0")
+        if module != "fake_nunchaku_moved.models.transformers.qwen_image":
+            violations.append(f"stale cache entry resolved to {module}")
+        with open(cache_path) as f:
+            if json.load(f)["1.0"]["module"] != module:
+                violations.append("stale cache entry was not replaced")
+        sys.path.remove(root)
+
+    report.update({"violations": violations[:10], "violation_count": len(violations)})
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
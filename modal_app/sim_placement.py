@@ -0,0 +1,122 @@
+"""
+Simulation: placement plans across VRAM budgets
+
+Feeds `plan_placement` made-up card sizes and free memory for the standard
+(bf16) and Nunchaku (int4) pipelines, with component sizes close to the real
+ones, and checks the chosen mode and resident block count.
+
+Checks, exiting non-zero on failure:
+- each scenario gets the expected mode (gpu / model_offload /
+  nunchaku_block_offload / sequential_offload) and num_blocks_on_gpu
+- the mode changes exactly at the budget boundaries (the whole model, then
+  the largest component, fitting in free VRAM minus headroom)
+- QWEN_PLACEMENT overrides are honoured, block offload without Nunchaku
+  falls back to sequential offload, and unknown modes raise
+- sweeping free VRAM upwards never picks a slower mode or fewer blocks
+
+Usage:
+    python modal_app/sim_placement.py
+    python modal_app/sim_placement.py --headroom-gb 6
+"""
+import argparse
+import json
+import os
+import sys
+
+from qwen_runtime.placement import GiB, PLACEMENT_MODES, plan_placement
+
+# Parameter + buffer bytes per component
+STANDARD = {"transformer": 41 * GiB, "text_encoder": 16 * GiB, "vae": GiB // 4}
+NUNCHAKU = {"transformer": 12 * GiB, "text_encoder": 16 * GiB, "vae": GiB // 4}
+BLOCKS = 60  # Nunchaku transformer: 0.2 GB per block
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--headroom-gb", type=float, default=4.0)
+    args = parser.parse_args()
+    # Plans come from the arguments only
+    os.environ.pop("QWEN_PLACEMENT", None)
+    os.environ.pop("QWEN_VRAM_HEADROOM_GB", None)
+
+    headroom = int(args.headroom_gb * GiB)
+    violations = []
+    results = []
+
+    def plan(total_gb, free_bytes, nunchaku, override=None):
+        return plan_placement(
+            int(total_gb * GiB),
+            int(free_bytes),
+            NUNCHAKU if nunchaku else STANDARD,
+            use_nunchaku=nunchaku,
+            transformer_blocks=BLOCKS if nunchaku else None,
+            headroom_bytes=headroom,
+            override=override,
+        )
+
+    def expect(name, placement, mode, blocks=None):
+        results.append({"scenario": name, "mode": placement.mode, "num_blocks_on_gpu": placement.num_blocks_on_gpu})
+        if placement.mode != mode or placement.num_blocks_on_gpu != blocks:
+            violations.append(
+                f"{name}: got {placement.mode}/{placement.num_blocks_on_gpu}, expected {mode}/{blocks} ({placement.reason})"
+            )
+
+    # Budgets are free VRAM minus headroom; sizes above are in GB
+    def free(budget_gb):
+        return budget_gb * GiB + headroom
+
+    expect("H100 80GB, standard", plan(80, free(74), False), "gpu")
+    expect("48GB, standard", plan(48, free(42), False), "model_offload")
+    expect("A100 40GB, standard", plan(40, free(35), False), "sequential_offload")
+    expect("A100 40GB, nunchaku", plan(40, free(35), True), "gpu")
+    expect("A10G 24GB, nunchaku", plan(24, free(19), True), "model_offload")
+    expect("A10G, 15GB budget, nunchaku", plan(24, free(15), True), "nunchaku_block_offload", BLOCKS)
+    expect("A10G, 10GB budget, nunchaku", plan(24, free(10), True), "nunchaku_block_offload", 50)
+    expect("16GB, 0.5GB budget, nunchaku", plan(16, free(0.5), True), "nunchaku_block_offload", 2)
+    expect("16GB, below headroom, nunchaku", plan(16, free(-1), True), "nunchaku_block_offload", 1)
+
+    # Boundaries: exactly fitting is enough, one byte less is not
+    model = sum(STANDARD.values())
+    largest = max(STANDARD.values())
+    expect("model fits exactly", plan(80, model + headroom, False), "gpu")
+    expect("model one byte over", plan(80, model + headroom - 1, False), "model_offload")
+    expect("largest fits exactly", plan(80, largest + headroom, False), "model_offload")
+    expect("largest one byte over", plan(80, largest + headroom - 1, False), "sequential_offload")
+
+    # Overrides
+    expect("forced model_offload", plan(80, free(74), False, "model_offload"), "model_offload")
+    expect("forced block offload", plan(24, free(10), True, "nunchaku_block_offload"), "nunchaku_block_offload", 50)
+    expect("forced block offload, standard", plan(80, free(74), False, "nunchaku_block_offload"), "sequential_offload")
+    try:
+        plan(80, free(74), False, "cpu")
+        violations.append("unknown override did not raise")
+    except ValueError:
+        pass
+
+    # Monotonic: more free memory never means a slower plan
+    sweep = []
+    for nunchaku in (False, True):
+        previous = None
+        for tenth_gb in range(0, 801, 5):
+            placement = plan(80, tenth_gb / 10 * GiB, nunchaku)
+            current = (-PLACEMENT_MODES.index(placement.mode), placement.num_blocks_on_gpu or 0)
+            if previous is not None and current < previous:
+                violations.append(f"{'nunchaku' if nunchaku else 'standard'}: slower plan at {tenth_gb / 10} GB free")
+            if previous is None or current[0] != previous[0]:
+                sweep.append({"nunchaku": nunchaku, "free_gb": tenth_gb / 10, "mode": placement.mode})
+            previous = current
+
+    report = {
+        "headroom_gb": args.headroom_gb,
+        "scenarios": results,
+        "mode_changes": sweep,
+        "violations": violations[:10],
+        "violation_count": len(violations),
+    }
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Simulation: result cache keys, LRU eviction and backend revisions
+
+Drives `ResultCache` with a `DirectoryStore` in a temp directory and a fake
+volume that counts commits and reloads, the way the GPU container and the
+CPU-side functions share the cache volume.
+
+Checks, exiting non-zero on failure:
+- a job's key is the same across cache instances and encoding dict orders,
+  differs when any keyed field does, and is None without a seed
+- the memory tier never holds more than its byte budget and evicts the least
+  recently used entry first
+- a container publishing a new revision makes old entries miss for new keys,
+  without deleting the entries a container on the old revision still serves
+- entries past the TTL are pruned from every revision's directory
+
+Usage:
+    python modal_app/sim_result_cache.py
+    python modal_app/sim_result_cache.py --entries 200 --memory-kb 64
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import replace
+
+from qwen_runtime.batching import GenerationJob
+from qwen_runtime.result_cache import DirectoryStore, MemoryLRU, ResultCache, backend_revision
+
+
+class FakeVolume:
+    def __init__(self):
+        self.commits = 0
+        self.reloads = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def reload(self):
+        self.reloads += 1
+
+
+def result(i: int, size: int) -> dict:
+    return {"success": True, "image_bytes": bytes([i % 256]) * size, "content_type": "image/png", "metadata": {"i": i}}
+
+
+def job(i: int, **fields) -> GenerationJob:
+    return GenerationJob(prompt=f"design {i}", width=1024, height=1024, seed=i, **fields)
+
+
+def entry_files(root: str) -> int:
+    return sum(name.endswith(".json") for _, _, names in os.walk(root) for name in names if name != "revision.json")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--entries", type=int, default=100)
+    parser.add_argument("--memory-kb", type=int, default=32)
+    parser.add_argument("--entry-kb", type=int, default=4)
+    args = parser.parse_args()
+
+    violations = []
+    old = backend_revision(True, "svdq-int4_r32.safetensors", diffusers="0.35.0", nunchaku="0.3.2")
+    new = backend_revision(True, "svdq-int4_r32.safetensors", diffusers="0.35.0", nunchaku="0.3.3")
+    with tempfile.TemporaryDirectory() as root, contextlib.redirect_stdout(io.StringIO()):
+        volume = FakeVolume()
+
+        def cache(memory_kb=args.memory_kb, ttl_s=3600.0):
+            return ResultCache(MemoryLRU(memory_kb * 1024), DirectoryStore(root, volume=volume), ttl_s=ttl_s)
+
+        # Key stability
+        first, second = cache(), cache()
+        first.publish_revision(old)
+        second.publish_revision(old)
+        encoding = {"format": "webp", "quality": 90}
+        a = first.key_for(job(1, encoding=encoding), "design 1, enhanced")
+        b = second.key_for(job(1, encoding=dict(reversed(list(encoding.items())))), "design 1, enhanced")
+        if a is None or a != b:
+            violations.append(f"same job gave keys {a} and {b}")
+        if not (a or "").startswith(f"{old['id']}/"):
+            violations.append(f"key {a} is not namespaced by revision {old['id']}")
+        variants = {
+            "seed": job(2, encoding=encoding),
+            "size": replace(job(1, encoding=encoding), width=1328),
+            "steps": replace(job(1, encoding=encoding), num_inference_steps=8),
+            "encoding": job(1, encoding={"format": "webp", "quality": 80}),
+            "negative_prompt": replace(job(1, encoding=encoding), negative_prompt="blurry"),
+        }
+        for field, variant in variants.items():
+            if first.key_for(variant, f"{variant.prompt}, enhanced") == a:
+                violations.append(f"changing {field} kept the key")
+        if first.key_for(replace(job(1), seed=None), "design 1, enhanced") is not None:
+            violations.append("an unseeded job got a key")
+        if first.key_for(job(1, encoding=encoding), "design 1, other enhancement") == a:
+            violations.append("changing the enhanced prompt kept the key")
+
+        # LRU eviction in the memory tier
+        gpu = cache()
+        gpu.publish_revision(old)
+        budget = args.memory_kb * 1024
+        keys = []
+        for i in range(args.entries):
+            key = gpu.key_for(job(i), f"design {i}")
+            keys.append(key)
+            gpu.put_result(key, result(i, args.entry_kb * 1024))
+            if i == 2:
+                gpu.lookup(keys[0])  # keys[0] becomes most recently used
+            if gpu.memory.stats()["bytes"] > budget:
+                violations.append(f"memory tier over budget after {i + 1} puts")
+        resident = budget // (args.entry_kb * 1024)
+        if args.entries > resident + 1:
+            if gpu.memory.get(keys[1]) is not None:
+                violations.append("least recently used entry survived eviction")
+            if gpu.memory.get(keys[-1]) is None:
+                violations.append("most recent entry was evicted")
+        evictions = gpu.memory.evictions
+        if evictions != max(0, args.entries - resident):
+            violations.append(f"{evictions} evictions, expected {max(0, args.entries - resident)}")
+        if entry_files(root) != args.entries:
+            violations.append(f"{entry_files(root)} entries on the volume, expected {args.entries}")
+
+        # Revision change: a new container must not prune the old one's entries
+        upgraded = cache()
+        upgraded.publish_revision(new)
+        new_key = upgraded.key_for(job(0), "design 0")
+        if new_key == keys[0]:
+            violations.append("a new revision kept the old key")
+        if upgraded.lookup(new_key) is not None:
+            violations.append("a new revision hit an entry generated by the old one")
+        if upgraded.lookup(keys[-1]) is not None:
+            violations.append("a new-revision container served an old-revision entry")
+        gpu.memory = MemoryLRU(budget)  # the old container's persistent tier only
+        if gpu.lookup(keys[-1]) is None:
+            violations.append("publishing a new revision removed the old revision's entries")
+        cpu = cache()
+        if (cpu.current_revision() or {}).get("id") != new["id"]:
+            violations.append("CPU side does not follow the latest published revision")
+
+        # TTL pruning across revisions
+        upgraded.put_result(new_key, result(0, 1024))
+        expired = cache(ttl_s=0.5)
+        time.sleep(0.6)
+        expired.publish_revision(old)  # revision changes back: prunes expired entries
+        remaining = entry_files(root)
+        if remaining != 0:
+            violations.append(f"{remaining} entries left after the TTL passed")
+        if os.path.isdir(os.path.join(root, old["id"])):
+            violations.append("the emptied revision directory was left behind")
+
+        report = {
+            "entries": args.entries,
+            "memory_budget_bytes": budget,
+            "evictions": evictions,
+            "volume_commits": volume.commits,
+            "volume_reloads": volume.reloads,
+            "revisions": {"old": old["id"], "new": new["id"]},
+        }
+
+    report.update({"violations": violations[:10], "violation_count": len(violations)})
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
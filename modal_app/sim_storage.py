@@ -0,0 +1,168 @@
+"""
+Simulation: direct upload of results to object storage
+
+Runs `store_result` against a local HTTP server standing in for a presigned
+B2 PUT URL and a stub S3 client standing in for boto3, both of which can be
+told to fail.
+
+Checks, exiting non-zero on failure:
+- presigned PUT: the server gets the exact image bytes and Content-Type, and
+  the result carries object_key, size_bytes and sha256 instead of the image
+- put_object: bucket, key layout ({prefix}{user_id}/{job_id}.{ext}), body,
+  content type, cache header and sha256 metadata are what B2 expects
+- base64 results are uploaded as their decoded bytes
+- a rejected PUT, an unreachable URL or a failing client leaves the result
+  unchanged, so the webhook delivers the image inline
+- failed generations are passed through without an upload
+
+Usage:
+    python modal_app/sim_storage.py
+
+Requires httpx (in the Modal image).
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qwen_runtime.storage import store_result, wants_direct_upload
+
+
+class PresignedTarget(BaseHTTPRequestHandler):
+    status = 200
+    received: list = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        type(self).received.append({"path": self.path, "body": body, "content_type": self.headers.get("content-type")})
+        self.send_response(self.status)
+        self.send_header("content-length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubS3:
+    """The part of a boto3 S3 client that upload_image uses."""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.objects = {}
+
+    def put_object(self, **kwargs):
+        if self.fail:
+            raise RuntimeError("SlowDown: please reduce your request rate")
+        self.objects[(kwargs["Bucket"], kwargs["Key"])] = kwargs
+        return {"ETag": hashlib.md5(kwargs["Body"]).hexdigest()}
+
+
+def result(image: bytes, content_type: str = "image/png", as_base64: bool = False) -> dict:
+    out = {"success": True, "content_type": content_type, "metadata": {"seed": 7}}
+    if as_base64:
+        out["image_base64"] = base64.b64encode(image).decode("utf-8")
+    else:
+        out["image_bytes"] = image
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.parse_args()
+    for name in ("TENKAIGEN_DIRECT_UPLOAD", "B2_S3_PREFIX", "B2_S3_BUCKET"):
+        os.environ.pop(name, None)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PresignedTarget)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    image = os.urandom(64 * 1024)
+    sha256 = hashlib.sha256(image).hexdigest()
+    violations = []
+
+    def check_reference(name, stored, key, content_type="image/png"):
+        if "image_bytes" in stored or "image_base64" in stored:
+            violations.append(f"{name}: image still inline")
+        expected = {"object_key": key, "size_bytes": len(image), "sha256": sha256, "content_type": content_type}
+        for field, value in expected.items():
+            if stored.get(field) != value:
+                violations.append(f"{name}: {field} is {stored.get(field)!r}, expected {value!r}")
+        if stored.get("metadata") != {"seed": 7}:
+            violations.append(f"{name}: lost the result metadata")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Presigned PUT
+        url = f"{base_url}/bucket/ai-generated/u1/job-1.png?X-Amz-Signature=abc"
+        stored = store_result("job-1", result(image), upload_url=url, object_key="ai-generated/u1/job-1.png")
+        check_reference("presigned", stored, "ai-generated/u1/job-1.png")
+        put = PresignedTarget.received[-1] if PresignedTarget.received else {}
+        if put.get("body") != image:
+            violations.append("presigned: server received different bytes")
+        if put.get("content_type") != "image/png":
+            violations.append(f"presigned: Content-Type {put.get('content_type')!r}")
+        if put.get("path") != "/bucket/ai-generated/u1/job-1.png?X-Amz-Signature=abc":
+            violations.append(f"presigned: PUT went to {put.get('path')}")
+
+        # put_object with credentials from the environment
+        client = StubS3()
+        stored = store_result("job-2", result(image, "image/webp", as_base64=True), user_id="u2", client=client)
+        check_reference("put_object", stored, "ai-generated/u2/job-2.webp", "image/webp")
+        obj = client.objects.get(("dev-test-tenkaigen", "ai-generated/u2/job-2.webp"), {})
+        if obj.get("Body") != image:
+            violations.append("put_object: stored body differs from the decoded image")
+        if obj.get("ContentType") != "image/webp" or obj.get("Metadata") != {"sha256": sha256}:
+            violations.append(f"put_object: headers {obj.get('ContentType')!r} {obj.get('Metadata')!r}")
+        if "max-age" not in obj.get("CacheControl", ""):
+            violations.append("put_object: no long-lived Cache-Control")
+        os.environ.update(B2_S3_BUCKET="prod-tenkaigen", B2_S3_PREFIX="designs/")
+        store_result("job-3", result(image), client=client)
+        if ("prod-tenkaigen", "designs/modal/job-3.png") not in client.objects:
+            violations.append(f"put_object: env bucket/prefix ignored, stored {sorted(client.objects)}")
+        os.environ.pop("B2_S3_BUCKET")
+        os.environ.pop("B2_S3_PREFIX")
+
+        # Failures fall back to inline delivery
+        original = result(image)
+        for name, kwargs in {
+            "rejected PUT": {"upload_url": f"{base_url}/expired"},
+            "unreachable URL": {"upload_url": "http://127.0.0.1:9/unreachable"},
+            "failing client": {"client": StubS3(fail=True)},
+        }.items():
+            PresignedTarget.status = 403 if name == "rejected PUT" else 200
+            stored = store_result("job-4", original, **kwargs)
+            if stored is not original or stored.get("image_bytes") != image:
+                violations.append(f"{name}: result was not left for inline delivery")
+        PresignedTarget.status = 200
+
+        # Failed generations are not uploaded
+        uploads = len(PresignedTarget.received)
+        failed = {"success": False, "error": "CUDA out of memory"}
+        if store_result("job-5", failed, upload_url=f"{base_url}/x") is not failed or len(PresignedTarget.received) != uploads:
+            violations.append("a failed result was uploaded or changed")
+
+    if wants_direct_upload(None) or not wants_direct_upload("https://example/put"):
+        violations.append("wants_direct_upload ignores the upload_url / default-off contract")
+    os.environ["TENKAIGEN_DIRECT_UPLOAD"] = "1"
+    if not wants_direct_upload(None):
+        violations.append("TENKAIGEN_DIRECT_UPLOAD=1 did not enable direct upload")
+    os.environ.pop("TENKAIGEN_DIRECT_UPLOAD")
+    server.shutdown()
+
+    report = {
+        "image_bytes": len(image),
+        "presigned_puts": len(PresignedTarget.received),
+        "violations": violations[:10],
+        "violation_count": len(violations),
+    }
+    print(json.dumps(report, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()